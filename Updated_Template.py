@@ -8,6 +8,7 @@ import math
 import time
 from datetime import datetime
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.linear_model import LinearRegression
 from streamlit_extras.stylable_container import stylable_container
 import warnings
@@ -15,21 +16,43 @@ import traceback
 import logging
 import sys
 import io
+import glob
+import csv
+import re
+import hashlib
+import hmac
+import sqlite3
+import zlib
+import multiprocessing
+import tempfile
+import shutil
+from contextlib import contextmanager
 from io import BytesIO
+import xlsxwriter
+from xlsxwriter.utility import xl_col_to_name
 import streamlit as st
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.errors import HttpError
 import gspread
 from google.oauth2.service_account import Credentials
-from collections import defaultdict
-from typing import Dict, List, Tuple, Set, Optional
+from collections import defaultdict, OrderedDict, deque
+from collections.abc import Mapping
+from types import MappingProxyType
+from dataclasses import dataclass, field
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple, Set, Optional, ClassVar
 # NEW: API-related imports
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from typing import Optional, List, Dict, Any
 import uuid
+import urllib.request
+import asyncio
 import threading
 
 warnings.filterwarnings('ignore')
@@ -48,6 +71,297 @@ try:
 except ImportError:
     GOOGLE_SHEETS_AVAILABLE = False
 
+# ==============================================================================
+# HISTORICAL SALES STORE (PARQUET)
+# ==============================================================================
+# Monthly sales history kept as Parquet files partitioned by channel and month.
+# The CSV base is imported once (and again only when the CSV changes) and the
+# weekly-derived months are upserted into their partitions, so every run reads
+# one typed, memory-mapped table instead of re-parsing and re-sorting history.
+# ==============================================================================
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+HISTORY_STORE_DIR = os.path.join(BASE_DIR, "history_store")
+
+_LOCAL_FILE_LOCKS = {}
+_LOCAL_FILE_LOCKS_GUARD = threading.Lock()
+
+
+@contextmanager
+def _file_lock(path, shared=False):
+    """
+    Hold an flock on `path` (created if missing) for the block: exclusive for
+    writers, shared for readers, across every process on the host. Without
+    fcntl (Windows) only the threads of this process are serialized.
+    """
+    if fcntl is None:
+        with _LOCAL_FILE_LOCKS_GUARD:
+            lock = _LOCAL_FILE_LOCKS.setdefault(os.path.abspath(path), threading.Lock())
+        with lock:
+            yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class HistoricalSalesStore:
+    """
+    Parquet store for the consolidated monthly sales history.
+
+    Layout: <root>/channel=<Channel>/month=<YYYY-MM>/<origin>.parquet where origin
+    is 'base' (rows imported from historical_sales.csv) or 'weekly' (months derived
+    from the weekly sales sheets). Upserting a weekly month replaces only that
+    partition's weekly file, so base rows are never rewritten.
+
+    Writers hold an exclusive file lock on <root>/_lock and load() a shared
+    one, so processes sharing the store never read a half-rebuilt tree.
+    """
+
+    COLUMNS = ['SKU', 'Channel', 'Date', 'Sales']
+    MANIFEST_FILE = "_manifest.json"
+    LOCK_FILE = "_lock"
+    # Bump when the base import changes so existing stores are rebuilt
+    FORMAT_VERSION = 2
+
+    def __init__(self, root_dir=HISTORY_STORE_DIR):
+        if not PARQUET_AVAILABLE:
+            raise ImportError("pyarrow is required for the Parquet history store")
+
+        self.root_dir = root_dir
+        self.manifest_path = os.path.join(root_dir, self.MANIFEST_FILE)
+        self.lock_path = os.path.join(root_dir, self.LOCK_FILE)
+        os.makedirs(root_dir, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    @property
+    def base_cutoff(self):
+        """Latest date of the CSV base; weekly months are only accepted after it."""
+        cutoff = self.manifest.get('base_cutoff')
+        return pd.Timestamp(cutoff) if cutoff else None
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️ Could not read history store manifest, rebuilding: {e}")
+            return {}
+
+    def _write_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _locked(self, shared=False):
+        return _file_lock(self.lock_path, shared=shared)
+
+    def _partition_files(self, origin=None):
+        pattern = f"{origin}.parquet" if origin else "*.parquet"
+        return sorted(glob.glob(os.path.join(self.root_dir, "channel=*", "month=*", pattern)))
+
+    @staticmethod
+    def _normalize(df):
+        """Coerce a SKU/Channel/Date/Sales frame to the store's typed schema."""
+        df = df[HistoricalSalesStore.COLUMNS].copy()
+        df['SKU'] = df['SKU'].astype(str).str.strip()
+        if not pd.api.types.is_datetime64_any_dtype(df['Date']):
+            df['Date'] = pd.to_datetime(df['Date'], format='%m/%d/%Y', errors='coerce')
+        df = df.dropna(subset=['Date'])
+        df['Date'] = df['Date'].astype('datetime64[ns]')
+        df['Channel'] = df['Channel'].astype(str).str.strip().str.title()
+        df['Sales'] = pd.to_numeric(df['Sales'], errors='coerce').fillna(0).astype('float64')
+        df['SKU'] = df['SKU'].astype('category')
+        df['Channel'] = df['Channel'].astype('category')
+        return df
+
+    def _write_partitions(self, df, origin, root_dir=None):
+        """Write one file per (channel, month) group under root_dir, atomically replacing existing ones."""
+        written = 0
+        months = df['Date'].dt.strftime('%Y-%m')
+        for (channel, month), part in df.groupby([df['Channel'].astype(str), months], sort=False, observed=True):
+            part_dir = os.path.join(root_dir or self.root_dir, f"channel={channel}", f"month={month}")
+            os.makedirs(part_dir, exist_ok=True)
+            part = part.copy()
+            part['SKU'] = part['SKU'].cat.remove_unused_categories()
+            part['Channel'] = part['Channel'].cat.remove_unused_categories()
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            final_path = os.path.join(part_dir, f"{origin}.parquet")
+            fd, tmp_path = tempfile.mkstemp(dir=part_dir, suffix=".tmp")
+            os.close(fd)
+            try:
+                pq.write_table(table, tmp_path, compression='snappy')
+                os.replace(tmp_path, final_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            written += 1
+        return written
+
+    def _swap_in(self, staging_dir):
+        """Replace the store's channel directories with staging_dir's. Caller holds the write lock."""
+        # Until the new manifest is written the tree doesn't match it; a crash here forces a rebuild
+        self.manifest = {}
+        self._write_manifest()
+        retired_dir = tempfile.mkdtemp(prefix=".retired-", dir=self.root_dir)
+        for path in glob.glob(os.path.join(self.root_dir, "channel=*")):
+            os.replace(path, os.path.join(retired_dir, os.path.basename(path)))
+        for path in glob.glob(os.path.join(staging_dir, "channel=*")):
+            os.replace(path, os.path.join(self.root_dir, os.path.basename(path)))
+        shutil.rmtree(retired_dir, ignore_errors=True)
+
+    def sync_base_from_csv(self, csv_path):
+        """
+        Import historical_sales.csv as the base history. Skipped when the CSV is
+        unchanged since the last import; a changed CSV rebuilds the whole store.
+        """
+        stat = os.stat(csv_path)
+        fingerprint = {
+            'path': os.path.abspath(csv_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'format_version': self.FORMAT_VERSION,
+        }
+
+        with self._locked():
+            self.manifest = self._read_manifest()
+            if self.manifest.get('base_source') == fingerprint and self._partition_files('base'):
+                print(f"✅ History store up to date with {os.path.basename(csv_path)}")
+                return False
+
+            print(f"🔄 Importing {os.path.basename(csv_path)} into Parquet history store...")
+            base_df = self._normalize(pd.read_csv(csv_path, sep=',', dtype={'SKU': str}, encoding='utf-8'))
+            # The CSV repeats some SKU/Channel/Date rows; keep the last one as the old merge did
+            base_df = base_df.drop_duplicates(subset=['SKU', 'Channel', 'Date'], keep='last')
+
+            # Leftovers of a rebuild that died; nobody else can be rebuilding while we hold the lock
+            for path in glob.glob(os.path.join(self.root_dir, ".staging-*")) + \
+                    glob.glob(os.path.join(self.root_dir, ".retired-*")):
+                shutil.rmtree(path, ignore_errors=True)
+
+            # The weekly months depend on the base cutoff, so the rebuilt store starts clean
+            staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=self.root_dir)
+            try:
+                partitions = self._write_partitions(base_df, 'base', staging_dir)
+                self._swap_in(staging_dir)
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            self.manifest = {
+                'base_source': fingerprint,
+                'base_cutoff': base_df['Date'].max().strftime('%Y-%m-%d') if not base_df.empty else None,
+                'base_rows': int(len(base_df)),
+                'updated_at': datetime.now().isoformat(timespec='seconds'),
+            }
+            self._write_manifest()
+
+            print(f"✅ Imported {len(base_df)} base records into {partitions} partitions")
+            return True
+
+    def upsert_weekly_months(self, monthly_df):
+        """
+        Upsert weekly-derived monthly sales (SKU, Channel, Date, Sales). Only months
+        after the base cutoff are kept, matching the old extend_* behaviour, and each
+        (channel, month) partition present in the input replaces the stored one.
+        """
+        if monthly_df is None or monthly_df.empty:
+            print("No weekly months to upsert into history store")
+            return 0
+
+        new_df = self._normalize(monthly_df)
+        with self._locked():
+            self.manifest = self._read_manifest()
+            cutoff = self.base_cutoff
+            if cutoff is not None:
+                new_df = new_df[new_df['Date'] > cutoff]
+
+            if new_df.empty:
+                print("No weekly months after historical cutoff")
+                return 0
+
+            partitions = self._write_partitions(new_df, 'weekly')
+            self.manifest['updated_at'] = datetime.now().isoformat(timespec='seconds')
+            self._write_manifest()
+
+        print(f"✅ Upserted {len(new_df)} weekly-derived records into {partitions} partitions")
+        return len(new_df)
+
+    def load(self):
+        """Read the consolidated history as one typed DataFrame sorted by SKU, Channel, Date."""
+        with self._locked(shared=True):
+            files = self._partition_files()
+            if not files:
+                return pd.DataFrame({
+                    'SKU': pd.Categorical([]),
+                    'Channel': pd.Categorical([]),
+                    'Date': pd.Series([], dtype='datetime64[ns]'),
+                    'Sales': pd.Series([], dtype='float64'),
+                })
+
+            table = pa.concat_tables([pq.read_table(path, memory_map=True) for path in files])
+            df = table.to_pandas()
+
+        for col in ('SKU', 'Channel'):
+            df[col] = df[col].astype(str).astype('category')
+
+        return df.sort_values(['SKU', 'Channel', 'Date'], ignore_index=True)
+
+
+class InventoryIndex(Mapping):
+    """
+    Read-only SKU -> inventory quantity mapping keyed by one canonical UPC per
+    product (alphanumerics only, leading zeros stripped). Lookups normalize the
+    requested SKU the same way, so the raw, zero-stripped, zero-padded and
+    punctuation-free spellings the old variant dict stored all still resolve.
+    """
+
+    def __init__(self, frame):
+        # frame: one row per sheet row with SKU, Canonical_SKU, Inventory (last row wins)
+        self.frame = frame
+        self._index = dict(zip(frame['Canonical_SKU'].tolist(), frame['Inventory'].tolist()))
+
+    @staticmethod
+    def canonical_sku(sku):
+        alphanumeric_only = ''.join(c for c in str(sku).strip() if c.isalnum())
+        return alphanumeric_only.lstrip('0') or alphanumeric_only
+
+    @staticmethod
+    def canonical_sku_series(skus):
+        """Vectorized canonical_sku() for a Series of SKU strings."""
+        alphanumeric_only = skus.astype(str).str.strip().str.replace(r'[\W_]', '', regex=True)
+        stripped = alphanumeric_only.str.lstrip('0')
+        return stripped.where(stripped != '', alphanumeric_only)
+
+    def __getitem__(self, sku):
+        return self._index[self.canonical_sku(sku)]
+
+    def __contains__(self, sku):
+        return self.canonical_sku(sku) in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
 class GoogleSheetsConnector:
     def __init__(self, credentials_file='credentials.json'):
         if not GOOGLE_SHEETS_AVAILABLE:
@@ -166,163 +480,108 @@ class GoogleSheetsConnector:
         """
         Extract inventory data from Google Sheets
         Column C: SKU
-        Column R: Inventory total
-        Searches through Teas, Capsules, and Liquids worksheets
+        Column T: Inventory total
+        Searches through Teas, Capsules, and Liquids worksheets and returns an
+        InventoryIndex keyed by canonical UPC.
         """
         try:
             print("📦 Extracting inventory data from Google Sheets...")
             spreadsheet = self.gc.open_by_url(spreadsheet_url)
-            
+
             # Get all available worksheets first for debugging
             all_worksheets = spreadsheet.worksheets()
-            print(f"📋 Available worksheets:")
-            for ws in all_worksheets:
-                print(f"   - '{ws.title}'")
-            
+            print(f"📋 Available worksheets: {[ws.title for ws in all_worksheets]}")
+
             # Define worksheets to search through
             worksheet_names = ['Teas', 'Capsules', 'Liquids']
-            
-            # Find column indices (C = index 2, R = index 17)
+
             sku_col = 2  # Column C (0-based indexing)
-            inventory_col = 19  # Column R (0-based indexing)
-            
-            print(f"🔍 Looking for SKUs in column {chr(67)} (index {sku_col})")
-            print(f"🔍 Looking for inventory in column {chr(82)} (index {inventory_col})")
-            
-            inventory_data = {}
-            skus_processed = 0
-            
-            # Iterate through each worksheet
+            inventory_col = 19  # Column T (0-based indexing)
+
+            frames = []
+
             for worksheet_name in worksheet_names:
                 try:
                     print(f"\n🔍 Searching in worksheet: {worksheet_name}")
-                    
-                    # Try to find worksheet by name (case-insensitive partial match)
-                    worksheet = None
-                    
-                    for ws in all_worksheets:
-                        if worksheet_name.lower() in ws.title.lower():
-                            worksheet = ws
-                            break
-                    
+
+                    # Case-insensitive partial match on the tab title
+                    worksheet = next((ws for ws in all_worksheets if worksheet_name.lower() in ws.title.lower()), None)
                     if not worksheet:
                         print(f"   ⚠️ Worksheet containing '{worksheet_name}' not found, skipping...")
                         continue
-                    
-                    print(f"   📄 Found worksheet: '{worksheet.title}'")
-                    
-                    # Get all values from current worksheet
+
                     all_values = worksheet.get_all_values()
-                    
                     if not all_values:
                         print(f"   ❌ No data found in {worksheet.title}")
                         continue
-                    
-                    # Debug: Show header row to verify column positions
-                    if len(all_values) > 0:
-                        header_row = all_values[0]
-                        print(f"   📊 Header row length: {len(header_row)} columns")
-                        if len(header_row) > sku_col:
-                            print(f"   📊 Column C header: '{header_row[sku_col]}'")
-                        if len(header_row) > inventory_col:
-                            print(f"   📊 Column R header: '{header_row[inventory_col]}'")
-                        else:
-                            print(f"   ⚠️ Column R (index {inventory_col}) not found! Sheet only has {len(header_row)} columns")
-                            continue
-                    
-                    worksheet_skus_processed = 0
-                    debug_count = 0
-                    
-                    # Process data rows (assuming row 1 is header)
-                    for row_idx, row in enumerate(all_values[1:], start=2):
-                        try:
-                            # Ensure row has enough columns
-                            if len(row) <= max(sku_col, inventory_col):
-                                continue
-                            
-                            # Extract SKU from column C
-                            raw_sku = str(row[sku_col]).strip()
-                            if not raw_sku or raw_sku.lower() in ['', 'none', 'null', 'n/a']:
-                                continue
-                            
-                            # Extract inventory quantity from column R
-                            inventory_value = row[inventory_col] if inventory_col < len(row) else '0'
-                            
-                            # Debug: Show first few entries
-                            if debug_count < 3:
-                                print(f"   🔍 Row {row_idx}: SKU='{raw_sku}', Inventory='{inventory_value}'")
-                                debug_count += 1
-                            
-                            try:
-                                # Clean the inventory value more thoroughly
-                                inventory_str = str(inventory_value).replace(',', '').replace('$', '').strip()
-                                
-                                # Handle empty or non-numeric values
-                                if not inventory_str or inventory_str.lower() in ['', 'none', 'null', 'n/a', '-']:
-                                    inventory_qty = 0
-                                else:
-                                    inventory_qty = float(inventory_str)
-                                    if inventory_qty < 0:
-                                        inventory_qty = 0
-                            except ValueError:
-                                print(f"   ⚠️ Could not parse inventory value '{inventory_value}' for SKU '{raw_sku}' at row {row_idx}")
-                                inventory_qty = 0
-                            
-                            # Clean SKU - multiple formats
-                            cleaned_skus = []
-                            
-                            # Original format
-                            cleaned_skus.append(raw_sku)
-                            
-                            # Remove leading zeros
-                            if raw_sku.lstrip('0'):  # Only add if not all zeros
-                                cleaned_skus.append(raw_sku.lstrip('0'))
-                            
-                            # Add leading zeros if short UPC
-                            if raw_sku.isdigit() and len(raw_sku) < 12:
-                                cleaned_skus.append(raw_sku.zfill(12))
-                            
-                            # Remove non-alphanumeric
-                            alphanumeric_only = ''.join(c for c in raw_sku if c.isalnum())
-                            if alphanumeric_only and alphanumeric_only != raw_sku:
-                                cleaned_skus.append(alphanumeric_only)
-                            
-                            # Store all SKU variations with the same inventory value
-                            # BUT check for duplicates and warn if inventory values differ
-                            for sku_variant in cleaned_skus:
-                                if sku_variant:
-                                    if sku_variant in inventory_data:
-                                        if inventory_data[sku_variant] != inventory_qty:
-                                            print(f"   ⚠️ SKU '{sku_variant}' found multiple times with different inventory: {inventory_data[sku_variant]} vs {inventory_qty}")
-                                    inventory_data[sku_variant] = inventory_qty
-                                    
-                            worksheet_skus_processed += 1
-                            
-                        except Exception as e:
-                            print(f"   ❌ Error processing row {row_idx} in {worksheet.title}: {e}")
-                            continue
-                    
-                    print(f"   ✅ Processed {worksheet_skus_processed} SKUs from {worksheet.title}")
-                    skus_processed += worksheet_skus_processed
-                    
+
+                    header_row = all_values[0]
+                    if len(header_row) <= inventory_col:
+                        print(f"   ⚠️ Column T (index {inventory_col}) not found! Sheet only has {len(header_row)} columns")
+                        continue
+                    print(f"   📄 '{worksheet.title}': SKU column '{header_row[sku_col]}', inventory column '{header_row[inventory_col]}'")
+
+                    matrix = self._values_to_matrix(all_values[1:], len(header_row))
+                    sheet_df = pd.DataFrame({
+                        'Worksheet': worksheet.title,
+                        'Row': np.arange(2, len(matrix) + 2),
+                        'SKU': np.char.strip(matrix[:, sku_col]),
+                        'Raw_Inventory': matrix[:, inventory_col],
+                    })
+                    sheet_df = sheet_df[
+                        (sheet_df['SKU'] != '') & ~sheet_df['SKU'].str.lower().isin(['none', 'null', 'n/a'])
+                    ]
+
+                    print(f"   ✅ Processed {len(sheet_df)} SKUs from {worksheet.title}")
+                    frames.append(sheet_df)
+
                 except Exception as e:
                     print(f"   ❌ Error processing worksheet '{worksheet_name}': {e}")
                     import traceback
                     traceback.print_exc()
                     continue
-            
-            print(f"\n✅ Extracted inventory for {skus_processed} SKUs across all worksheets")
-            print(f"   Total inventory records (including variants): {len(inventory_data)}")
-            
-            # Show sample data with more details
-            if inventory_data:
-                print(f"\n🔍 SAMPLE INVENTORY DATA:")
-                sample_items = list(inventory_data.items())[:10]  # Show more samples
-                for sku, qty in sample_items:
-                    print(f"   SKU: '{sku}' -> Inventory: {qty}")
-            
-            return inventory_data
-            
+
+            if not frames:
+                print("\n⚠️ No inventory rows found in any worksheet")
+                return InventoryIndex(pd.DataFrame(columns=['Worksheet', 'Row', 'SKU', 'Inventory', 'Canonical_SKU']))
+
+            inventory_df = pd.concat(frames, ignore_index=True)
+
+            # Quantities: strip ',' and '$'; blanks/placeholders are 0, negatives clamp to 0
+            inventory_str = inventory_df['Raw_Inventory'].str.replace(',', '').str.replace('$', '').str.strip()
+            placeholder = inventory_str.str.lower().isin(['', 'none', 'null', 'n/a', '-'])
+            quantities = pd.to_numeric(inventory_str.where(~placeholder), errors='coerce')
+
+            unparsable = quantities.isna() & ~placeholder
+            if unparsable.any():
+                examples = inventory_df.loc[unparsable, ['SKU', 'Raw_Inventory']].head(5).values.tolist()
+                print(f"   ⚠️ Could not parse {int(unparsable.sum())} inventory values, using 0 (e.g. {examples})")
+
+            inventory_df['Inventory'] = quantities.fillna(0).clip(lower=0).astype(float)
+            inventory_df['Canonical_SKU'] = InventoryIndex.canonical_sku_series(inventory_df['SKU'])
+            inventory_df = inventory_df.drop(columns=['Raw_Inventory'])
+
+            # Conflicting duplicates in one pass: same canonical UPC with different quantities
+            quantity_counts = inventory_df.groupby('Canonical_SKU')['Inventory'].nunique()
+            conflicts = quantity_counts[quantity_counts > 1]
+            if not conflicts.empty:
+                print(f"   ⚠️ {len(conflicts)} SKUs found multiple times with different inventory (last value wins):")
+                conflict_rows = inventory_df[inventory_df['Canonical_SKU'].isin(conflicts.index[:10])]
+                for canonical, rows in conflict_rows.groupby('Canonical_SKU', sort=False):
+                    details = ', '.join(f"{ws} row {row}: {qty}" for ws, row, qty in rows[['Worksheet', 'Row', 'Inventory']].values)
+                    print(f"      {canonical}: {details}")
+
+            inventory_index = InventoryIndex(inventory_df)
+
+            print(f"\n✅ Extracted inventory for {len(inventory_df)} SKU rows across all worksheets")
+            print(f"   Unique canonical SKUs: {len(inventory_index)}")
+
+            print(f"\n🔍 SAMPLE INVENTORY DATA:")
+            for sku, qty in inventory_df[['SKU', 'Inventory']].head(10).values:
+                print(f"   SKU: '{sku}' -> Inventory: {qty}")
+
+            return inventory_index
+
         except Exception as e:
             print(f"❌ Error extracting inventory data: {e}")
             import traceback
@@ -510,1017 +769,336 @@ class GoogleSheetsConnector:
             traceback.print_exc()
             return {}, {}, {}, {}, {}
 
-    def get_amazon_fba_weekly_sales(self, spreadsheet_url):
-        try:
-            print("📦 Extracting Amazon FBA weekly sales data...")
-            spreadsheet = self.gc.open_by_url(spreadsheet_url)
-            worksheet = spreadsheet.worksheet("Amazon FBA")
-
-            all_values = worksheet.get_all_values()
-            if not all_values:
-                print("❌ No data found.")
-                return pd.DataFrame()
-
-            headers = all_values[0]
-            print(f"🧾 Headers: {headers}")
-
-            sku_col = None
-            week_columns = []
+    # Weekly sales tabs in WEEKLY_SALES_URL: (worksheet name, channel label used in history)
+    WEEKLY_SALES_CHANNELS = [
+        ("Amazon FBA", "Amazon"),
+        ("Shopify Main", "Shopify"),
+        ("Shopify Faire", "Shopify Faire"),
+        ("Walmart FBM", "Walmartfbm"),
+        ("Amazon FBM", "Amazonfbm"),
+    ]
 
-            # Identify columns
-            for i, header in enumerate(headers):
-                header_clean = str(header).strip().lower()
+    WEEKLY_SALES_COLUMNS = ['SKU', 'Original_SKU', 'Week_Start', 'Sales', 'Channel']
 
-                if 'upc' in header_clean:
-                    sku_col = i
-                    print(f"✅ Found UPC column at index {i}: {header}")
-                    continue
+    # 'week_start': whole week goes to the month of its Week_Start (original behaviour)
+    # 'proportional': week split across the months it touches by number of days
+    WEEK_ALLOCATION_MODES = ('week_start', 'proportional')
 
-                # Try to parse as date
-                try:
-                    week_date = pd.to_datetime(header, dayfirst=False)  # mm/dd/yyyy format
-                    week_columns.append((i, week_date))
-                    print(f"📅 Week column at index {i}: {week_date.strftime('%d/%m/%Y')}")
-                except:
-                    # Print once for debugging
-                    if i >= 4:  # Avoid clutter for known non-date columns
-                        print(f"⛔ Skipping non-date column: {header}")
-                    continue
+    @staticmethod
+    def _values_to_matrix(rows, width):
+        """Pad/trim the ragged rows returned by the Sheets API into one 2-D string array."""
+        if not rows or width == 0:
+            return np.empty((0, width), dtype=str)
+        frame = pd.DataFrame(rows).reindex(columns=range(width)).fillna('')
+        return frame.to_numpy(dtype=object).astype(str)
 
-            if sku_col is None or not week_columns:
-                print("❌ Could not identify necessary columns.")
-                return pd.DataFrame()
+    def parse_weekly_sales_values(self, all_values, channel, label=None):
+        """
+        Turn a weekly sales tab (header row + one row per UPC, one column per week)
+        into long-format weekly records. The whole tab is handled as one NumPy array:
+        date headers, numeric coercion and the melt to SKU/week rows are vectorized.
+        """
+        label = label or channel
+
+        if not all_values:
+            print(f"❌ No data found in {label} tab.")
+            return pd.DataFrame(columns=self.WEEKLY_SALES_COLUMNS)
+
+        headers = np.array([str(h) for h in all_values[0]], dtype=str)
+        header_clean = np.char.lower(np.char.strip(headers))
+
+        # Last header containing 'upc' is the SKU column; every other header that parses as a date is a week
+        upc_cols = np.flatnonzero(np.char.find(header_clean, 'upc') >= 0)
+        week_dates = pd.to_datetime(pd.Series(headers), errors='coerce', format='mixed')
+        is_week = week_dates.notna().to_numpy(copy=True)
+        is_week[upc_cols] = False
+        week_cols = np.flatnonzero(is_week)
+
+        if len(upc_cols) == 0 or len(week_cols) == 0:
+            print(f"❌ Could not identify UPC/week columns in {label} tab.")
+            return pd.DataFrame(columns=self.WEEKLY_SALES_COLUMNS)
+
+        sku_col = upc_cols[-1]
+        print(f"✅ {label}: UPC column '{headers[sku_col]}' | {len(week_cols)} week columns "
+              f"({week_dates[week_cols[0]].strftime('%d/%m/%Y')} → {week_dates[week_cols[-1]].strftime('%d/%m/%Y')})")
+
+        matrix = self._values_to_matrix(all_values[1:], len(headers))
+
+        # SKU cleaning: skip blanks/placeholders, zero-pad short numeric UPCs to 12 digits
+        raw_skus = np.char.strip(matrix[:, sku_col])
+        valid_rows = (raw_skus != '') & ~np.isin(np.char.lower(raw_skus), ['none', 'null', 'n/a'])
+        raw_skus = raw_skus[valid_rows]
+        pad = np.char.isdigit(raw_skus) & (np.char.str_len(raw_skus) < 12)
+        cleaned_skus = np.where(pad, np.char.zfill(raw_skus, 12), raw_skus)
+
+        # Numeric coercion: '', '-', 'n/a' and anything unparsable count as 0
+        cells = np.char.strip(matrix[valid_rows][:, week_cols])
+        sales = pd.to_numeric(pd.Series(cells.ravel()), errors='coerce').fillna(0).to_numpy(dtype=float)
+        sales = sales.reshape(cells.shape)
+
+        # Melt to long format, keeping only positive weeks (row-major, same order as the sheet)
+        row_idx, week_idx = np.nonzero(sales > 0)
+        weekly_df = pd.DataFrame({
+            'SKU': cleaned_skus[row_idx],
+            'Original_SKU': raw_skus[row_idx],
+            'Week_Start': week_dates.to_numpy()[week_cols][week_idx],
+            'Sales': sales[row_idx, week_idx],
+            'Channel': channel,
+        })
 
-            # Parse each row
-            weekly_sales_data = []
-            processed_skus = set()
+        if weekly_df.empty:
+            print(f"⚠️ No valid weekly sales found in {label} tab.")
+        else:
+            print(f"✅ {label}: {len(weekly_df)} records extracted | {weekly_df['SKU'].nunique()} SKUs")
 
-            for row_idx, row in enumerate(all_values[1:], start=2):
-                try:
-                    if len(row) <= sku_col:
-                        continue
+        return weekly_df
 
-                    raw_sku = str(row[sku_col]).strip()
-                    if not raw_sku or raw_sku.lower() in ['none', 'null', 'n/a', '']:
-                        continue
+    def get_weekly_sales(self, spreadsheet_url, worksheet_name, channel):
+        """Extract one channel's weekly sales tab."""
+        try:
+            print(f"📦 Extracting {worksheet_name} weekly sales data...")
+            spreadsheet = self.gc.open_by_url(spreadsheet_url)
+            worksheet = spreadsheet.worksheet(worksheet_name)
+            return self.parse_weekly_sales_values(worksheet.get_all_values(), channel, worksheet_name)
 
-                    # Clean SKU
-                    cleaned_sku = raw_sku.zfill(12) if raw_sku.isdigit() and len(raw_sku) < 12 else raw_sku
-                    processed_skus.add(cleaned_sku)
+        except Exception as e:
+            print(f"❌ Fatal error during {worksheet_name} extraction: {e}")
+            import traceback
+            traceback.print_exc()
+            return pd.DataFrame()
 
-                    for col_idx, week_date in week_columns:
-                        if col_idx >= len(row):
-                            continue
-                        try:
-                            sales = float(row[col_idx]) if row[col_idx].strip() not in ['', '-', 'n/a', 'N/A'] else 0
-                        except:
-                            sales = 0
-
-                        if sales > 0:
-                            weekly_sales_data.append({
-                                'SKU': cleaned_sku,
-                                'Original_SKU': raw_sku,
-                                'Week_Start': week_date,
-                                'Sales': sales,
-                                'Channel': 'Amazon'
-                            })
+    def get_all_weekly_sales(self, spreadsheet_url, channels=None):
+        """
+        Extract every weekly channel tab into one long-format frame. All tabs are
+        fetched with a single batch read; if that fails (e.g. a tab was renamed)
+        each tab is read on its own so one bad tab doesn't drop the others.
+        """
+        channels = channels or self.WEEKLY_SALES_CHANNELS
 
-                except Exception as e:
-                    print(f"⚠️ Error at row {row_idx}: {e}")
-                    continue
+        try:
+            print(f"📦 Extracting weekly sales data for {len(channels)} channels...")
+            spreadsheet = self.gc.open_by_url(spreadsheet_url)
 
-            # Convert to DataFrame
-            weekly_df = pd.DataFrame(weekly_sales_data)
+            try:
+                response = spreadsheet.values_batch_get([f"'{name}'" for name, _ in channels])
+                tab_values = [value_range.get('values', []) for value_range in response.get('valueRanges', [])]
+            except Exception as e:
+                print(f"⚠️ Batch read failed ({e}), reading weekly tabs one by one...")
+                tab_values = []
+                for name, _ in channels:
+                    try:
+                        tab_values.append(spreadsheet.worksheet(name).get_all_values())
+                    except Exception as tab_error:
+                        print(f"❌ Could not read {name} tab: {tab_error}")
+                        tab_values.append([])
+
+            frames = []
+            for (name, channel), values in zip(channels, tab_values):
+                channel_df = self.parse_weekly_sales_values(values, channel, name)
+                if channel_df.empty:
+                    print(f"⚠️ No {name} weekly sales data found")
+                else:
+                    frames.append(channel_df)
 
-            if weekly_df.empty:
-                print("⚠️ No valid weekly sales found.")
-            else:
-                print(f"✅ {len(weekly_df)} records extracted | {weekly_df['SKU'].nunique()} SKUs")
-                print(f"   Range: {weekly_df['Week_Start'].min().strftime('%d/%m/%Y')} → {weekly_df['Week_Start'].max().strftime('%d/%m/%Y')}")
+            if not frames:
+                return pd.DataFrame(columns=self.WEEKLY_SALES_COLUMNS)
 
+            weekly_df = pd.concat(frames, ignore_index=True)
+            print(f"✅ {len(weekly_df)} weekly records across {weekly_df['Channel'].nunique()} channels")
             return weekly_df
 
         except Exception as e:
-            print(f"❌ Fatal error during extraction: {e}")
+            print(f"❌ Fatal error during weekly sales extraction: {e}")
             import traceback
             traceback.print_exc()
             return pd.DataFrame()
 
-    def convert_amazon_weekly_to_monthly(self, weekly_df):
+    @staticmethod
+    def _allocate_weeks_to_months(week_start, sales):
         """
-        Convert Amazon FBA weekly sales data to monthly format
-        using actual week start dates.
+        Split each 7-day week across the (at most two) months it touches, in
+        proportion to days. Returns month-end dates and sales for both halves;
+        a week fully inside one month gets 0 for its second half.
         """
-        try:
-            if weekly_df.empty:
-                return pd.DataFrame()
+        start_day = week_start.astype('datetime64[D]')
+        first_month = start_day.astype('datetime64[M]')
+        next_month_start = (first_month + 1).astype('datetime64[D]')
 
-            print(f"Converting Amazon FBA weekly sales to monthly format...")
+        days_in_first = np.minimum((next_month_start - start_day).astype(np.int64), 7)
+        first_share = sales * (days_in_first / 7.0)
 
-            # Ensure 'Week_Start' column is datetime
-            weekly_df['Week_Start'] = pd.to_datetime(weekly_df['Week_Start'], errors='coerce')
+        first_month_end = next_month_start - np.timedelta64(1, 'D')
+        second_month_end = (first_month + 2).astype('datetime64[D]') - np.timedelta64(1, 'D')
 
-            # Drop rows with invalid dates
-            weekly_df = weekly_df.dropna(subset=['Week_Start'])
+        return first_month_end, first_share, second_month_end, sales - first_share
 
-            # Assign the month (e.g., 2025-01-31, 2025-02-28 etc.) to each week using MonthEnd
-            weekly_df['Month'] = weekly_df['Week_Start'] + pd.offsets.MonthEnd(0)
+    def convert_weekly_to_monthly(self, weekly_df, allocation='week_start'):
+        """
+        Convert weekly sales for any mix of channels to monthly records with a
+        single groupby. allocation='week_start' assigns each week to the month of
+        its Week_Start; allocation='proportional' splits weeks that straddle a
+        month boundary by days.
+        """
+        # A configuration error, not bad sheet data: raise instead of returning no history
+        if allocation not in self.WEEK_ALLOCATION_MODES:
+            raise ValueError(f"Unknown week allocation mode: {allocation}")
+
+        try:
+            if weekly_df.empty:
+                return pd.DataFrame()
 
-            # Debug print mapping
-            mapping = weekly_df[['Week_Start', 'Month']].drop_duplicates().sort_values('Week_Start')
-            print("Week to Month mapping:")
-            for _, row in mapping.head(10).iterrows():
-                print(f"   Week of {row['Week_Start'].strftime('%d/%m/%Y')} → Month End: {row['Month'].strftime('%d/%m/%Y')}")
+            print(f"Converting weekly sales to monthly format ({allocation} allocation)...")
+
+            week_start = pd.to_datetime(weekly_df['Week_Start'], errors='coerce')
+            valid = week_start.notna().to_numpy()
+
+            channels = weekly_df['Channel'].to_numpy()[valid]
+            skus = weekly_df['SKU'].to_numpy()[valid]
+            sales = weekly_df['Sales'].to_numpy(dtype=float)[valid]
+
+            if allocation == 'proportional':
+                first_end, first_sales, second_end, second_sales = self._allocate_weeks_to_months(
+                    week_start[valid].to_numpy(), sales
+                )
+                spill = second_sales > 0
+                weekly = pd.DataFrame({
+                    'Channel': np.concatenate([channels, channels[spill]]),
+                    'SKU': np.concatenate([skus, skus[spill]]),
+                    'Date': np.concatenate([first_end, second_end[spill]]).astype('datetime64[ns]'),
+                    'Sales': np.concatenate([first_sales, second_sales[spill]]),
+                })
+            else:
+                weekly = pd.DataFrame({
+                    'Channel': channels,
+                    'SKU': skus,
+                    'Date': (week_start[valid] + pd.offsets.MonthEnd(0)).to_numpy(),
+                    'Sales': sales,
+                })
 
-            # Group and aggregate
-            monthly_sales = weekly_df.groupby(['SKU', 'Month'])['Sales'].sum().reset_index()
-            monthly_sales['Channel'] = 'Amazon'
-            monthly_sales = monthly_sales.rename(columns={'Month': 'Date'})
+            monthly_sales = weekly.groupby(['Channel', 'SKU', 'Date'], sort=True)['Sales'].sum().reset_index()
+            monthly_sales = monthly_sales[['SKU', 'Date', 'Sales', 'Channel']]
 
             print(f"✅ Converted to {len(monthly_sales)} monthly records")
-            print(f"   Date range: {monthly_sales['Date'].min().strftime('%d/%m/%Y')} to {monthly_sales['Date'].max().strftime('%d/%m/%Y')}")
-            print(f"   SKUs covered: {monthly_sales['SKU'].nunique()}")
-
-            # Sample output
-            for _, row in monthly_sales.head(3).iterrows():
-                print(f"   SKU {row['SKU']} | {row['Date'].strftime('%b %Y')} | Sales: {row['Sales']}")
+            for channel, channel_sales in monthly_sales.groupby('Channel', sort=False):
+                print(f"   {channel}: {channel_sales['Date'].min().strftime('%d/%m/%Y')} to "
+                      f"{channel_sales['Date'].max().strftime('%d/%m/%Y')} | {channel_sales['SKU'].nunique()} SKUs")
 
             return monthly_sales
 
         except Exception as e:
-            print(f"❌ Error converting Amazon FBA weekly to monthly: {e}")
+            print(f"❌ Error converting weekly sales to monthly: {e}")
             import traceback
             traceback.print_exc()
             return pd.DataFrame()
 
-    def extend_historical_data_with_amazon_weekly(self, historical_data, amazon_weekly_monthly_data):
+    def extend_historical_data_with_weekly(self, historical_data, weekly_monthly_data, label='weekly'):
         """
-        Extend historical sales data with Amazon FBA weekly data
+        Extend historical sales data with weekly-derived monthly data, keeping only
+        months after the latest historical date.
         """
         try:
-            if amazon_weekly_monthly_data.empty:
-                print("No Amazon FBA weekly data to extend historical data")
+            if weekly_monthly_data.empty:
+                print(f"No {label} weekly data to extend historical data")
                 return historical_data
 
-            print("Extending historical data with Amazon FBA weekly sales...")
+            print(f"Extending historical data with {label} weekly sales...")
 
-            # Get the latest date in historical data
             historical_data['Date'] = pd.to_datetime(historical_data['Date'])
             latest_historical_date = historical_data['Date'].max()
-
             print(f"Latest historical date: {latest_historical_date}")
-            print(f"Amazon FBA weekly data starts: {amazon_weekly_monthly_data['Date'].min()}")
-            print(f"Amazon FBA weekly data ends: {amazon_weekly_monthly_data['Date'].max()}")
 
-            # Filter Amazon weekly data to only include dates after historical data
-            new_amazon_data = amazon_weekly_monthly_data[amazon_weekly_monthly_data['Date'] > latest_historical_date].copy()
+            new_data = weekly_monthly_data[weekly_monthly_data['Date'] > latest_historical_date]
 
-            if new_amazon_data.empty:
-                print("No new Amazon FBA weekly data after historical cutoff")
+            if new_data.empty:
+                print(f"No new {label} weekly data after historical cutoff")
                 return historical_data
 
-            print(f"Adding {len(new_amazon_data)} new Amazon FBA monthly records")
+            combined_data = pd.concat([historical_data, new_data], ignore_index=True)
+            combined_data = combined_data.sort_values(['SKU', 'Channel', 'Date'])
 
-            # Amazon FBA data is already in the right format - just add it
-            if not new_amazon_data.empty:
-                # Combine with historical data
-                combined_data = pd.concat([historical_data, new_amazon_data], ignore_index=True)
-                combined_data = combined_data.sort_values(['SKU', 'Channel', 'Date'])
+            print(f"✅ Extended historical data with {len(new_data)} new {label} records")
+            print(f"   Total records: {len(combined_data)} (was {len(historical_data)})")
 
-                print(f"✅ Extended historical data with {len(new_amazon_data)} new Amazon records")
-                print(f"   Total records: {len(combined_data)} (was {len(historical_data)})")
-                print(f"   New date range: {combined_data['Date'].min()} to {combined_data['Date'].max()}")
-
-                # Show sample of extended data
-                amazon_sample = new_amazon_data.head(3)
-                for _, row in amazon_sample.iterrows():
-                    print(f"   Added Amazon: {row['SKU']}, {row['Date'].strftime('%b %Y')}, Sales: {row['Sales']}")
-
-                return combined_data
-            else:
-                return historical_data
+            return combined_data
 
         except Exception as e:
-            print(f"❌ Error extending historical data with Amazon FBA: {e}")
+            print(f"❌ Error extending historical data with {label}: {e}")
             import traceback
             traceback.print_exc()
             return historical_data
-        
-    ### For Shopify Data Seprately
 
-    def get_shopify_main_weekly_sales(self, spreadsheet_url):
-        try:
-            print("📦 Extracting Shopify Main weekly sales data...")
-            spreadsheet = self.gc.open_by_url(spreadsheet_url)
-            worksheet = spreadsheet.worksheet("Shopify Main")
+    # Per-channel entry points kept for existing callers
 
-            all_values = worksheet.get_all_values()
-            if not all_values:
-                print("❌ No data found.")
-                return pd.DataFrame()
+    def get_amazon_fba_weekly_sales(self, spreadsheet_url):
+        return self.get_weekly_sales(spreadsheet_url, "Amazon FBA", "Amazon")
 
-            headers = all_values[0]
-            print(f"🧾 Headers: {headers}")
+    def convert_amazon_weekly_to_monthly(self, weekly_df):
+        return self.convert_weekly_to_monthly(weekly_df.assign(Channel='Amazon') if not weekly_df.empty else weekly_df)
 
-            sku_col = None
-            week_columns = []
+    def extend_historical_data_with_amazon_weekly(self, historical_data, amazon_weekly_monthly_data):
+        return self.extend_historical_data_with_weekly(historical_data, amazon_weekly_monthly_data, "Amazon FBA")
 
-            # Identify columns
-            for i, header in enumerate(headers):
-                header_clean = str(header).strip().lower()
+    def get_shopify_main_weekly_sales(self, spreadsheet_url):
+        return self.get_weekly_sales(spreadsheet_url, "Shopify Main", "Shopify")
 
-                if 'upc' in header_clean:
-                    sku_col = i
-                    print(f"✅ Found UPC column at index {i}: {header}")
-                    continue
+    def convert_shopify_weekly_to_monthly(self, weekly_df2):
+        return self.convert_weekly_to_monthly(weekly_df2.assign(Channel='Shopify') if not weekly_df2.empty else weekly_df2)
 
-                # Try to parse as date
-                try:
-                    week_date = pd.to_datetime(header, dayfirst=False)  # mm/dd/yyyy format
-                    week_columns.append((i, week_date))
-                    print(f"📅 Week column at index {i}: {week_date.strftime('%d/%m/%Y')}")
-                except:
-                    # Print once for debugging
-                    if i >= 4:  # Avoid clutter for known non-date columns
-                        print(f"⛔ Skipping non-date column: {header}")
-                    continue
+    def extend_historical_data_with_shopify_weekly(self, historical_data, shopify_weekly_monthly_data):
+        return self.extend_historical_data_with_weekly(historical_data, shopify_weekly_monthly_data, "Shopify Main")
 
-            if sku_col is None or not week_columns:
-                print("❌ Could not identify necessary columns.")
-                return pd.DataFrame()
+    def get_shopify_faire_weekly_sales(self, spreadsheet_url):
+        return self.get_weekly_sales(spreadsheet_url, "Shopify Faire", "Shopify Faire")
 
-            # Parse each row
-            weekly_sales_data = []
-            processed_skus = set()
+    def convert_shopify_faire_weekly_to_monthly(self, weekly_df3):
+        return self.convert_weekly_to_monthly(weekly_df3.assign(Channel='Shopify Faire') if not weekly_df3.empty else weekly_df3)
 
-            for row_idx, row in enumerate(all_values[1:], start=2):
-                try:
-                    if len(row) <= sku_col:
-                        continue
+    def extend_historical_data_with_shopify_faire_weekly(self, historical_data, shopify_faire_weekly_monthly_data):
+        return self.extend_historical_data_with_weekly(historical_data, shopify_faire_weekly_monthly_data, "Shopify Faire")
 
-                    raw_sku = str(row[sku_col]).strip()
-                    if not raw_sku or raw_sku.lower() in ['none', 'null', 'n/a', '']:
-                        continue
+    def get_amazon_fbm_weekly_sales(self, spreadsheet_url):
+        return self.get_weekly_sales(spreadsheet_url, "Amazon FBM", "Amazonfbm")
 
-                    # Clean SKU
-                    cleaned_sku = raw_sku.zfill(12) if raw_sku.isdigit() and len(raw_sku) < 12 else raw_sku
-                    processed_skus.add(cleaned_sku)
+    def convert_amazon_fbm_weekly_to_monthly(self, weekly_df4):
+        return self.convert_weekly_to_monthly(weekly_df4.assign(Channel='Amazonfbm') if not weekly_df4.empty else weekly_df4)
 
-                    for col_idx, week_date in week_columns:
-                        if col_idx >= len(row):
-                            continue
-                        try:
-                            sales = float(row[col_idx]) if row[col_idx].strip() not in ['', '-', 'n/a', 'N/A'] else 0
-                        except:
-                            sales = 0
-
-                        if sales > 0:
-                            weekly_sales_data.append({
-                                'SKU': cleaned_sku,
-                                'Original_SKU': raw_sku,
-                                'Week_Start': week_date,
-                                'Sales': sales,
-                                'Channel': 'Shopify'
-                            })
+    def extend_historical_data_with_amazon_fbm_weekly(self, historical_data, amazon_fbm_weekly_monthly_data):
+        return self.extend_historical_data_with_weekly(historical_data, amazon_fbm_weekly_monthly_data, "Amazon FBM")
 
-                except Exception as e:
-                    print(f"⚠️ Error at row {row_idx}: {e}")
-                    continue
+    def get_walmart_fbm_weekly_sales(self, spreadsheet_url):
+        return self.get_weekly_sales(spreadsheet_url, "Walmart FBM", "Walmartfbm")
 
-            # Convert to DataFrame
-            weekly_df2 = pd.DataFrame(weekly_sales_data)
+    def convert_walmart_fbm_weekly_to_monthly(self, weekly_df5):
+        return self.convert_weekly_to_monthly(weekly_df5.assign(Channel='Walmartfbm') if not weekly_df5.empty else weekly_df5)
 
-            if weekly_df2.empty:
-                print("⚠️ No valid weekly sales found.")
-            else:
-                print(f"✅ {len(weekly_df2)} records extracted | {weekly_df2['SKU'].nunique()} SKUs")
-                print(f"   Range: {weekly_df2['Week_Start'].min().strftime('%d/%m/%Y')} → {weekly_df2['Week_Start'].max().strftime('%d/%m/%Y')}")
+    def extend_historical_data_with_walmart_fbm_weekly(self, historical_data, walmart_fbm_weekly_monthly_data):
+        return self.extend_historical_data_with_weekly(historical_data, walmart_fbm_weekly_monthly_data, "Walmart FBM")
 
-            return weekly_df2
 
-        except Exception as e:
-            print(f"❌ Fatal error during extraction: {e}")
-            import traceback
-            traceback.print_exc()
-            return pd.DataFrame()
+# [REST OF THE CODE REMAINS EXACTLY THE SAME FROM EnhancedForecastingModel CLASS ONWARDS]
+# Including all methods in EnhancedForecastingModel and the main() function
+# Only the inventory loading part in main() needs to be modified
 
-    def convert_shopify_weekly_to_monthly(self, weekly_df2):
-        """
-        Convert Shopify Main weekly sales data to monthly format
-        using actual week start dates.
-        """
+
+class EnhancedForecastingModel:
+    def __init__(self, historical_data, lead_times, launch_dates, service_level=0.95):
         try:
-            if weekly_df2.empty:
-                return pd.DataFrame()
+            print("Initializing Enhanced Forecasting Model...")
 
-            print(f"Converting Shopify Main weekly sales to monthly format...")
+            expected_columns = ['SKU', 'Channel', 'Date', 'Sales']
+            missing_cols = [col for col in expected_columns if col not in historical_data.columns]
+            if missing_cols:
+                raise ValueError(f"Missing columns: {missing_cols}")
 
-            # Ensure 'Week_Start' column is datetime
-            weekly_df2['Week_Start'] = pd.to_datetime(weekly_df2['Week_Start'], errors='coerce')
-
-            # Drop rows with invalid dates
-            weekly_df2 = weekly_df2.dropna(subset=['Week_Start'])
-
-            # Assign the month (e.g., 2025-01-31, 2025-02-28 etc.) to each week using MonthEnd
-            weekly_df2['Month'] = weekly_df2['Week_Start'] + pd.offsets.MonthEnd(0)
-
-            # Debug print mapping
-            mapping = weekly_df2[['Week_Start', 'Month']].drop_duplicates().sort_values('Week_Start')
-            print("Week to Month mapping:")
-            for _, row in mapping.head(10).iterrows():
-                print(f"   Week of {row['Week_Start'].strftime('%d/%m/%Y')} → Month End: {row['Month'].strftime('%d/%m/%Y')}")
-
-            # Group and aggregate
-            monthly_sales2 = weekly_df2.groupby(['SKU', 'Month'])['Sales'].sum().reset_index()
-            monthly_sales2['Channel'] = 'Shopify'
-            monthly_sales2 = monthly_sales2.rename(columns={'Month': 'Date'})
-
-            print(f"✅ Converted to {len(monthly_sales2)} monthly records")
-            print(f"   Date range: {monthly_sales2['Date'].min().strftime('%d/%m/%Y')} to {monthly_sales2['Date'].max().strftime('%d/%m/%Y')}")
-            print(f"   SKUs covered: {monthly_sales2['SKU'].nunique()}")
-
-            # Sample output
-            for _, row in monthly_sales2.head(3).iterrows():
-                print(f"   SKU {row['SKU']} | {row['Date'].strftime('%b %Y')} | Sales: {row['Sales']}")
-
-            return monthly_sales2
-
-        except Exception as e:
-            print(f"❌ Error converting Shopify Main weekly to monthly: {e}")
-            import traceback
-            traceback.print_exc()
-            return pd.DataFrame()
-    
-    def extend_historical_data_with_shopify_weekly(self, historical_data, shopify_weekly_monthly_data):
-        """
-        Extend historical sales data with Shopify Main weekly data
-        """
-        try:
-            if shopify_weekly_monthly_data.empty:
-                print("No Shopify Main weekly data to extend historical data")
-                return historical_data
-
-            print("Extending historical data with Shopify weekly sales...")
-
-            # Get the latest date in historical data
-            historical_data['Date'] = pd.to_datetime(historical_data['Date'])
-            latest_historical_date = historical_data['Date'].max()
-
-            print(f"Latest historical date: {latest_historical_date}")
-            print(f"Shopify Main weekly data starts: {shopify_weekly_monthly_data['Date'].min()}")
-            print(f"Shopify Main weekly data ends: {shopify_weekly_monthly_data['Date'].max()}")
-
-            # Filter Shopify weekly data to only include dates after historical data
-            new_shopify_data = shopify_weekly_monthly_data[shopify_weekly_monthly_data['Date'] > latest_historical_date].copy()
-
-            if new_shopify_data.empty:
-                print("No new Shopify Main weekly data after historical cutoff")
-                return historical_data
-
-            print(f"Adding {len(new_shopify_data)} new Shopify Main monthly records")
-
-            # Shopify Main data is already in the right format - just add it
-            if not new_shopify_data.empty:
-                # Combine with historical data
-                combined_data = pd.concat([historical_data, new_shopify_data], ignore_index=True)
-                combined_data = combined_data.sort_values(['SKU', 'Channel', 'Date'])
-
-                print(f"✅ Extended historical data with {len(new_shopify_data)} new Shopify records")
-                print(f"   Total records: {len(combined_data)} (was {len(historical_data)})")
-                print(f"   New date range: {combined_data['Date'].min()} to {combined_data['Date'].max()}")
-
-                # Show sample of extended data
-                shopify_sample = new_shopify_data.head(3)
-                for _, row in shopify_sample.iterrows():
-                    print(f"   Added Shopify: {row['SKU']}, {row['Date'].strftime('%b %Y')}, Sales: {row['Sales']}")
-
-                return combined_data
-            else:
-                return historical_data
-
-        except Exception as e:
-            print(f"❌ Error extending historical data with Shopify Main: {e}")
-            import traceback
-            traceback.print_exc()
-            return historical_data    
-
-### Just ADDED Shopify Faire Tab
-
-    def get_shopify_faire_weekly_sales(self, spreadsheet_url):
-        try:
-            print("📦 Extracting Shopify Faire weekly sales data...")
-            spreadsheet = self.gc.open_by_url(spreadsheet_url)
-            worksheet = spreadsheet.worksheet("Shopify Faire")
-
-            all_values = worksheet.get_all_values()
-            if not all_values:
-                print("❌ No data found.")
-                return pd.DataFrame()
-
-            headers = all_values[0]
-            print(f"🧾 Headers: {headers}")
-
-            sku_col = None
-            week_columns = []
-
-            # Identify columns
-            for i, header in enumerate(headers):
-                header_clean = str(header).strip().lower()
-
-                if 'upc' in header_clean:
-                    sku_col = i
-                    print(f"✅ Found UPC column at index {i}: {header}")
-                    continue
-
-                # Try to parse as date
-                try:
-                    week_date = pd.to_datetime(header, dayfirst=False)  # mm/dd/yyyy format
-                    week_columns.append((i, week_date))
-                    print(f"📅 Week column at index {i}: {week_date.strftime('%d/%m/%Y')}")
-                except:
-                    # Print once for debugging
-                    if i >= 4:  # Avoid clutter for known non-date columns
-                        print(f"⛔ Skipping non-date column: {header}")
-                    continue
-
-            if sku_col is None or not week_columns:
-                print("❌ Could not identify necessary columns.")
-                return pd.DataFrame()
-
-            # Parse each row
-            weekly_sales_data = []
-            processed_skus = set()
-
-            for row_idx, row in enumerate(all_values[1:], start=2):
-                try:
-                    if len(row) <= sku_col:
-                        continue
-
-                    raw_sku = str(row[sku_col]).strip()
-                    if not raw_sku or raw_sku.lower() in ['none', 'null', 'n/a', '']:
-                        continue
-
-                    # Clean SKU
-                    cleaned_sku = raw_sku.zfill(12) if raw_sku.isdigit() and len(raw_sku) < 12 else raw_sku
-                    processed_skus.add(cleaned_sku)
-
-                    for col_idx, week_date in week_columns:
-                        if col_idx >= len(row):
-                            continue
-                        try:
-                            sales = float(row[col_idx]) if row[col_idx].strip() not in ['', '-', 'n/a', 'N/A'] else 0
-                        except:
-                            sales = 0
-
-                        if sales > 0:
-                            weekly_sales_data.append({
-                                'SKU': cleaned_sku,
-                                'Original_SKU': raw_sku,
-                                'Week_Start': week_date,
-                                'Sales': sales,
-                                'Channel': 'Shopify Faire'
-                            })
-
-                except Exception as e:
-                    print(f"⚠️ Error at row {row_idx}: {e}")
-                    continue
-
-            # Convert to DataFrame
-            weekly_df3 = pd.DataFrame(weekly_sales_data)
-
-            if weekly_df3.empty:
-                print("⚠️ No valid weekly sales found.")
-            else:
-                print(f"✅ {len(weekly_df3)} records extracted | {weekly_df3['SKU'].nunique()} SKUs")
-                print(f"   Range: {weekly_df3['Week_Start'].min().strftime('%d/%m/%Y')} → {weekly_df3['Week_Start'].max().strftime('%d/%m/%Y')}")
-
-            return weekly_df3
-
-        except Exception as e:
-            print(f"❌ Fatal error during extraction: {e}")
-            import traceback
-            traceback.print_exc()
-            return pd.DataFrame()
-
-    def convert_shopify_faire_weekly_to_monthly(self, weekly_df3):
-        """
-        Convert Shopify Faire weekly sales data to monthly format
-        using actual week start dates.
-        """
-        try:
-            if weekly_df3.empty:
-                return pd.DataFrame()
-
-            print(f"Converting Shopify Faire weekly sales to monthly format...")
-
-            # Ensure 'Week_Start' column is datetime
-            weekly_df3['Week_Start'] = pd.to_datetime(weekly_df3['Week_Start'], errors='coerce')
-
-            # Drop rows with invalid dates
-            weekly_df3 = weekly_df3.dropna(subset=['Week_Start'])
-
-            # Assign the month (e.g., 2025-01-31, 2025-02-28 etc.) to each week using MonthEnd
-            weekly_df3['Month'] = weekly_df3['Week_Start'] + pd.offsets.MonthEnd(0)
-
-            # Debug print mapping
-            mapping = weekly_df3[['Week_Start', 'Month']].drop_duplicates().sort_values('Week_Start')
-            print("Week to Month mapping:")
-            for _, row in mapping.head(10).iterrows():
-                print(f"   Week of {row['Week_Start'].strftime('%d/%m/%Y')} → Month End: {row['Month'].strftime('%d/%m/%Y')}")
-
-            # Group and aggregate
-            monthly_sales3 = weekly_df3.groupby(['SKU', 'Month'])['Sales'].sum().reset_index()
-            monthly_sales3['Channel'] = 'Shopify Faire'
-            monthly_sales3 = monthly_sales3.rename(columns={'Month': 'Date'})
-
-            print(f"✅ Converted to {len(monthly_sales3)} monthly records")
-            print(f"   Date range: {monthly_sales3['Date'].min().strftime('%d/%m/%Y')} to {monthly_sales3['Date'].max().strftime('%d/%m/%Y')}")
-            print(f"   SKUs covered: {monthly_sales3['SKU'].nunique()}")
-
-            # Sample output
-            for _, row in monthly_sales3.head(3).iterrows():
-                print(f"   SKU {row['SKU']} | {row['Date'].strftime('%b %Y')} | Sales: {row['Sales']}")
-
-            return monthly_sales3
-
-        except Exception as e:
-            print(f"❌ Error converting Shopify Faire weekly to monthly: {e}")
-            import traceback
-            traceback.print_exc()
-            return pd.DataFrame()
-
-    def extend_historical_data_with_shopify_faire_weekly(self, historical_data, shopify_faire_weekly_monthly_data):
-        """
-        Extend historical sales data with Shopify Faire weekly data
-        """
-        try:
-            if shopify_faire_weekly_monthly_data.empty:
-                print("No Shopify Faire weekly data to extend historical data")
-                return historical_data
-
-            print("Extending historical data with Shopify Faire weekly sales...")
-
-            # Get the latest date in historical data
-            historical_data['Date'] = pd.to_datetime(historical_data['Date'])
-            latest_historical_date = historical_data['Date'].max()
-
-            print(f"Latest historical date: {latest_historical_date}")
-            print(f"Shopify Faire weekly data starts: {shopify_faire_weekly_monthly_data['Date'].min()}")
-            print(f"Shopify Faire weekly data ends: {shopify_faire_weekly_monthly_data['Date'].max()}")
-
-            # Filter Shopify Faire weekly data to only include dates after historical data
-            new_shopify_faire_data = shopify_faire_weekly_monthly_data[shopify_faire_weekly_monthly_data['Date'] > latest_historical_date].copy()
-
-            if new_shopify_faire_data.empty:
-                print("No new Shopify Faire weekly data after historical cutoff")
-                return historical_data
-
-            print(f"Adding {len(new_shopify_faire_data)} new Shopify Faire monthly records")
-
-            # Shopify Faire data is already in the right format - just add it
-            if not new_shopify_faire_data.empty:
-                # Combine with historical data
-                combined_data = pd.concat([historical_data, new_shopify_faire_data], ignore_index=True)
-                combined_data = combined_data.sort_values(['SKU', 'Channel', 'Date'])
-
-                print(f"✅ Extended historical data with {len(new_shopify_faire_data)} new Shopify records")
-                print(f"   Total records: {len(combined_data)} (was {len(historical_data)})")
-                print(f"   New date range: {combined_data['Date'].min()} to {combined_data['Date'].max()}")
-
-                # Show sample of extended data
-                shopify_faire_sample = new_shopify_faire_data.head(3)
-                for _, row in shopify_faire_sample.iterrows():
-                    print(f"   Added Shopify Faire: {row['SKU']}, {row['Date'].strftime('%b %Y')}, Sales: {row['Sales']}")
-
-                return combined_data
-            else:
-                return historical_data
-
-        except Exception as e:
-            print(f"❌ Error extending historical data with Shopify Faire: {e}")
-            import traceback
-            traceback.print_exc()
-            return historical_data     
-
-        ### AMAZON FBM TAB   
-        
-    def get_amazon_fbm_weekly_sales(self, spreadsheet_url):
-        try:
-            print("📦 Extracting Amazon FBM weekly sales data...")
-            spreadsheet = self.gc.open_by_url(spreadsheet_url)
-            worksheet = spreadsheet.worksheet("Amazon FBM")
-
-            all_values = worksheet.get_all_values()
-            if not all_values:
-                print("❌ No data found.")
-                return pd.DataFrame()
-
-            headers = all_values[0]
-            print(f"🧾 Headers: {headers}")
-
-            sku_col = None
-            week_columns = []
-
-            # Identify columns
-            for i, header in enumerate(headers):
-                header_clean = str(header).strip().lower()
-
-                if 'upc' in header_clean:
-                    sku_col = i
-                    print(f"✅ Found UPC column at index {i}: {header}")
-                    continue
-
-                # Try to parse as date
-                try:
-                    week_date = pd.to_datetime(header, dayfirst=False)  # mm/dd/yyyy format
-                    week_columns.append((i, week_date))
-                    print(f"📅 Week column at index {i}: {week_date.strftime('%d/%m/%Y')}")
-                except:
-                    # Print once for debugging
-                    if i >= 4:  # Avoid clutter for known non-date columns
-                        print(f"⛔ Skipping non-date column: {header}")
-                    continue
-
-            if sku_col is None or not week_columns:
-                print("❌ Could not identify necessary columns.")
-                return pd.DataFrame()
-
-            # Parse each row
-            weekly_sales_data = []
-            processed_skus = set()
-
-            for row_idx, row in enumerate(all_values[1:], start=2):
-                try:
-                    if len(row) <= sku_col:
-                        continue
-
-                    raw_sku = str(row[sku_col]).strip()
-                    if not raw_sku or raw_sku.lower() in ['none', 'null', 'n/a', '']:
-                        continue
-
-                    # Clean SKU
-                    cleaned_sku = raw_sku.zfill(12) if raw_sku.isdigit() and len(raw_sku) < 12 else raw_sku
-                    processed_skus.add(cleaned_sku)
-
-                    for col_idx, week_date in week_columns:
-                        if col_idx >= len(row):
-                            continue
-                        try:
-                            sales = float(row[col_idx]) if row[col_idx].strip() not in ['', '-', 'n/a', 'N/A'] else 0
-                        except:
-                            sales = 0
-
-                        if sales > 0:
-                            weekly_sales_data.append({
-                                'SKU': cleaned_sku,
-                                'Original_SKU': raw_sku,
-                                'Week_Start': week_date,
-                                'Sales': sales,
-                                'Channel': 'Amazonfbm'
-                            })
-
-                except Exception as e:
-                    print(f"⚠️ Error at row {row_idx}: {e}")
-                    continue
-
-            # Convert to DataFrame
-            weekly_df4 = pd.DataFrame(weekly_sales_data)
-
-            if weekly_df4.empty:
-                print("⚠️ No valid weekly sales found.")
-            else:
-                print(f"✅ {len(weekly_df4)} records extracted | {weekly_df4['SKU'].nunique()} SKUs")
-                print(f"   Range: {weekly_df4['Week_Start'].min().strftime('%d/%m/%Y')} → {weekly_df4['Week_Start'].max().strftime('%d/%m/%Y')}")
-
-            return weekly_df4
-
-        except Exception as e:
-            print(f"❌ Fatal error during extraction: {e}")
-            import traceback
-            traceback.print_exc()
-            return pd.DataFrame()
-
-    def convert_amazon_fbm_weekly_to_monthly(self, weekly_df4):
-        """
-        Convert Amazon FBM weekly sales data to monthly format
-        using actual week start dates.
-        """
-        try:
-            if weekly_df4.empty:
-                return pd.DataFrame()
-
-            print(f"Converting Amazon FBM weekly sales to monthly format...")
-
-            # Ensure 'Week_Start' column is datetime
-            weekly_df4['Week_Start'] = pd.to_datetime(weekly_df4['Week_Start'], errors='coerce')
-
-            # Drop rows with invalid dates
-            weekly_df4 = weekly_df4.dropna(subset=['Week_Start'])
-
-            # Assign the month (e.g., 2025-01-31, 2025-02-28 etc.) to each week using MonthEnd
-            weekly_df4['Month'] = weekly_df4['Week_Start'] + pd.offsets.MonthEnd(0)
-
-            # Debug print mapping
-            mapping = weekly_df4[['Week_Start', 'Month']].drop_duplicates().sort_values('Week_Start')
-            print("Week to Month mapping:")
-            for _, row in mapping.head(10).iterrows():
-                print(f"   Week of {row['Week_Start'].strftime('%d/%m/%Y')} → Month End: {row['Month'].strftime('%d/%m/%Y')}")
-
-            # Group and aggregate
-            monthly_sales4 = weekly_df4.groupby(['SKU', 'Month'])['Sales'].sum().reset_index()
-            monthly_sales4['Channel'] = 'Amazonfbm'
-            monthly_sales4 = monthly_sales4.rename(columns={'Month': 'Date'})
-
-            print(f"✅ Converted to {len(monthly_sales4)} monthly records")
-            print(f"   Date range: {monthly_sales4['Date'].min().strftime('%d/%m/%Y')} to {monthly_sales4['Date'].max().strftime('%d/%m/%Y')}")
-            print(f"   SKUs covered: {monthly_sales4['SKU'].nunique()}")
-
-            # Sample output
-            for _, row in monthly_sales4.head(3).iterrows():
-                print(f"   SKU {row['SKU']} | {row['Date'].strftime('%b %Y')} | Sales: {row['Sales']}")
-
-            return monthly_sales4
-
-        except Exception as e:
-            print(f"❌ Error converting Amazon FBM weekly to monthly: {e}")
-            import traceback
-            traceback.print_exc()
-            return pd.DataFrame()
-
-    def extend_historical_data_with_amazon_fbm_weekly(self, historical_data, amazon_fbm_weekly_monthly_data):
-        """
-        Extend historical sales data with Amazon FBM weekly data
-        """
-        try:
-            if amazon_fbm_weekly_monthly_data.empty:
-                print("No Amazon FBM weekly data to extend historical data")
-                return historical_data
-
-            print("Extending historical data with Amazon FBM weekly sales...")
-
-            # Get the latest date in historical data
-            historical_data['Date'] = pd.to_datetime(historical_data['Date'])
-            latest_historical_date = historical_data['Date'].max()
-
-            print(f"Latest historical date: {latest_historical_date}")
-            print(f"Amazon FBM weekly data starts: {amazon_fbm_weekly_monthly_data['Date'].min()}")
-            print(f"Amazon FBM weekly data ends: {amazon_fbm_weekly_monthly_data['Date'].max()}")
-
-            # Filter Amazon FBM weekly data to only include dates after historical data
-            new_amazon_fbm_data = amazon_fbm_weekly_monthly_data[amazon_fbm_weekly_monthly_data['Date'] > latest_historical_date].copy()
-
-            if new_amazon_fbm_data.empty:
-                print("No new Amazon FBM weekly data after historical cutoff")
-                return historical_data
-
-            print(f"Adding {len(new_amazon_fbm_data)} new Amazon FBM monthly records")
-
-            # Amazon FBM data is already in the right format - just add it
-            if not new_amazon_fbm_data.empty:
-                # Combine with historical data
-                combined_data = pd.concat([historical_data, new_amazon_fbm_data], ignore_index=True)
-                combined_data = combined_data.sort_values(['SKU', 'Channel', 'Date'])
-
-                print(f"✅ Extended historical data with {len(new_amazon_fbm_data)} new Shopify records")
-                print(f"   Total records: {len(combined_data)} (was {len(historical_data)})")
-                print(f"   New date range: {combined_data['Date'].min()} to {combined_data['Date'].max()}")
-
-                # Show sample of extended data
-                amazon_fbm_sample = new_amazon_fbm_data.head(3)
-                for _, row in amazon_fbm_sample.iterrows():
-                    print(f"   Added Amazon FBM: {row['SKU']}, {row['Date'].strftime('%b %Y')}, Sales: {row['Sales']}")
-
-                return combined_data
-            else:
-                return historical_data
-
-        except Exception as e:
-            print(f"❌ Error extending historical data with Amazon FBM: {e}")
-            import traceback
-            traceback.print_exc()
-            return historical_data        
-        
-        ### Walmart FBM Tab
-
-    def get_walmart_fbm_weekly_sales(self, spreadsheet_url):
-        try:
-            print("📦 Extracting Walmart FBM weekly sales data...")
-            spreadsheet = self.gc.open_by_url(spreadsheet_url)
-            worksheet = spreadsheet.worksheet("Walmart FBM")
-
-            all_values = worksheet.get_all_values()
-            if not all_values:
-                print("❌ No data found.")
-                return pd.DataFrame()
-
-            headers = all_values[0]
-            print(f"🧾 Headers: {headers}")
-
-            sku_col = None
-            week_columns = []
-
-            # Identify columns
-            for i, header in enumerate(headers):
-                header_clean = str(header).strip().lower()
-
-                if 'upc' in header_clean:
-                    sku_col = i
-                    print(f"✅ Found UPC column at index {i}: {header}")
-                    continue
-
-                # Try to parse as date
-                try:
-                    week_date = pd.to_datetime(header, dayfirst=False)  # mm/dd/yyyy format
-                    week_columns.append((i, week_date))
-                    print(f"📅 Week column at index {i}: {week_date.strftime('%d/%m/%Y')}")
-                except:
-                    # Print once for debugging
-                    if i >= 4:  # Avoid clutter for known non-date columns
-                        print(f"⛔ Skipping non-date column: {header}")
-                    continue
-
-            if sku_col is None or not week_columns:
-                print("❌ Could not identify necessary columns.")
-                return pd.DataFrame()
-
-            # Parse each row
-            weekly_sales_data = []
-            processed_skus = set()
-
-            for row_idx, row in enumerate(all_values[1:], start=2):
-                try:
-                    if len(row) <= sku_col:
-                        continue
-
-                    raw_sku = str(row[sku_col]).strip()
-                    if not raw_sku or raw_sku.lower() in ['none', 'null', 'n/a', '']:
-                        continue
-
-                    # Clean SKU
-                    cleaned_sku = raw_sku.zfill(12) if raw_sku.isdigit() and len(raw_sku) < 12 else raw_sku
-                    processed_skus.add(cleaned_sku)
-
-                    for col_idx, week_date in week_columns:
-                        if col_idx >= len(row):
-                            continue
-                        try:
-                            sales = float(row[col_idx]) if row[col_idx].strip() not in ['', '-', 'n/a', 'N/A'] else 0
-                        except:
-                            sales = 0
-
-                        if sales > 0:
-                            weekly_sales_data.append({
-                                'SKU': cleaned_sku,
-                                'Original_SKU': raw_sku,
-                                'Week_Start': week_date,
-                                'Sales': sales,
-                                'Channel': 'Walmartfbm'
-                            })
-
-                except Exception as e:
-                    print(f"⚠️ Error at row {row_idx}: {e}")
-                    continue
-
-            # Convert to DataFrame
-            weekly_df5 = pd.DataFrame(weekly_sales_data)
-
-            if weekly_df5.empty:
-                print("⚠️ No valid weekly sales found.")
-            else:
-                print(f"✅ {len(weekly_df5)} records extracted | {weekly_df5['SKU'].nunique()} SKUs")
-                print(f"   Range: {weekly_df5['Week_Start'].min().strftime('%d/%m/%Y')} → {weekly_df5['Week_Start'].max().strftime('%d/%m/%Y')}")
-
-            return weekly_df5
-
-        except Exception as e:
-            print(f"❌ Fatal error during extraction: {e}")
-            import traceback
-            traceback.print_exc()
-            return pd.DataFrame()
-
-    def convert_walmart_fbm_weekly_to_monthly(self, weekly_df5):
-        """
-        Convert Walmart FBM weekly sales data to monthly format
-        using actual week start dates.
-        """
-        try:
-            if weekly_df5.empty:
-                return pd.DataFrame()
-
-            print(f"Converting Walmart FBM weekly sales to monthly format...")
-
-            # Ensure 'Week_Start' column is datetime
-            weekly_df5['Week_Start'] = pd.to_datetime(weekly_df5['Week_Start'], errors='coerce')
-
-            # Drop rows with invalid dates
-            weekly_df5 = weekly_df5.dropna(subset=['Week_Start'])
-
-            # Assign the month (e.g., 2025-01-31, 2025-02-28 etc.) to each week using MonthEnd
-            weekly_df5['Month'] = weekly_df5['Week_Start'] + pd.offsets.MonthEnd(0)
-
-            # Debug print mapping
-            mapping = weekly_df5[['Week_Start', 'Month']].drop_duplicates().sort_values('Week_Start')
-            print("Week to Month mapping:")
-            for _, row in mapping.head(10).iterrows():
-                print(f"   Week of {row['Week_Start'].strftime('%d/%m/%Y')} → Month End: {row['Month'].strftime('%d/%m/%Y')}")
-
-            # Group and aggregate
-            monthly_sales5 = weekly_df5.groupby(['SKU', 'Month'])['Sales'].sum().reset_index()
-            monthly_sales5['Channel'] = 'Walmartfbm'
-            monthly_sales5 = monthly_sales5.rename(columns={'Month': 'Date'})
-
-            print(f"✅ Converted to {len(monthly_sales5)} monthly records")
-            print(f"   Date range: {monthly_sales5['Date'].min().strftime('%d/%m/%Y')} to {monthly_sales5['Date'].max().strftime('%d/%m/%Y')}")
-            print(f"   SKUs covered: {monthly_sales5['SKU'].nunique()}")
-
-            # Sample output
-            for _, row in monthly_sales5.head(3).iterrows():
-                print(f"   SKU {row['SKU']} | {row['Date'].strftime('%b %Y')} | Sales: {row['Sales']}")
-
-            return monthly_sales5
-
-        except Exception as e:
-            print(f"❌ Error converting Walmart FBM weekly to monthly: {e}")
-            import traceback
-            traceback.print_exc()
-            return pd.DataFrame()
-
-    def extend_historical_data_with_walmart_fbm_weekly(self, historical_data, walmart_fbm_weekly_monthly_data):
-        """
-        Extend historical sales data with Walmart FBM weekly data
-        """
-        try:
-            if walmart_fbm_weekly_monthly_data.empty:
-                print("No Walmart FBM weekly data to extend historical data")
-                return historical_data
-
-            print("Extending historical data with Walmart FBM weekly sales...")
-
-            # Get the latest date in historical data
-            historical_data['Date'] = pd.to_datetime(historical_data['Date'])
-            latest_historical_date = historical_data['Date'].max()
-
-            print(f"Latest historical date: {latest_historical_date}")
-            print(f"Walmart FBM weekly data starts: {walmart_fbm_weekly_monthly_data['Date'].min()}")
-            print(f"Walmart FBM weekly data ends: {walmart_fbm_weekly_monthly_data['Date'].max()}")
-
-            # Filter Walmart FBM weekly data to only include dates after historical data
-            new_walmart_fbm_data = walmart_fbm_weekly_monthly_data[walmart_fbm_weekly_monthly_data['Date'] > latest_historical_date].copy()
-
-            if new_walmart_fbm_data.empty:
-                print("No new Walmart FBM weekly data after historical cutoff")
-                return historical_data
-
-            print(f"Adding {len(new_walmart_fbm_data)} new Walmart FBM monthly records")
-
-            # Walmart FBM data is already in the right format - just add it
-            if not new_walmart_fbm_data.empty:
-                # Combine with historical data
-                combined_data = pd.concat([historical_data, new_walmart_fbm_data], ignore_index=True)
-                combined_data = combined_data.sort_values(['SKU', 'Channel', 'Date'])
-
-                print(f"✅ Extended historical data with {len(new_walmart_fbm_data)} new Shopify records")
-                print(f"   Total records: {len(combined_data)} (was {len(historical_data)})")
-                print(f"   New date range: {combined_data['Date'].min()} to {combined_data['Date'].max()}")
-
-                # Show sample of extended data
-                walmart_fbm_sample = new_walmart_fbm_data.head(3)
-                for _, row in walmart_fbm_sample.iterrows():
-                    print(f"   Added Walmart FBM: {row['SKU']}, {row['Date'].strftime('%b %Y')}, Sales: {row['Sales']}")
-
-                return combined_data
-            else:
-                return historical_data
-
-        except Exception as e:
-            print(f"❌ Error extending historical data with Walmart FBM: {e}")
-            import traceback
-            traceback.print_exc()
-            return historical_data        
-    
-
-# [REST OF THE CODE REMAINS EXACTLY THE SAME FROM EnhancedForecastingModel CLASS ONWARDS]
-# Including all methods in EnhancedForecastingModel and the main() function
-# Only the inventory loading part in main() needs to be modified
-
-
-class EnhancedForecastingModel:
-    def __init__(self, historical_data, lead_times, launch_dates, service_level=0.95):
-        try:
-            print("Initializing Enhanced Forecasting Model...")
-
-            expected_columns = ['SKU', 'Channel', 'Date', 'Sales']
-            missing_cols = [col for col in expected_columns if col not in historical_data.columns]
-            if missing_cols:
-                raise ValueError(f"Missing columns: {missing_cols}")
-
-            # Clean SKU data more thoroughly
-            historical_data['SKU'] = historical_data['SKU'].astype(str).str.strip()
-            historical_data['Date'] = pd.to_datetime(historical_data['Date'], format='%m/%d/%Y', errors='coerce')
-            historical_data = historical_data.dropna(subset=['Date'])
-            historical_data['Channel'] = historical_data['Channel'].str.strip().str.title()
-            historical_data = historical_data[historical_data['Channel'].isin(['Amazon', 'Shopify', 'Shopify Faire', 'Amazonfbm', 'Walmartfbm'])]
-            historical_data['Sales'] = pd.to_numeric(historical_data['Sales'], errors='coerce').fillna(0)
+            # Clean SKU data more thoroughly
+            historical_data['SKU'] = historical_data['SKU'].astype(str).str.strip()
+            # History from the Parquet store already carries typed dates
+            if not pd.api.types.is_datetime64_any_dtype(historical_data['Date']):
+                historical_data['Date'] = pd.to_datetime(historical_data['Date'], format='%m/%d/%Y', errors='coerce')
+            historical_data = historical_data.dropna(subset=['Date'])
+            historical_data['Channel'] = historical_data['Channel'].str.strip().str.title()
+            historical_data = historical_data[historical_data['Channel'].isin(['Amazon', 'Shopify', 'Shopify Faire', 'Amazonfbm', 'Walmartfbm'])]
+            historical_data['Sales'] = pd.to_numeric(historical_data['Sales'], errors='coerce').fillna(0)
 
             self.data = historical_data
             self.lead_times = lead_times
@@ -3413,6 +2991,406 @@ class EnhancedForecastingModel:
             except Exception:
                 return pd.DataFrame()    
 
+# ==============================================================================
+# RUN RESULTS + LAZY ARTIFACTS
+# ==============================================================================
+# main() and run_forecast_bom_analysis() return their output tables as a
+# RunResult; the DataFrames are the only thing a run materializes. The
+# formatted XLSX, Parquet, CSV and Arrow IPC renderings are produced the first
+# time they are asked for and cached on the result, and recent results are
+# kept by run_id so the API can serve any format of a finished run.
+
+ARTIFACT_FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'csv': ('text/csv', 'csv'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+RUN_RESULT_CACHE_SIZE = 8  # most recent runs kept in memory for artifact requests
+
+BOM_REQUIREMENTS_SHEET = '📦 MRP Requirements'
+BOM_URGENT_SHEET = '🚨 Urgent Reorders'
+# The BOM workbook's creation date: fixed, so unchanged requirements render
+# identical bytes and the Drive upload's md5 check can skip them
+BOM_WORKBOOK_CREATED = datetime(2000, 1, 1)
+FORECAST_PRIMARY_SHEET = '📈 All Forecasts'
+# Channel (as in the sales history) -> its forecast tab
+FORECAST_CHANNEL_SHEETS = {
+    'Amazon': '🛒 Amazon',
+    'Shopify': '🛍️ Shopify',
+    'Shopify Faire': '🛍️ Shopify Faire',
+    'Amazonfbm': '🛍️ Amazon FBM',
+    'Walmartfbm': '🛍️ Walmart FBM',
+}
+
+
+def table_key(sheet_name):
+    """URL-friendly table name: '📦 MRP Requirements' -> 'mrp_requirements'."""
+    return re.sub(r'[^0-9a-z]+', '_', sheet_name.lower()).strip('_')
+
+
+def _arrow_table(df):
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed-type object columns (e.g. summary 'Value') are sent as text
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+@dataclass
+class RunResult(ABC):
+    """Output tables of one run, keyed by workbook tab name in tab order."""
+
+    kind: ClassVar[str] = 'run'
+    primary_sheet: ClassVar[Optional[str]] = None
+
+    sheet_frames: Dict[str, pd.DataFrame]
+    filename: str
+    created_at: datetime = field(default_factory=datetime.now)
+    run_id: str = ''
+    _artifacts: Dict[Tuple[str, str], bytes] = field(default_factory=dict, init=False, repr=False)
+    _render_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        if not self.run_id:
+            self.run_id = f"{self.kind}-{uuid.uuid4().hex[:12]}"
+
+    def tables(self) -> List[dict]:
+        return [{"table": table_key(name), "sheet": name, "rows": len(df), "columns": list(map(str, df.columns))}
+                for name, df in self.sheet_frames.items()]
+
+    def resolve_sheet(self, table: Optional[str] = None) -> str:
+        """Sheet name for a table key or sheet name; the primary table by default."""
+        if table is None:
+            if self.primary_sheet in self.sheet_frames:
+                return self.primary_sheet
+            return next(iter(self.sheet_frames))
+        for name in self.sheet_frames:
+            if table in (name, table_key(name)):
+                return name
+        raise KeyError(table)
+
+    def artifact(self, fmt: str, table: Optional[str] = None) -> bytes:
+        """Render one artifact (whole workbook for xlsx, one table otherwise), once."""
+        if fmt not in ARTIFACT_FORMATS:
+            raise ValueError(f"Unknown artifact format '{fmt}'")
+        key = (fmt, '' if fmt == 'xlsx' else self.resolve_sheet(table))
+        with self._render_lock:
+            if key not in self._artifacts:
+                started = time.time()
+                self._artifacts[key] = self._render(*key)
+                print(f"🧾 Rendered {fmt} for {self.run_id} ({key[1] or 'workbook'}) in {time.time() - started:.1f}s")
+            return self._artifacts[key]
+
+    def artifact_filename(self, fmt: str, table: Optional[str] = None) -> str:
+        if fmt == 'xlsx':
+            return self.filename
+        stem = os.path.splitext(self.filename)[0]
+        return f"{stem}_{table_key(self.resolve_sheet(table))}.{ARTIFACT_FORMATS[fmt][1]}"
+
+    def excel_bytes(self) -> bytes:
+        return self.artifact('xlsx')
+
+    @abstractmethod
+    def render_workbook(self) -> bytes:
+        """The formatted XLSX workbook of all tabs."""
+
+    def _render(self, fmt, sheet_name):
+        if fmt == 'xlsx':
+            return self.render_workbook()
+        df = self.sheet_frames[sheet_name]
+        if fmt == 'csv':
+            return df.to_csv(index=False).encode('utf-8')
+        if not PARQUET_AVAILABLE:
+            raise ImportError("pyarrow is required for Parquet and Arrow artifacts")
+        table = _arrow_table(df)
+        sink = pa.BufferOutputStream()
+        if fmt == 'parquet':
+            pq.write_table(table, sink, compression='snappy')
+        else:
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+class RunResultCache:
+    """The most recent RunResults by run_id (LRU, RUN_RESULT_CACHE_SIZE entries)."""
+
+    def __init__(self, max_entries=RUN_RESULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, result):
+        with self._lock:
+            self._results[result.run_id] = result
+            self._results.move_to_end(result.run_id)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return result
+
+    def get(self, run_id):
+        with self._lock:
+            result = self._results.get(run_id)
+            if result is not None:
+                self._results.move_to_end(run_id)
+            return result
+
+
+@st.cache_resource
+def get_run_result_cache():
+    """One cache per server process, shared across Streamlit reruns and API calls."""
+    return RunResultCache()
+
+
+@dataclass
+class ForecastRunResult(RunResult):
+    kind: ClassVar[str] = 'forecast'
+    primary_sheet: ClassVar[Optional[str]] = FORECAST_PRIMARY_SHEET
+
+    # Stamped into the workbook instead of "now" so an unchanged forecast
+    # renders identical bytes and the Drive upload is skipped
+    workbook_created: Optional[datetime] = None
+    # SKU/Channel/Date/Sales rows the model was fitted on (not a workbook tab)
+    history: Optional[pd.DataFrame] = field(default=None, repr=False)
+
+    @property
+    def forecasts(self) -> pd.DataFrame:
+        return self.sheet_frames.get(FORECAST_PRIMARY_SHEET, pd.DataFrame())
+
+    def summary(self) -> dict:
+        forecasts = self.forecasts
+        status = (forecasts['Stock_Status'].astype(str) if 'Stock_Status' in forecasts.columns
+                  else pd.Series(dtype=str))
+        return {
+            "total_skus": len(forecasts),
+            "out_of_stock": int((status == 'OUT OF STOCK').sum()),
+            "reorder_now": int((status == 'REORDER NOW').sum()),
+            "total_recommended_po_qty": float(pd.to_numeric(forecasts['Recommended_PO_Qty'], errors='coerce').sum())
+                                        if 'Recommended_PO_Qty' in forecasts.columns else 0,
+            "data_through": self.workbook_created.date().isoformat() if self.workbook_created else None
+        }
+
+    def render_workbook(self) -> bytes:
+        return render_forecast_workbook(self.sheet_frames, created=self.workbook_created)
+
+
+@dataclass
+class BOMAnalysisResult(RunResult):
+    kind: ClassVar[str] = 'bom'
+    primary_sheet: ClassVar[Optional[str]] = BOM_REQUIREMENTS_SHEET
+
+    @property
+    def requirements(self) -> pd.DataFrame:
+        return self.sheet_frames.get(BOM_REQUIREMENTS_SHEET, pd.DataFrame())
+
+    @property
+    def urgent_reorders(self) -> pd.DataFrame:
+        return self.sheet_frames.get(BOM_URGENT_SHEET, pd.DataFrame())
+
+    def summary(self) -> dict:
+        requirements = self.requirements
+        status = (requirements['Order_Status'].astype(str) if 'Order_Status' in requirements.columns
+                  else pd.Series(dtype=str))
+        return {
+            "total_components": len(requirements),
+            "urgent_reorders": int(status.str.contains('🔴', na=False).sum()),
+            "reorder_soon": int(status.str.contains('🟡', na=False).sum()),
+            "ok": int(status.str.contains('🟢', na=False).sum()),
+            "total_procurement_cost": float(requirements['Procurement_Cost'].sum()) if 'Procurement_Cost' in requirements.columns else 0
+        }
+
+    @staticmethod
+    def records(df: pd.DataFrame) -> List[dict]:
+        """JSON-ready rows: blanks for missing values, plain Python scalars."""
+        return df.astype(object).where(df.notna(), "").to_dict(orient="records")
+
+    def render_workbook(self) -> bytes:
+        return render_bom_workbook(self.sheet_frames)
+
+
+def render_bom_workbook(sheet_frames: Dict[str, pd.DataFrame]) -> bytes:
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine='xlsxwriter',
+                        engine_kwargs={'options': {'nan_inf_to_errors': True}}) as writer:
+        writer.book.set_properties({'created': BOM_WORKBOOK_CREATED})
+        for sheet_name, df in sheet_frames.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+        format_bom_excel_output(writer, sheet_frames)
+    return buffer.getvalue()
+
+
+def format_bom_excel_output(writer, sheet_frames: Dict[str, pd.DataFrame]) -> None:
+    """
+    Style the BOM workbook written by pd.ExcelWriter(engine='xlsxwriter').
+
+    Everything is declared per column or per range (column formats and
+    conditional_format rules), so the cost depends on the number of
+    sheets and columns, not on the number of components.
+    """
+    workbook = writer.book
+
+    header_format = workbook.add_format({
+        'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#366092', 'border': 1,
+        'align': 'center', 'valign': 'vcenter', 'text_wrap': True,
+    })
+    border_format = workbook.add_format({'border': 1})
+    urgent_format = workbook.add_format({'bg_color': '#FFC7CE'})
+    soon_format = workbook.add_format({'bg_color': '#FFEB9C'})
+    ok_format = workbook.add_format({'bg_color': '#C6EFCE'})
+    section_header_format = workbook.add_format({'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#4472C4'})
+    abc_formats = {
+        'A': workbook.add_format({'bold': True, 'font_color': '#9C0006'}),
+        'B': workbook.add_format({'bold': True, 'font_color': '#9C5700'}),
+        'C': workbook.add_format({'font_color': '#006100'}),
+    }
+    # Order_Priority_Score runs 0-100; >= 50 is what the summary calls high priority
+    priority_bands = [
+        ('>=', 75, workbook.add_format({'bold': True, 'font_color': '#9C0006', 'bg_color': '#FFC7CE'})),
+        ('between', (50, 74.99), workbook.add_format({'bold': True, 'font_color': '#9C0006'})),
+        ('between', (25, 49.99), workbook.add_format({'font_color': '#9C5700'})),
+    ]
+
+    # MODIFIED: Removed currency formats for BOM (kept for reference if needed elsewhere)
+    # CURRENCY_FORMAT = '$#,##0.00'
+    # CURRENCY_WHOLE_FORMAT = '$#,##0'
+    NUMBER_FORMAT = '#,##0'
+    NUMBER_DECIMAL_FORMAT = '#,##0.00'
+    # Whole numbers at |x| >= 10, two decimals below, decided by Excel per cell
+    SMART_NUMBER_FORMAT = f'[>=10]{NUMBER_FORMAT};[<=-10]-{NUMBER_FORMAT};{NUMBER_DECIMAL_FORMAT}'
+    PERCENT_FORMAT = '0.0%'
+
+    # MODIFIED: Removed cost-related columns from currency list
+    currency_columns = []  # Empty - no cost columns in BOM anymore
+
+    quantity_columns = ['Gross_Requirement', 'Net_Requirement', 'Calculated_ROP', 'ROP',
+                    'Recommended_Order_Qty', 'Procurement_Needed', 'moq', 'eoq', 'MOQ', 'EOQ',
+                    'Safety_Stock', 'current_inventory', 'Current_Inventory',
+                    'Forecast_Demand', 'Total_Net_Requirement', 'Component_Count', 'Urgent_Count',
+                    'Daily_Demand']
+
+    column_formats = {
+        'wastage': workbook.add_format({'num_format': '0.0"%"', 'valign': 'vcenter'}),  # Wastage is stored as 10 meaning 10%
+        'percent': workbook.add_format({'num_format': PERCENT_FORMAT, 'valign': 'vcenter'}),
+        'quantity': workbook.add_format({'num_format': SMART_NUMBER_FORMAT, 'valign': 'vcenter'}),
+        'plain': workbook.add_format({'valign': 'vcenter'}),
+    }
+    number_formatted_sheets = {'📦 MRP Requirements', '🚨 Urgent Reorders', '🟡 Reorder Soon', '📈 Forecasted Demand'}
+    status_sheets = {'📦 MRP Requirements', '🚨 Urgent Reorders', '🟡 Reorder Soon'}
+
+    def column_kind(col_name):
+        if col_name == 'Wastage%':
+            return 'wastage'
+        if 'Percentage' in col_name or 'Pct' in col_name:
+            return 'percent'
+        if any(qty in col_name for qty in quantity_columns):
+            return 'quantity'
+        return 'plain'
+
+    def column_width(df, col_name):
+        values = df[col_name].dropna()
+        longest = values.astype(str).str.len().max() if len(values) else 0
+        return max(min(max(longest, len(str(col_name))) + 3, 50), 10)
+
+    for sheet_name, df in sheet_frames.items():
+        worksheet = writer.sheets[sheet_name]
+        n_rows, n_cols = len(df), len(df.columns)
+        last_row, last_col = n_rows, n_cols - 1
+        data_range = (1, 0, last_row, last_col)
+
+        worksheet.write_row(0, 0, [str(c) for c in df.columns], header_format)
+
+        if sheet_name == '📊 Executive Summary':
+            _format_bom_executive_summary(workbook, worksheet, df, section_header_format,
+                                          urgent_format, soon_format, ok_format,
+                                          PERCENT_FORMAT, SMART_NUMBER_FORMAT)
+            worksheet.freeze_panes(1, 0)
+            continue
+
+        for col_idx, col_name in enumerate(df.columns):
+            kind = column_kind(str(col_name)) if sheet_name in number_formatted_sheets else 'plain'
+            worksheet.set_column(col_idx, col_idx, column_width(df, col_name), column_formats[kind])
+
+        if n_rows == 0:
+            worksheet.freeze_panes(1, 0)
+            continue
+
+        columns = list(df.columns)
+        if sheet_name == '📦 MRP Requirements' and 'Order_Status' in columns:
+            status_col = xl_col_to_name(columns.index('Order_Status'))
+            for status, fmt in (('🔴 Urgent Reorder', urgent_format),
+                                ('🟡 Reorder Soon', soon_format),
+                                ('🟢 OK', ok_format)):
+                worksheet.conditional_format(*data_range, {
+                    'type': 'formula', 'criteria': f'=${status_col}2="{status}"', 'format': fmt,
+                })
+        elif sheet_name == '🚨 Urgent Reorders':
+            worksheet.conditional_format(*data_range, {'type': 'formula', 'criteria': '=TRUE', 'format': urgent_format})
+        elif sheet_name == '🟡 Reorder Soon':
+            worksheet.conditional_format(*data_range, {'type': 'formula', 'criteria': '=TRUE', 'format': soon_format})
+
+        if sheet_name in status_sheets:
+            if 'ABC_Class' in columns:
+                abc_idx = columns.index('ABC_Class')
+                for abc_class, fmt in abc_formats.items():
+                    worksheet.conditional_format(1, abc_idx, last_row, abc_idx, {
+                        'type': 'cell', 'criteria': '==', 'value': f'"{abc_class}"', 'format': fmt,
+                    })
+            if 'Order_Priority_Score' in columns:
+                score_idx = columns.index('Order_Priority_Score')
+                for criteria, value, fmt in priority_bands:
+                    rule = {'type': 'cell', 'criteria': criteria, 'format': fmt}
+                    if criteria == 'between':
+                        rule['minimum'], rule['maximum'] = value
+                    else:
+                        rule['value'] = value
+                    worksheet.conditional_format(1, score_idx, last_row, score_idx, rule)
+
+        worksheet.conditional_format(*data_range, {'type': 'no_blanks', 'format': border_format})
+        worksheet.freeze_panes(1, 2 if sheet_name in status_sheets else 0)
+
+    print("✅ Applied professional Excel formatting (cost columns removed)")
+
+def _format_bom_executive_summary(workbook, worksheet, summary_df, section_header_format,
+                                  urgent_format, soon_format, ok_format,
+                                  percent_format, number_format):
+    """The summary has a fixed set of rows; values written as text ("1,234", "12.5%") become numbers."""
+    worksheet.set_column('A:A', 45)
+    worksheet.set_column('B:B', 25, workbook.add_format({'align': 'right', 'valign': 'vcenter'}))
+    worksheet.set_column('C:C', 15, workbook.add_format({'align': 'left', 'valign': 'vcenter'}))
+
+    last_row = len(summary_df)
+    if last_row == 0:
+        return
+
+    worksheet.conditional_format(1, 0, last_row, 2, {
+        'type': 'formula', 'criteria': '=LEFT($A2,3)="═══"', 'format': section_header_format,
+    })
+    for metric, fmt in (('🔴 Urgent Reorder', urgent_format),
+                        ('🟡 Reorder Soon', soon_format),
+                        ('🟢 Inventory OK', ok_format)):
+        worksheet.conditional_format(1, 0, last_row, 2, {
+            'type': 'formula', 'criteria': f'=$A2="{metric}"', 'format': fmt,
+        })
+    worksheet.conditional_format(1, 0, last_row, 2, {'type': 'no_blanks', 'format': workbook.add_format({'border': 1})})
+
+    percent_cell = workbook.add_format({'num_format': percent_format, 'align': 'right'})
+    number_cell = workbook.add_format({'num_format': number_format, 'align': 'right'})
+    text = summary_df['Value'].astype(str).str.strip().str.replace(',', '', regex=False)
+    is_section = summary_df['Metric'].astype(str).str.strip().str.startswith('═══')
+    percents = pd.to_numeric(text.str.removesuffix('%').where(text.str.endswith('%')), errors='coerce') / 100
+    numbers = pd.to_numeric(text.where(text.str.replace(r'[.\-]', '', regex=True).str.isdigit()), errors='coerce')
+
+    for row_idx in np.flatnonzero((percents.notna() | numbers.notna()) & ~is_section):
+        if pd.notna(percents.iat[row_idx]):
+            worksheet.write_number(row_idx + 1, 1, percents.iat[row_idx], percent_cell)
+        else:
+            worksheet.write_number(row_idx + 1, 1, numbers.iat[row_idx], number_cell)
+
+
 # NEW: Wrapped Forecast BOM Function
 # PLACEMENT: After EnhancedForecastingModel class, before upload_excel_to_google_sheet function
 
@@ -3430,7 +3408,7 @@ class EnhancedForecastingModel:
 # ==============================================================================
 
 
-def run_forecast_bom_analysis(gc_client=None):
+def run_forecast_bom_analysis(gc_client=None, progress_callback=None):
     """
     ENHANCED Forecast BOM Analysis function v2.0 - Wrapped for WebApp
     
@@ -3447,13 +3425,11 @@ def run_forecast_bom_analysis(gc_client=None):
     - Professional Excel formatting with proper data types
     - Emoji sheet names for visual clarity
     
-    Returns: (excel_buffer, filename) tuple or (None, None) on failure
+    Returns: (BOMAnalysisResult, filename, publish_job) tuple or (None, None, None) on failure
     """
     from collections import defaultdict
     from typing import Dict, List, Tuple, Set, Optional
     from io import BytesIO
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
     from datetime import datetime, timedelta
     import numpy as np
     
@@ -4428,226 +4404,25 @@ def run_forecast_bom_analysis(gc_client=None):
         return pd.DataFrame(summary_data)
 
     # ==========================================================================
-    # EXCEL FORMATTING
+    # MAIN EXECUTION
     # ==========================================================================
 
-    def format_excel_output(writer, results_df: pd.DataFrame, forecast_df: pd.DataFrame,
-                        procurement_df: pd.DataFrame, inventory_df: pd.DataFrame,
-                        skipped_skus: List[Dict], missing_data: List[str]) -> None:
-
-        workbook = writer.book
-
-        header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        header_font = Font(name='Calibri', size=11, bold=True, color='FFFFFF')
-        urgent_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-        soon_fill = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')
-        ok_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
-        section_header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-        section_header_font = Font(name='Calibri', size=11, bold=True, color='FFFFFF')
-        thin_border = Border(left=Side(style='thin'), right=Side(style='thin'),
-                            top=Side(style='thin'), bottom=Side(style='thin'))
-        
-        # MODIFIED: Removed currency formats for BOM (kept for reference if needed elsewhere)
-        # CURRENCY_FORMAT = '$#,##0.00'
-        # CURRENCY_WHOLE_FORMAT = '$#,##0'
-        NUMBER_FORMAT = '#,##0'
-        NUMBER_DECIMAL_FORMAT = '#,##0.00'
-        PERCENT_FORMAT = '0.0%'
-        
-        # MODIFIED: Removed cost-related columns from currency list
-        currency_columns = []  # Empty - no cost columns in BOM anymore
-        
-        quantity_columns = ['Gross_Requirement', 'Net_Requirement', 'Calculated_ROP', 'ROP',
-                        'Recommended_Order_Qty', 'Procurement_Needed', 'moq', 'eoq', 'MOQ', 'EOQ',
-                        'Safety_Stock', 'current_inventory', 'Current_Inventory',
-                        'Forecast_Demand', 'Total_Net_Requirement', 'Component_Count', 'Urgent_Count',
-                        'Daily_Demand']
-
-        def smart_number_format(value, is_currency=False):
+    run_started = stage_started = time.time()
+
+    def report_stage(stage, percent):
+        """Tell progress_callback that `stage` finished, with its own and total elapsed time."""
+        nonlocal stage_started
+        now = time.time()
+        event = {"stage": stage, "percent": percent,
+                 "stage_seconds": round(now - stage_started, 3),
+                 "elapsed_seconds": round(now - run_started, 3)}
+        stage_started = now
+        print(f"⏱️ {stage}: {event['stage_seconds']:.1f}s ({event['elapsed_seconds']:.1f}s total)")
+        if progress_callback is not None:
             try:
-                val = float(value) if value else 0
-                # MODIFIED: No currency formatting needed for BOM
-                return NUMBER_FORMAT if abs(val) >= 10 else NUMBER_DECIMAL_FORMAT
-            except:
-                return NUMBER_DECIMAL_FORMAT
-
-        def apply_column_formatting(worksheet, df):
-            if df is None or len(df) == 0:
-                return
-            for col_idx, col_name in enumerate(df.columns, 1):
-                col_letter = get_column_letter(col_idx)
-                # MODIFIED: Removed currency check
-                is_quantity = any(qty in col_name for qty in quantity_columns)
-                is_percent = 'Percentage' in col_name or 'Pct' in col_name or col_name == 'Qty_Percentage'
-                is_wastage = col_name == 'Wastage%'
-                
-                for row in range(2, worksheet.max_row + 1):
-                    cell = worksheet[f'{col_letter}{row}']
-                    cell_value = cell.value
-                    try:
-                        if cell_value is not None and cell_value != '':
-                            if is_wastage:
-                                # Wastage is stored as 10 meaning 10%, so use custom format
-                                cell.number_format = '0.0"%"'
-                            elif is_percent:
-                                cell.number_format = PERCENT_FORMAT
-                            elif is_quantity:
-                                cell.number_format = smart_number_format(cell_value, is_currency=False)
-                    except:
-                        pass
-
-        for sheet_name in workbook.sheetnames:
-            worksheet = workbook[sheet_name]
-
-            # Apply header formatting to all sheets
-            for cell in worksheet[1]:
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-                cell.border = thin_border
-
-            # Auto-adjust column widths
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = get_column_letter(column[0].column)
-                for cell in column:
-                    try:
-                        cell_len = len(str(cell.value)) if cell.value else 0
-                        if cell_len > max_length:
-                            max_length = cell_len
-                    except:
-                        pass
-                adjusted_width = min(max_length + 3, 50)
-                worksheet.column_dimensions[column_letter].width = max(adjusted_width, 10)
-
-            # Apply borders to all cells with data
-            for row in worksheet.iter_rows(min_row=1, max_row=worksheet.max_row,
-                                        min_col=1, max_col=worksheet.max_column):
-                for cell in row:
-                    if cell.value is not None:
-                        cell.border = thin_border
-                        cell.alignment = Alignment(vertical='center')
-
-            # Sheet-specific formatting
-            if sheet_name == '📦 MRP Requirements':
-                apply_column_formatting(worksheet, results_df)
-                if 'Order_Status' in results_df.columns:
-                    status_col_idx = results_df.columns.get_loc('Order_Status') + 1
-                    for row in range(2, worksheet.max_row + 1):
-                        status_cell = worksheet.cell(row=row, column=status_col_idx)
-                        fill_color = None
-                        if '🔴' in str(status_cell.value):
-                            fill_color = urgent_fill
-                        elif '🟡' in str(status_cell.value):
-                            fill_color = soon_fill
-                        elif '🟢' in str(status_cell.value):
-                            fill_color = ok_fill
-                        if fill_color:
-                            for col in range(1, worksheet.max_column + 1):
-                                worksheet.cell(row=row, column=col).fill = fill_color
-                worksheet.freeze_panes = 'C2'
-
-            elif sheet_name == '🚨 Urgent Reorders':
-                apply_column_formatting(worksheet, results_df)
-                for row in range(2, worksheet.max_row + 1):
-                    for col in range(1, worksheet.max_column + 1):
-                        worksheet.cell(row=row, column=col).fill = urgent_fill
-                worksheet.freeze_panes = 'C2'
-
-            elif sheet_name == '🟡 Reorder Soon':
-                apply_column_formatting(worksheet, results_df)
-                for row in range(2, worksheet.max_row + 1):
-                    for col in range(1, worksheet.max_column + 1):
-                        worksheet.cell(row=row, column=col).fill = soon_fill
-                worksheet.freeze_panes = 'C2'
-
-            elif sheet_name == '📈 Forecasted Demand':
-                apply_column_formatting(worksheet, forecast_df)
-                worksheet.freeze_panes = 'A2'
-
-            elif sheet_name == '📊 Executive Summary':
-                worksheet.column_dimensions['A'].width = 45
-                worksheet.column_dimensions['B'].width = 25
-                worksheet.column_dimensions['C'].width = 15
-
-                for row_idx in range(1, worksheet.max_row + 1):
-                    metric_cell = worksheet.cell(row=row_idx, column=1)
-                    value_cell = worksheet.cell(row=row_idx, column=2)
-                    unit_cell = worksheet.cell(row=row_idx, column=3)
-                    
-                    metric_text = str(metric_cell.value).strip() if metric_cell.value else ''
-                    value_text = str(value_cell.value).strip() if value_cell.value else ''
-                    
-                    if metric_text.startswith('═══'):
-                        for col in range(1, 4):
-                            cell = worksheet.cell(row=row_idx, column=col)
-                            cell.fill = section_header_fill
-                            cell.font = section_header_font
-                            cell.alignment = Alignment(horizontal='center', vertical='center')
-                        continue
-                    
-                    value_cell.alignment = Alignment(horizontal='right', vertical='center')
-                    unit_cell.alignment = Alignment(horizontal='left', vertical='center')
-                    
-                    # MODIFIED: Removed currency formatting logic
-                    if value_text:
-                        if value_text.endswith('%'):
-                            try:
-                                num_str = value_text.replace('%', '').replace(',', '')
-                                num_val = float(num_str) / 100
-                                value_cell.value = num_val
-                                value_cell.number_format = PERCENT_FORMAT
-                            except:
-                                pass
-                        elif value_text.replace(',', '').replace('.', '').replace('-', '').isdigit():
-                            try:
-                                num_val = float(value_text.replace(',', ''))
-                                value_cell.value = num_val
-                                value_cell.number_format = NUMBER_FORMAT if num_val >= 10 else NUMBER_DECIMAL_FORMAT
-                            except:
-                                pass
-                    
-                    if metric_text.startswith('🔴'):
-                        for col in range(1, 4):
-                            worksheet.cell(row=row_idx, column=col).fill = urgent_fill
-                    elif metric_text.startswith('🟡'):
-                        for col in range(1, 4):
-                            worksheet.cell(row=row_idx, column=col).fill = soon_fill
-                    elif metric_text.startswith('🟢'):
-                        for col in range(1, 4):
-                            worksheet.cell(row=row_idx, column=col).fill = ok_fill
-
-                worksheet.freeze_panes = 'A2'
-
-            elif sheet_name == '📊 Category Summary':
-                apply_column_formatting(worksheet, None)  # Basic formatting
-                worksheet.freeze_panes = 'A2'
-
-            elif sheet_name == '📅 Procurement Timeline':
-                apply_column_formatting(worksheet, None)  # Basic formatting
-                worksheet.freeze_panes = 'A2'
-
-            elif sheet_name == '⚙️ Procurement Parameters':
-                worksheet.freeze_panes = 'A2'
-
-            elif sheet_name == '📋 Current Inventory':
-                worksheet.freeze_panes = 'A2'
-
-            elif sheet_name == '⚠️ Skipped SKUs':
-                worksheet.freeze_panes = 'A2'
-
-            elif sheet_name == '❌ Missing Data':
-                worksheet.freeze_panes = 'A2'
-
-            else:
-                # For any other sheets not explicitly handled above
-                worksheet.freeze_panes = 'A2'
-
-        print("✅ Applied professional Excel formatting (cost columns removed)")
-
-    # ==========================================================================
-    # MAIN EXECUTION
-    # ==========================================================================
+                progress_callback(event)
+            except Exception as e:
+                print(f"⚠️ Progress callback failed for stage {stage}: {e}")
 
     try:
         print("\n" + "="*80)
@@ -4681,25 +4456,30 @@ def run_forecast_bom_analysis(gc_client=None):
 
         # 2. Fetch BOM
         bom_df = fetch_bom_from_sheet(client, BOM_CONFIG['SPREADSHEET_URL'], BOM_CONFIG['WORKSHEET_NAME'])
+        report_stage("fetch_bom", 15)
 
         # 3. Build BOM structure
         bom_structure = build_bom_structure_from_sheet(bom_df)
+        report_stage("build_structure", 25)
 
         # 4. Get forecast
         forecast_df, skipped_skus = fetch_forecast_demand_from_sheets(client, bom_df, BOM_CONFIG)
+        report_stage("forecast_lookup", 40)
 
         if len(forecast_df) == 0:
             print("\n❌ No valid forecasts found.")
-            return None, None
+            return None, None, None
 
         # 5. Aggregate requirements
         requirements = aggregate_requirements(forecast_df, bom_structure)
 
         # 6. Final requirements
         results_df = calculate_final_requirements(requirements, inventory=None)
+        report_stage("explode", 55)
 
         # 7. ABC Classification
         results_df = calculate_abc_classification(results_df, BOM_CONFIG)
+        report_stage("abc", 65)
 
         # 8. Procurement parameters
         procurement_df = fetch_procurement_parameters(client, BOM_CONFIG['PROCUREMENT_PARAMS_URL'],
@@ -4716,6 +4496,7 @@ def run_forecast_bom_analysis(gc_client=None):
         # 10. ROP & procurement
         results_df, missing_procurement_data = calculate_rop_and_procurement(results_df, procurement_df,
                                                                              inventory_df, BOM_CONFIG)
+        report_stage("procurement", 80)
 
         # 11. Category summary
         category_summary = create_category_summary(results_df)
@@ -4727,50 +4508,48 @@ def run_forecast_bom_analysis(gc_client=None):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f'HG_BOM_Analysis_{timestamp}.xlsx'
 
-        excel_buffer = BytesIO()
-
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
+        # Tables in workbook tab order; the workbook itself is only rendered
+        # when it is downloaded or uploaded to Drive
+        bom_sheet_frames = {}
 
-            exec_summary_df = create_executive_summary(results_df, forecast_df, skipped_skus, category_summary)
-            exec_summary_df.to_excel(writer, sheet_name='📊 Executive Summary', index=False)
+        exec_summary_df = create_executive_summary(results_df, forecast_df, skipped_skus, category_summary)
+        bom_sheet_frames['📊 Executive Summary'] = exec_summary_df
 
-            results_df.to_excel(writer, sheet_name='📦 MRP Requirements', index=False)
+        bom_sheet_frames['📦 MRP Requirements'] = results_df
 
-            if len(category_summary) > 0:
-                category_summary.to_excel(writer, sheet_name='📊 Category Summary', index=False)
-
-            if len(procurement_timeline) > 0:
-                procurement_timeline.to_excel(writer, sheet_name='📅 Procurement Timeline', index=False)
+        if len(category_summary) > 0:
+            bom_sheet_frames['📊 Category Summary'] = category_summary
 
-            urgent = results_df[results_df['Order_Status'] == '🔴 Urgent Reorder'].copy()
-            if len(urgent) > 0:
-                urgent.to_excel(writer, sheet_name='🚨 Urgent Reorders', index=False)
+        if len(procurement_timeline) > 0:
+            bom_sheet_frames['📅 Procurement Timeline'] = procurement_timeline
 
-            reorder_soon = results_df[results_df['Order_Status'] == '🟡 Reorder Soon'].copy()
-            if len(reorder_soon) > 0:
-                reorder_soon.to_excel(writer, sheet_name='🟡 Reorder Soon', index=False)
+        urgent = results_df[results_df['Order_Status'] == '🔴 Urgent Reorder'].copy()
+        if len(urgent) > 0:
+            bom_sheet_frames['🚨 Urgent Reorders'] = urgent
 
-            forecast_df.to_excel(writer, sheet_name='📈 Forecasted Demand', index=False)
-            procurement_df.to_excel(writer, sheet_name='⚙️ Procurement Parameters', index=False)
-            inventory_df.to_excel(writer, sheet_name='📋 Current Inventory', index=False)
+        reorder_soon = results_df[results_df['Order_Status'] == '🟡 Reorder Soon'].copy()
+        if len(reorder_soon) > 0:
+            bom_sheet_frames['🟡 Reorder Soon'] = reorder_soon
 
-            if skipped_skus and len(skipped_skus) > 0:
-                skipped_df = pd.DataFrame(skipped_skus)
-                skipped_df.to_excel(writer, sheet_name='⚠️ Skipped SKUs', index=False)
+        bom_sheet_frames['📈 Forecasted Demand'] = forecast_df
+        bom_sheet_frames['⚙️ Procurement Parameters'] = procurement_df
+        bom_sheet_frames['📋 Current Inventory'] = inventory_df
 
-            if missing_procurement_data:
-                missing_df = pd.DataFrame({'Missing_Data': missing_procurement_data})
-                missing_df[['Component_ID', 'Reason']] = missing_df['Missing_Data'].str.split(':', expand=True, n=1)
-                missing_df['Description'] = missing_df['Component_ID'].map(
-                    results_df.set_index('Component_ID')['Description'].to_dict()
-                ).fillna('')
-                missing_df = missing_df[['Component_ID', 'Description', 'Reason']]
-                missing_df.to_excel(writer, sheet_name='❌ Missing Data', index=False)
+        if skipped_skus and len(skipped_skus) > 0:
+            skipped_df = pd.DataFrame(skipped_skus)
+            bom_sheet_frames['⚠️ Skipped SKUs'] = skipped_df
 
-            format_excel_output(writer, results_df, forecast_df, procurement_df, inventory_df,
-                               skipped_skus, missing_procurement_data)
+        if missing_procurement_data:
+            missing_df = pd.DataFrame({'Missing_Data': missing_procurement_data})
+            missing_df[['Component_ID', 'Reason']] = missing_df['Missing_Data'].str.split(':', expand=True, n=1)
+            missing_df['Description'] = missing_df['Component_ID'].map(
+                results_df.set_index('Component_ID')['Description'].to_dict()
+            ).fillna('')
+            missing_df = missing_df[['Component_ID', 'Description', 'Reason']]
+            bom_sheet_frames['❌ Missing Data'] = missing_df
 
-        excel_buffer.seek(0)
+        bom_result = get_run_result_cache().put(BOMAnalysisResult(bom_sheet_frames, filename))
+        report_stage("export", 90)
 
         # Print summary
         print(f"\n💾 Results ready for download: {filename}")
@@ -4789,34 +4568,24 @@ def run_forecast_bom_analysis(gc_client=None):
 
         print("\n✅ MRP WITH PROCUREMENT LOGIC COMPLETE!\n")
 
-        # NEW: Upload BOM output to Google Sheets and Google Drive
+        # Upload BOM output to Google Sheets and Google Drive in the background
+        publish_job = None
         try:
             print("\n" + "="*80)
             print("📤 UPLOADING BOM OUTPUT TO CLOUD SERVICES".center(80))
             print("="*80)
             
-            # Upload to Google Sheets
-            excel_buffer.seek(0)  # Reset buffer position
-            bom_sheet_url = upload_bom_excel_to_google_sheet(excel_buffer)
-            
-            # Upload to Google Drive
-            excel_buffer.seek(0)  # Reset buffer position again
-            bom_drive_file_id = upload_bom_to_google_drive_from_buffer(excel_buffer)
-            
-            print("\n✅ BOM output successfully uploaded to:")
-            print(f"   📊 Google Sheets: {bom_sheet_url}")
-            print(f"   📁 Google Drive File ID: {bom_drive_file_id}")
+            publish_job = submit_publish_job("BOM", bom_sheet_frames, BOM_OUTPUT_SHEET_ID,
+                                             bom_result.excel_bytes, upload_bom_to_google_drive_from_buffer)
+            report_stage("upload_queued", 95)
             
         except Exception as e:
-            print(f"\n⚠️ Warning: Failed to upload BOM output to cloud: {str(e)}")
+            print(f"\n⚠️ Warning: Failed to queue BOM output upload: {str(e)}")
             print("   📥 Local download will still be available.")
             import traceback
             traceback.print_exc()
 
-        # Reset buffer for download
-        excel_buffer.seek(0)
-        
-        return excel_buffer, filename
+        return bom_result, filename, publish_job
 
     except Exception as e:
         print(f"\n❌ ERROR: {str(e)}\n")
@@ -4833,530 +4602,851 @@ def run_forecast_bom_analysis(gc_client=None):
         print("5. Worksheet names are correct (case-sensitive)")
         import traceback
         traceback.print_exc()
-        return None, None
+        return None, None, None
 
-def upload_bom_excel_to_google_sheet(excel_buffer, sheet_id=None):
-    """
-    Upload BOM Excel output to a dedicated Google Sheet.
-    Reuses the same authentication pattern as the main upload function.
-    """
-    import pandas as pd
-    import numpy as np
-    import gspread
-    import time
-    import os
-    import json
-    from google.oauth2.service_account import Credentials
+# ==============================================================================
+# GOOGLE SHEETS PUBLISHING (DataFrames -> Sheets)
+# ==============================================================================
+# Result DataFrames are published straight to the output spreadsheets: one
+# structural batch_update (add/resize/clear tabs) and one values batch update
+# for all tabs, with numbers kept as numbers. No Excel round-trip. Repeat
+# publishes only send the rows whose content changed since the last one.
+# ==============================================================================
 
-    print("🔄 Uploading BOM output to Google Sheets...")
-    
-    # Ensure env var is present
+FORECAST_OUTPUT_SHEET_ID = "1051NJelrnQGKwKDXWmaMiU1-fBgm4ZSd4s_G2-hJIcE"
+BOM_OUTPUT_SHEET_ID = "1_wXJDNZeZ7Y31S_i3UUDQ89vCbJC-xotm3wADBSf5eY"
+
+
+def authorize_sheets_writer():
+    """gspread client with write access, built from the gcp_service_account_sheets secret."""
     if "gcp_service_account_sheets" not in os.environ:
         raise FileNotFoundError("❌ No GCP service account credentials found in environment variables.")
 
     try:
-        raw_secret = os.environ["gcp_service_account_sheets"]
-        creds_dict = json.loads(raw_secret)
+        creds_dict = json.loads(os.environ["gcp_service_account_sheets"])
         print(f"✅ Loaded service account for: {creds_dict.get('client_email', 'UNKNOWN EMAIL')}")
-    except Exception as e:
+    except Exception:
         print("❌ Failed to parse service account secret")
-        import traceback
         traceback.print_exc()
         raise
-    
-    # Save to temp file
-    credentials_file = "temp_bom_sheet_credentials.json"
-    with open(credentials_file, "w") as f:
-        json.dump(creds_dict, f)
 
-    # Create credentials from temp file
     scopes = ['https://www.googleapis.com/auth/spreadsheets']
-    credentials = Credentials.from_service_account_file(credentials_file, scopes=scopes)
-    gc = gspread.authorize(credentials)
+    credentials = Credentials.from_service_account_info(creds_dict, scopes=scopes)
+    return gspread.authorize(credentials)
+
+
+def _sheet_cell(value):
+    """Convert one object-column value to something the Sheets API accepts."""
+    if value is None or isinstance(value, str):
+        return '' if value is None else value
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value) if np.isfinite(value) else ''
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return '' if pd.isna(value) else value.strftime('%Y-%m-%d')
+    try:
+        if pd.isna(value):
+            return ''
+    except (TypeError, ValueError):
+        pass
+    return str(value)
+
+
+def dataframe_to_sheet_values(df):
+    """
+    Header row + data rows for a values update. Numeric columns stay numeric,
+    NaN/inf become blanks and dates are written as YYYY-MM-DD.
+    """
+    columns = []
+    for name in df.columns:
+        col = df[name]
+        if pd.api.types.is_datetime64_any_dtype(col):
+            values = col.dt.strftime('%Y-%m-%d').astype(object).where(col.notna(), '')
+        elif pd.api.types.is_bool_dtype(col):
+            values = col.astype(object)
+        elif pd.api.types.is_numeric_dtype(col):
+            finite = np.isfinite(col.to_numpy(dtype=float, na_value=np.nan))
+            values = col.astype(object).where(finite, '')
+        else:
+            values = col.astype(object).map(_sheet_cell)
+        columns.append(values.to_numpy(dtype=object))
+
+    header = [str(name) for name in df.columns]
+    if not columns:
+        return [header]
+    return [header] + np.column_stack(columns).tolist()
+
+
+def _a1_sheet_title(title):
+    return "'" + title.replace("'", "''") + "'"
+
+
+def _a1_column(n):
+    """1-based column number to A1 letters (1 -> A, 27 -> AA)."""
+    letters = ""
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _row_hashes(values):
+    """64-bit content hash per data row (header excluded), as hex strings."""
+    if len(values) <= 1:
+        return []
+    rows = pd.DataFrame(values[1:], dtype=object)
+    return [format(h, '016x') for h in pd.util.hash_pandas_object(rows, index=False).to_numpy()]
+
+
+def _changed_row_runs(old_hashes, new_hashes, merge_gap=3):
+    """
+    Contiguous [start, end) runs of data rows whose hash changed or that are new.
+    Runs separated by at most merge_gap unchanged rows are merged into one range.
+    """
+    old = np.array(old_hashes, dtype=object)
+    new = np.array(new_hashes, dtype=object)
+    overlap = min(len(old), len(new))
+
+    changed = np.zeros(len(new), dtype=bool)
+    changed[:overlap] = old[:overlap] != new[:overlap]
+    changed[overlap:] = True
+
+    idx = np.flatnonzero(changed)
+    if len(idx) == 0:
+        return []
+
+    breaks = np.flatnonzero(np.diff(idx) > merge_gap + 1)
+    starts = np.concatenate([[idx[0]], idx[breaks + 1]])
+    ends = np.concatenate([idx[breaks], [idx[-1]]]) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+class SheetPublishState:
+    """
+    Per-spreadsheet record of what the last publish wrote: for each tab its
+    header, sheetId and one hash per row. Stored as JSON under BASE_DIR and
+    paired with a developer-metadata publish id on the spreadsheet, so a state
+    file that does not match the sheet (another instance published, or a
+    publish failed halfway) is ignored and the tabs are fully rewritten.
+    """
+
+    STATE_DIR = os.path.join(BASE_DIR, ".sheets_publish_state")
+    METADATA_KEY = "hg_publish_id"
 
-    # Clean up temp file
-    try:
-        os.remove(credentials_file)
-    except:
-        pass
+    @classmethod
+    def lock(cls, sheet_id):
+        """Exclusive across processes; hold it from reading the state until it is saved."""
+        return _file_lock(os.path.join(cls.STATE_DIR, f"{sheet_id}.lock"))
 
-    # BOM-specific Google Sheet ID
-    if sheet_id is None:
-        sheet_id = "1_wXJDNZeZ7Y31S_i3UUDQ89vCbJC-xotm3wADBSf5eY"
+    def __init__(self, sheet_id):
+        self.path = os.path.join(self.STATE_DIR, f"{sheet_id}.json")
+        self.publish_id = None
+        self.tabs = {}
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+            self.publish_id = state.get('publish_id')
+            self.tabs = state.get('tabs', {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable publish state {self.path}: {e}")
 
-    try:
-        sheet = gc.open_by_key(sheet_id)
-        print(f"🔁 Connected to BOM Google Sheet: {sheet.title}")
-    except Exception as e:
-        print("❌ Failed to connect to BOM Google Sheet:", e)
-        raise
+    def save(self, publish_id, tabs):
+        os.makedirs(self.STATE_DIR, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({'publish_id': publish_id, 'tabs': tabs}, f)
+        os.replace(tmp_path, self.path)
 
-    try:
-        # Read Excel from buffer
-        excel_buffer.seek(0)
-        all_sheets = pd.read_excel(excel_buffer, sheet_name=None, engine="openpyxl")
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
 
-        # Existing sheet names
-        existing_titles = [ws.title for ws in sheet.worksheets()]
 
-        for i, (sheet_name, df) in enumerate(all_sheets.items()):
-            df = df.replace([np.nan, np.inf, -np.inf], "").astype(str)
+def publish_frames_to_google_sheet(frames, sheet_id, label="output", gc=None, incremental=True):
+    """
+    Publish {tab title: DataFrame} to a Google Sheet.
+
+    With incremental=True only rows whose content hash changed since the last
+    publish are sent; removed trailing rows are cleared. A tab is rewritten in
+    full when it is new, its header changed, or the saved state doesn't match
+    the sheet. Structural changes and clears go out in one batch_update and
+    all values in one values batch update. Returns the spreadsheet URL, or
+    None on failure.
+    """
+    print(f"🔄 Publishing {len(frames)} {label} tabs to Google Sheets...")
+    # Another process publishing the same sheet would interleave state reads and writes
+    with SheetPublishState.lock(sheet_id):
+        state = SheetPublishState(sheet_id)
 
-            # Reuse existing sheet if available
-            if sheet_name in existing_titles:
-                ws = sheet.worksheet(sheet_name)
-                ws.clear()
+        try:
+            gc = gc or authorize_sheets_writer()
+            spreadsheet = gc.open_by_key(sheet_id)
+            print(f"🔁 Connected to Google Sheet: {spreadsheet.title}")
+
+            metadata = spreadsheet.fetch_sheet_metadata()
+            existing = {s['properties']['title']: s['properties'] for s in metadata.get('sheets', [])}
+            next_sheet_id = max((p['sheetId'] for p in existing.values()), default=0) + 1
+
+            sheet_publish_id = next(
+                (m.get('metadataValue') for m in metadata.get('developerMetadata', [])
+                 if m.get('metadataKey') == SheetPublishState.METADATA_KEY),
+                None
+            )
+            state_matches = incremental and state.publish_id is not None and state.publish_id == sheet_publish_id
+            if incremental and not state_matches:
+                print("   ℹ️ No matching publish state for this sheet, rewriting all tabs")
+
+            new_publish_id = uuid.uuid4().hex
+            requests = []
+            data = []
+            new_tabs = {}
+            cells_written = 0
+
+            for title, df in frames.items():
+                title = title[:99]
+                values = dataframe_to_sheet_values(df)
+                header = values[0]
+                n_rows, n_cols = len(values), max(len(header), 1)
+                row_hashes = _row_hashes(values)
+                last_col = _a1_column(n_cols)
+
+                props = existing.get(title)
+                if props is None:
+                    tab_sheet_id = next_sheet_id
+                    next_sheet_id += 1
+                    requests.append({'addSheet': {'properties': {
+                        'sheetId': tab_sheet_id,
+                        'title': title,
+                        'gridProperties': {'rowCount': n_rows + 50, 'columnCount': n_cols + 10},
+                    }}})
+                else:
+                    tab_sheet_id = props['sheetId']
+                    grid = props.get('gridProperties', {})
+                    if grid.get('rowCount', 0) < n_rows or grid.get('columnCount', 0) < n_cols:
+                        requests.append({'updateSheetProperties': {
+                            'properties': {'sheetId': tab_sheet_id, 'gridProperties': {
+                                'rowCount': max(grid.get('rowCount', 0), n_rows + 50),
+                                'columnCount': max(grid.get('columnCount', 0), n_cols + 10),
+                            }},
+                            'fields': 'gridProperties.rowCount,gridProperties.columnCount',
+                        }})
+
+                previous = state.tabs.get(title) if state_matches else None
+                full_rewrite = (
+                    props is None or previous is None
+                    or previous.get('header') != header
+                    or previous.get('sheet_id') != tab_sheet_id
+                )
+
+                if full_rewrite:
+                    if props is not None:
+                        requests.append({'updateCells': {'range': {'sheetId': tab_sheet_id}, 'fields': 'userEnteredValue'}})
+                    data.append({'range': f"{_a1_sheet_title(title)}!A1", 'values': values})
+                    cells_written += n_rows * n_cols
+                else:
+                    for start, end in _changed_row_runs(previous.get('row_hashes', []), row_hashes):
+                        # Data row i lives on sheet row i + 2 (row 1 is the header)
+                        data.append({
+                            'range': f"{_a1_sheet_title(title)}!A{start + 2}:{last_col}{end + 1}",
+                            'values': values[start + 1:end + 1],
+                        })
+                        cells_written += (end - start) * n_cols
+
+                    old_rows = len(previous.get('row_hashes', []))
+                    if old_rows > n_rows - 1:
+                        requests.append({'updateCells': {
+                            'range': {'sheetId': tab_sheet_id, 'startRowIndex': n_rows, 'endRowIndex': old_rows + 1},
+                            'fields': 'userEnteredValue',
+                        }})
+
+                new_tabs[title] = {'header': header, 'sheet_id': tab_sheet_id, 'row_hashes': row_hashes}
+
+            # Tag the sheet with this publish so the saved state can be trusted next time
+            publish_id_request = {'developerMetadata': {'metadataValue': new_publish_id}, 'fields': 'metadataValue',
+                                  'dataFilters': [{'developerMetadataLookup': {'metadataKey': SheetPublishState.METADATA_KEY}}]}
+            if sheet_publish_id is not None:
+                requests.append({'updateDeveloperMetadata': publish_id_request})
             else:
-                # Add new sheet with enough space
-                ws = sheet.add_worksheet(title=sheet_name[:99], rows=str(len(df)+50), cols=str(len(df.columns)+10))
+                requests.append({'createDeveloperMetadata': {'developerMetadata': {
+                    'metadataKey': SheetPublishState.METADATA_KEY,
+                    'metadataValue': new_publish_id,
+                    'location': {'spreadsheet': True},
+                    'visibility': 'DOCUMENT',
+                }}})
+
+            # Forget the old state before touching the sheet; a failure below forces a full rewrite
+            state.discard()
+            spreadsheet.batch_update({'requests': requests})
+            if data:
+                spreadsheet.values_batch_update({'valueInputOption': 'RAW', 'data': data})
+            state.save(new_publish_id, new_tabs)
+
+            total_cells = sum((len(t['row_hashes']) + 1) * len(t['header']) for t in new_tabs.values())
+            print(f"✅ Published {len(new_tabs)} tabs: {len(data)} ranges, {cells_written:,} of {total_cells:,} cells written")
+            return f"https://docs.google.com/spreadsheets/d/{sheet_id}"
 
-            # Push to Google Sheet
-            try:
-                ws.update([df.columns.tolist()] + df.values.tolist())
-                print(f"✅ Updated BOM sheet: {sheet_name}")
-            except Exception as e:
-                print(f"⚠️ Error updating '{sheet_name}': {e}")
-            
-            time.sleep(1)  # Add delay to avoid quota issues
+        except Exception as e:
+            print(f"❌ Error publishing {label} to Google Sheets: {e}")
+            traceback.print_exc()
+            return None
 
-        print(f"✅ BOM output uploaded to Google Sheets successfully")
-        return f"https://docs.google.com/spreadsheets/d/{sheet_id}"
 
-    except Exception as e:
-        print("❌ Unexpected error while uploading BOM to Google Sheets:", e)
-        import traceback
-        traceback.print_exc()
-        return None
+def upload_bom_excel_to_google_sheet(excel_buffer, sheet_id=None):
+    """
+    Upload BOM Excel output to the dedicated BOM Google Sheet.
+    Kept for callers that only have the workbook; run_forecast_bom_analysis()
+    publishes its DataFrames directly.
+    """
+    excel_buffer.seek(0)
+    all_sheets = pd.read_excel(excel_buffer, sheet_name=None, engine="openpyxl")
+    return publish_frames_to_google_sheet(all_sheets, sheet_id or BOM_OUTPUT_SHEET_ID, "BOM")
 
 
 # NEW: BOM-specific Google Drive Upload Function
 # PLACEMENT: Immediately after upload_bom_excel_to_google_sheet
 
-def upload_bom_to_google_drive_from_buffer(buffer):
-    """
-    Upload BOM Excel output to Google Drive with timestamped backup.
-    Reuses the same authentication pattern as the main upload function.
-    """
-    from datetime import datetime
-    from google.oauth2 import service_account
-    from googleapiclient.discovery import build
-    from googleapiclient.http import MediaIoBaseUpload
-    
-    SCOPES = ['https://www.googleapis.com/auth/drive']
-    SHARED_DRIVE_ID = '0ANRBYKNxrAXaUk9PVA'
-    FOLDER_ID = '0ANRBYKNxrAXaUk9PVA'
-    FIXED_FILENAME = "BOM Analysis Workbook.xlsx"
-    BOM_SUBFOLDER_ID = '1PHfLwnrl15wbu5si02Y1ZEqTs7EZKEp7'  # BOM-specific timestamp subfolder
+# ==============================================================================
+# GOOGLE DRIVE WORKBOOK UPLOADS
+# ==============================================================================
+# Workbooks go up as resumable, chunked uploads: each chunk is retried on its
+# own and a dropped connection resumes from the last byte Drive acknowledged.
+# Before uploading, the workbook's MD5 is compared with Drive's md5Checksum
+# and an unchanged workbook (and its timestamped backup) is skipped.
 
-    # Handle service account credentials - GCP only
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+DRIVE_SHARED_DRIVE_ID = '0ANRBYKNxrAXaUk9PVA'
+DRIVE_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # must be a multiple of 256 KiB
+DRIVE_CHUNK_RETRIES = 5                     # per-chunk retries inside the client
+DRIVE_RESUME_ATTEMPTS = 5                   # resumes after a chunk finally fails
+
+
+def authorize_drive_service():
+    """Drive v3 client for the service account in gcp_service_account_drive."""
     if "gcp_service_account_drive" not in os.environ:
         raise FileNotFoundError("❌ No Google Drive service account credentials found in environment variables.")
-    
-    print("🔄 Uploading BOM output to Google Drive...")
-    
-    # Load credentials from environment
+
     creds_dict = json.loads(os.environ["gcp_service_account_drive"])
-    
-    # Write to temporary file
-    SERVICE_ACCOUNT_FILE = "temp_bom_drive_service_account.json"
-    with open(SERVICE_ACCOUNT_FILE, "w") as f:
-        json.dump(creds_dict, f)
-    
-    # Initialize credentials and service
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES
+    credentials = service_account.Credentials.from_service_account_info(
+        creds_dict, scopes=['https://www.googleapis.com/auth/drive']
     )
-    drive_service = build('drive', 'v3', credentials=credentials)
+    return build('drive', 'v3', credentials=credentials)
 
-    # ==========================================================================
-    # PART 1: Update/Create main BOM file
-    # ==========================================================================
-    
-    # Check if file with same name already exists
-    query = f"'{FOLDER_ID}' in parents and name = '{FIXED_FILENAME}' and trashed = false"
+
+def _drive_find_file(drive_service, parent_id, name, mime_type=None):
+    """First non-trashed file called `name` under parent_id, with its md5Checksum, or None."""
+    query = f"'{parent_id}' in parents and name = '{name}' and trashed = false"
+    if mime_type:
+        query += f" and mimeType = '{mime_type}'"
     result = drive_service.files().list(
         q=query,
-        fields="files(id)",
+        fields="files(id, name, md5Checksum)",
         supportsAllDrives=True,
         includeItemsFromAllDrives=True,
         corpora="drive",
-        driveId=SHARED_DRIVE_ID
+        driveId=DRIVE_SHARED_DRIVE_ID
     ).execute()
+    files = result.get("files", [])
+    return files[0] if files else None
 
-    existing_files = result.get("files", [])
 
-    # If exists, update it
-    if existing_files:
-        file_id = existing_files[0]['id']
-        buffer.seek(0)
-        media = MediaIoBaseUpload(buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            resumable=True
-        )
-        updated_file = drive_service.files().update(
-            fileId=file_id,
+def _drive_resumable_upload(request, label):
+    """Drive a resumable upload request chunk by chunk; returns the final response."""
+    response = None
+    resumes = 0
+    last_pct = -1
+    while response is None:
+        try:
+            status, response = request.next_chunk(num_retries=DRIVE_CHUNK_RETRIES)
+        except (HttpError, ConnectionError, TimeoutError, OSError) as e:
+            retryable = not isinstance(e, HttpError) or e.resp.status in (408, 429, 500, 502, 503, 504)
+            if not retryable or resumes >= DRIVE_RESUME_ATTEMPTS:
+                raise
+            resumes += 1
+            wait = min(2 ** resumes, 30)
+            print(f"   ⚠️ Upload of {label} interrupted ({e}); resuming in {wait}s (attempt {resumes}/{DRIVE_RESUME_ATTEMPTS})")
+            time.sleep(wait)
+            continue
+        if status is not None:
+            pct = int(status.progress() * 100)
+            if pct != last_pct:
+                print(f"   ⬆️ {label}: {pct}%")
+                last_pct = pct
+    return response
+
+
+def upload_workbook_to_drive(drive_service, workbook_bytes, name, parent_id, existing=None):
+    """
+    Create or update `name` under parent_id with workbook_bytes.
+
+    `existing` is the file entry from _drive_find_file (looked up when not
+    given). Returns (file_id, uploaded); uploaded is False when Drive already
+    holds identical content.
+    """
+    if existing is None:
+        existing = _drive_find_file(drive_service, parent_id, name)
+
+    if existing and existing.get('md5Checksum') == hashlib.md5(workbook_bytes).hexdigest():
+        print(f"⏭️ {name} unchanged on Drive (ID: {existing['id']}), skipping upload")
+        return existing['id'], False
+
+    media = MediaIoBaseUpload(BytesIO(workbook_bytes), mimetype=XLSX_MIMETYPE,
+                              chunksize=DRIVE_UPLOAD_CHUNK_SIZE, resumable=True)
+    if existing:
+        request = drive_service.files().update(
+            fileId=existing['id'],
             media_body=media,
-            supportsAllDrives=True
-        ).execute()
-        print(f"♻️ Existing BOM file updated: {FIXED_FILENAME} (ID: {file_id})")
-    else:
-        buffer.seek(0)
-        media = MediaIoBaseUpload(buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            resumable=True
+            supportsAllDrives=True,
+            fields='id'
         )
-        file_metadata = {
-            'name': FIXED_FILENAME,
-            'parents': [FOLDER_ID],
-            'driveId': SHARED_DRIVE_ID
-        }
-        uploaded_file = drive_service.files().create(
-            body=file_metadata,
+    else:
+        request = drive_service.files().create(
+            body={'name': name, 'parents': [parent_id], 'driveId': DRIVE_SHARED_DRIVE_ID},
             media_body=media,
             supportsAllDrives=True,
             fields='id'
-        ).execute()
-        file_id = uploaded_file.get('id')
-        print(f"✅ New BOM file uploaded: {FIXED_FILENAME} (ID: {file_id})")
+        )
+    response = _drive_resumable_upload(request, name)
+    return response.get('id', existing['id'] if existing else None), True
+
+
+def upload_workbook_with_backup(buffer, fixed_filename, backup_prefix, label,
+                                backup_folder_id=None, backup_folder_name=None):
+    """
+    Upload the workbook to the shared drive under fixed_filename, then save a
+    timestamped copy to the backup folder (given by ID, or by name in the
+    shared drive root). Both are skipped when the content matches what is
+    already stored. Returns the main file's ID.
+    """
+    workbook_bytes = buffer.getvalue()
+    drive_service = authorize_drive_service()
+
+    file_id, uploaded = upload_workbook_to_drive(drive_service, workbook_bytes, fixed_filename, DRIVE_SHARED_DRIVE_ID)
+    if not uploaded:
+        return file_id
+    print(f"✅ {label} workbook uploaded: {fixed_filename} (ID: {file_id})")
 
-    # ==========================================================================
-    # PART 2: Save timestamped backup to BOM-specific subfolder
-    # ==========================================================================
-    
     try:
-        print("📁 Starting BOM timestamped backup process...")
-        
-        # Generate timestamped filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        timestamped_filename = f"BOM_Backup_{timestamp}.xlsx"
-        print(f"🕒 Generated timestamped filename: {timestamped_filename}")
-        
-        # Check if file with same timestamp already exists (overwrite if exists)
-        timestamp_query = f"'{BOM_SUBFOLDER_ID}' in parents and name = '{timestamped_filename}' and trashed = false"
-        timestamp_result = drive_service.files().list(
-            q=timestamp_query,
-            fields="files(id)",
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True,
-            corpora="drive",
-            driveId=SHARED_DRIVE_ID
-        ).execute()
-        
-        existing_timestamp_files = timestamp_result.get("files", [])
-        
-        # Upload or update timestamped file
-        buffer.seek(0)
-        media = MediaIoBaseUpload(buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            resumable=True
-        )
-        
-        if existing_timestamp_files:
-            # Update existing timestamped file
-            timestamp_file_id = existing_timestamp_files[0]['id']
-            updated_timestamp_file = drive_service.files().update(
-                fileId=timestamp_file_id,
-                media_body=media,
-                supportsAllDrives=True
-            ).execute()
-            print(f"🔄 Overwritten existing BOM timestamped backup: {timestamped_filename}")
-        else:
-            # Create new timestamped file
-            timestamp_file_metadata = {
-                'name': timestamped_filename,
-                'parents': [BOM_SUBFOLDER_ID],
-                'driveId': SHARED_DRIVE_ID
-            }
-            uploaded_timestamp_file = drive_service.files().create(
-                body=timestamp_file_metadata,
-                media_body=media,
-                supportsAllDrives=True,
-                fields='id'
-            ).execute()
-            print(f"✅ New BOM timestamped backup saved: {timestamped_filename}")
-            
-        print("📚 BOM timestamped backup process completed successfully!")
-        
+        print(f"📁 Starting {label} timestamped backup...")
+        if backup_folder_id is None:
+            folder = _drive_find_file(drive_service, DRIVE_SHARED_DRIVE_ID, backup_folder_name,
+                                      mime_type='application/vnd.google-apps.folder')
+            if folder is None:
+                raise FileNotFoundError(f"❌ Subfolder '{backup_folder_name}' not found. Please create it manually in your Drive folder.")
+            backup_folder_id = folder['id']
+        timestamped_filename = f"{backup_prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        upload_workbook_to_drive(drive_service, workbook_bytes, timestamped_filename, backup_folder_id)
+        print(f"📚 Timestamped backup saved: {timestamped_filename}")
     except Exception as e:
-        print(f"⚠️ Warning: Failed to save BOM timestamped backup: {str(e)}")
-        print("📝 Main BOM file upload was successful, continuing...")
+        print(f"⚠️ Warning: Failed to save {label} timestamped backup: {str(e)}")
+        print(f"📝 Main {label} file upload was successful, continuing...")
+
+    return file_id
 
-    # Clean up temp file
-    try:
-        os.remove(SERVICE_ACCOUNT_FILE)
-    except:
-        pass
 
+def upload_bom_to_google_drive_from_buffer(buffer):
+    """
+    Upload BOM Excel buffer to Google Drive with timestamped backup.
+    """
+    print("🔄 Uploading BOM output to Google Drive...")
+    BOM_SUBFOLDER_ID = '1PHfLwnrl15wbu5si02Y1ZEqTs7EZKEp7'  # BOM-specific timestamp subfolder
+    file_id = upload_workbook_with_backup(buffer, "BOM Analysis Workbook.xlsx", "BOM_Backup", "BOM",
+                                          backup_folder_id=BOM_SUBFOLDER_ID)
     print(f"✅ BOM output uploaded to Google Drive successfully")
     return file_id
 
 def upload_excel_to_google_sheet(excel_buffer, sheet_id=None):
-    import pandas as pd
-    import numpy as np
-    import gspread
-    import time
-    import os
-    import json
-    from google.oauth2.service_account import Credentials
+    """
+    Upload a finished forecast workbook to the forecast Google Sheet.
+    Kept for callers that only have the workbook; main() publishes its
+    DataFrames directly.
+    """
+    excel_buffer.seek(0)
+    all_sheets = pd.read_excel(excel_buffer, sheet_name=None, engine="openpyxl")
+    return publish_frames_to_google_sheet(all_sheets, sheet_id or FORECAST_OUTPUT_SHEET_ID, "forecast")
 
-    print("🔄 Using GCP credentials from environment...")
-    
-    # Ensure env var is present
-    if "gcp_service_account_sheets" not in os.environ:
-        raise FileNotFoundError("❌ No GCP service account credentials found in environment variables.")
+def upload_to_google_drive_from_buffer(buffer):
+    """
+    Upload the forecast workbook to Google Drive, with a timestamped copy in
+    Output_TimeStamps.
+    """
+    print("🔄 Uploading forecast workbook to Google Drive...")
+    return upload_workbook_with_backup(buffer, "Forecasting Excel Workbook Format.xlsx", "Forecasting_Backup", "forecast",
+                                       backup_folder_name="Output_TimeStamps")
 
-    # ✅ Debug: Check what we actually got from env
-    try:
-        raw_secret = os.environ["gcp_service_account_sheets"]
-        print(f"🔍 Secret length: {len(raw_secret)} characters")
-        creds_dict = json.loads(raw_secret)
-        print(f"✅ Loaded service account for: {creds_dict.get('client_email', 'UNKNOWN EMAIL')}")
-    except Exception as e:
-        print("❌ Failed to parse service account secret")
-        import traceback
-        traceback.print_exc()
-        raise
-    
-    # Save to temp file (exactly like your working function)
-    credentials_file = "temp_credentials.json"
-    with open(credentials_file, "w") as f:
-        json.dump(creds_dict, f)
-    print("✅ Credentials saved to temp file.")
 
-    # Create credentials from temp file
-    scopes = ['https://www.googleapis.com/auth/spreadsheets']
-    credentials = Credentials.from_service_account_file(credentials_file, scopes=scopes)
-    gc = gspread.authorize(credentials)
+# ==============================================================================
+# BACKGROUND PUBLISHING (Sheets + Drive off the request path)
+# ==============================================================================
+# main() and run_forecast_bom_analysis() hand their results to a small worker
+# pool and return as soon as the workbook is built. The Sheets publish and the
+# Drive upload run side by side; the PublishJob they share is what the UI polls
+# for status and the Drive file ID.
 
-    # Clean up temp file
-    try:
-        os.remove(credentials_file)
-        print("🧹 Cleaned up temp credentials file.")
-    except:
-        pass
+PUBLISH_WORKERS = 4
 
-    # ✅ Set your fixed Google Sheet ID here
-    if sheet_id is None:
-        sheet_id = "1051NJelrnQGKwKDXWmaMiU1-fBgm4ZSd4s_G2-hJIcE"
 
-    try:
-        sheet = gc.open_by_key(sheet_id)
-        print(f"🔁 Connected to Google Sheet: {sheet.title}")
-    except Exception as e:
-        print("❌ Failed to connect to Google Sheet:", e)
-        raise
+class PublishJob:
+    """Status of one background publish (Sheets tabs + Drive workbook)."""
 
-    try:
-        # Read Excel from buffer
-        excel_buffer.seek(0)
-        all_sheets = pd.read_excel(excel_buffer, sheet_name=None, engine="openpyxl")
+    TARGETS = ("sheets", "drive")
 
-        # Existing sheet names
-        existing_titles = [ws.title for ws in sheet.worksheets()]
+    def __init__(self, label):
+        self.label = label
+        self.submitted_at = datetime.now()
+        self.finished_at = None
+        self.status = {target: "queued" for target in self.TARGETS}
+        self.errors = {}
+        self.sheet_url = None
+        self.drive_file_id = None
+        self._lock = threading.Lock()
 
-        for i, (sheet_name, df) in enumerate(all_sheets.items()):
-            df = df.replace([np.nan, np.inf, -np.inf], "").astype(str)
+    def _run(self, target, fn):
+        with self._lock:
+            self.status[target] = "running"
+        try:
+            result = fn()
+            with self._lock:
+                if target == "sheets":
+                    self.sheet_url = result
+                else:
+                    self.drive_file_id = result
+                self.status[target] = "done" if result else "failed"
+        except Exception as e:
+            print(f"❌ Background {target} publish for {self.label} failed: {e}")
+            traceback.print_exc()
+            with self._lock:
+                self.status[target] = "failed"
+                self.errors[target] = str(e)
+        finally:
+            with self._lock:
+                if self.done and self.finished_at is None:
+                    self.finished_at = datetime.now()
+                    elapsed = (self.finished_at - self.submitted_at).total_seconds()
+                    print(f"📤 {self.label} publish finished in {elapsed:.1f}s: {self.status}")
 
-            # Reuse existing sheet if available
-            if sheet_name in existing_titles:
-                ws = sheet.worksheet(sheet_name)
-                ws.clear()
-            else:
-                # Add new sheet with enough space
-                ws = sheet.add_worksheet(title=sheet_name[:99], rows=str(len(df)+50), cols=str(len(df.columns)+10))
+    @property
+    def done(self):
+        return all(s in ("done", "failed") for s in self.status.values())
 
-            # Push to Google Sheet
-            try:
-                ws.update([df.columns.tolist()] + df.values.tolist())
-                print(f"✅ Updated sheet: {sheet_name}")
-            except Exception as e:
-                print(f"⚠️ Error updating '{sheet_name}': {e}")
-            
-            time.sleep(1)  # Add delay to avoid quota issues
+    def describe(self):
+        icons = {"queued": "⏳", "running": "🔄", "done": "✅", "failed": "❌"}
+        with self._lock:
+            return " · ".join(f"{icons[s]} {target.title()}: {s}" for target, s in self.status.items())
 
-        return f"https://docs.google.com/spreadsheets/d/{sheet_id}"
 
-    except Exception as e:
-        print("❌ Unexpected error while uploading to Google Sheets:", e)
-        import traceback
-        traceback.print_exc()
-        return None
-     
-def upload_to_google_drive_from_buffer(buffer):
-    from datetime import datetime
-    # BASE_DIR = os.path.dirname(__file__)
-    # SERVICE_ACCOUNT_FILE = os.path.join(BASE_DIR, "GoogleDriveAPIKey.json")
-    SCOPES = ['https://www.googleapis.com/auth/drive']
-    SHARED_DRIVE_ID = '0ANRBYKNxrAXaUk9PVA'
-    FOLDER_ID = '0ANRBYKNxrAXaUk9PVA'
-    FIXED_FILENAME = "Forecasting Excel Workbook Format.xlsx"
-    SUBFOLDER_NAME = "Output_TimeStamps"
-
-    # Handle service account credentials - GCP only
-    if "gcp_service_account_drive" not in os.environ:
-        raise FileNotFoundError("❌ No Google Drive service account credentials found in environment variables.")
-    
-    print("🔄 Using Google Drive credentials from environment...")
-    
-    # Load credentials from environment
-    creds_dict = json.loads(os.environ["gcp_service_account_drive"])
-    
-    # Write to temporary file (required for from_service_account_file)
-    SERVICE_ACCOUNT_FILE = "temp_service_account.json"
-    with open(SERVICE_ACCOUNT_FILE, "w") as f:
-        json.dump(creds_dict, f)
-    
-    print("✅ Google Drive credentials loaded and saved to temp file.")
-    
-    # Initialize credentials and service
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES
-    )
-    drive_service = build('drive', 'v3', credentials=credentials)
+@st.cache_resource
+def get_publish_executor():
+    """One worker pool per server process, shared across Streamlit reruns and API calls."""
+    return ThreadPoolExecutor(max_workers=PUBLISH_WORKERS, thread_name_prefix="publish")
 
-    # =============================================================================
-    # PART 1: Original functionality - Update/Create main file
-    # =============================================================================
-    
-    # Check if file with same name already exists
-    query = f"'{FOLDER_ID}' in parents and name = '{FIXED_FILENAME}' and trashed = false"
-    result = drive_service.files().list(
-        q=query,
-        fields="files(id)",
-        supportsAllDrives=True,
-        includeItemsFromAllDrives=True,
-        corpora="drive",
-        driveId=SHARED_DRIVE_ID
-    ).execute()
 
-    existing_files = result.get("files", [])
+def submit_publish_job(label, frames, sheet_id, workbook, drive_uploader):
+    """
+    Queue the Sheets publish and the Drive upload for one result and return
+    the PublishJob immediately. `workbook` is either the workbook bytes or a
+    zero-argument callable returning them; a callable is invoked on the
+    worker, so a lazily rendered workbook is built off the request path.
+    """
+    job = PublishJob(label)
+    executor = get_publish_executor()
+    executor.submit(job._run, "sheets",
+                    lambda: publish_frames_to_google_sheet(frames, sheet_id, label))
+    executor.submit(job._run, "drive",
+                    lambda: drive_uploader(BytesIO(workbook() if callable(workbook) else workbook)))
+    print(f"📤 Queued {label} publish to Google Sheets and Drive")
+    return job
 
-    # If exists, update it
-    if existing_files:
-        file_id = existing_files[0]['id']
-        buffer.seek(0)
-        media = MediaIoBaseUpload(buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            resumable=True
-        )
-        updated_file = drive_service.files().update(
-            fileId=file_id,
-            media_body=media,
-            supportsAllDrives=True
-        ).execute()
-        print(f"♻️ Existing file updated: {FIXED_FILENAME} (ID: {file_id})")
+
+# ==============================================================================
+# STREAMING FORECAST REPORT WRITER
+# ==============================================================================
+# The forecast workbook is written with xlsxwriter's constant_memory mode: each
+# sheet is streamed to disk row by row, so peak memory no longer grows with
+# the SKU count. Rows are written once, in order; number formats come from the
+# column and highlighting from conditional_format rules over the data range.
+
+REPORT_COLUMN_WIDTHS = {
+    'SKU': 15, 'Product_Name': 35, 'Product': 35, 'Launch_Date': 12, 'Years_Since_Launch': 10,
+    'Current_Inventory': 12, 'Stock_Status': 15, 'PO_Urgency': 25, 'Recommended_PO_Qty': 15,
+    'Next_Order_Date': 12, 'Next_Order_Qty': 12, 'Next_Arrival_Date': 12, 'Months_of_Inventory': 12,
+    'Velocity_Category': 10, 'Safety_Stock_Months': 12, 'Reorder_Point': 12, 'Safety_Stock': 12,
+    'Last_3_Months_Avg': 12, 'Total_Sales': 12, 'Growth_Rate': 10, 'Order_2_Date': 12, 'Order_2_Qty': 10,
+    'Order_2_Arrival': 12, 'Order_3_Date': 12, 'Order_3_Qty': 10, 'Order_3_Arrival': 12, 'Lead_Time': 10,
+    'Service_Level': 10, 'Monthly_Velocity': 12, 'Velocity_Rank': 10, 'Channel': 10, 'Forecast_Method': 20,
+    'Priority': 12, 'Action': 40, 'Reason': 30, 'Quantity': 10, 'Impact': 30, 'Contact': 35, 'By_Date': 12,
+    'Notes': 30, 'Risk_Level': 12, 'Issue': 35, 'Potential_Loss': 15, 'Mitigation': 40, 'Order_Month': 12,
+    'Order_Date': 12, 'Order_Quantity': 12, 'Order_Urgency': 15, 'Unit_Cost': 10, 'Total_Order_Value': 15,
+    'Supplier': 20, 'Payment_Terms': 15, 'Expected_Payment_Date': 15, 'Priority_Score': 10,
+    'Action_Priority': 12, 'Action_Timeline': 15, 'Recommended_Action': 35, 'Next_Month_Forecast': 12,
+    'Type': 12, 'Trend': 20, 'Potential': 30, 'Current_Order': 12, 'Suggestion': 30, 'Savings': 25,
+    'Preparation': 30, 'Budget_Impact': 15, 'Metric': 30, 'Value': 20, 'Excess_Units': 12,
+    'Excess_Value': 15, 'SKU_Count': 10, 'Inventory_Value': 15, 'Order_Value': 12, 'Arrival_Date': 12,
+    'Mapping_Status': 20,
+}
+
+REPORT_NUMBER_COLUMNS = {'Current_Inventory', 'Recommended_PO_Qty', 'Next_Order_Qty', 'Order_2_Qty', 'Order_3_Qty',
+                         'Safety_Stock', 'Reorder_Point', 'Order_Quantity', 'Quantity', 'Excess_Units', 'SKU_Count'}
+REPORT_DECIMAL_COLUMNS = {'Months_of_Inventory', 'Last_3_Months_Avg', 'Growth_Rate', 'Monthly_Velocity',
+                          'Years_Since_Launch', 'Safety_Stock_Months'}
+REPORT_CURRENCY_COLUMNS = {'Total_Order_Value', 'Inventory_Value', 'Excess_Value', 'Order_Value',
+                           'Potential_Loss', 'Budget_Impact'}
+MONTH_PREFIXES = ('Jan_', 'Feb_', 'Mar_', 'Apr_', 'May_', 'Jun_', 'Jul_', 'Aug_', 'Sep_', 'Oct_', 'Nov_', 'Dec_')
+REPORT_ROW_CHUNK = 2000  # rows converted to Python values at a time
+
+
+class StreamingReportWriter:
+    """
+    Row-ordered xlsxwriter workbook in constant_memory mode.
+
+    write_table() writes the header and then every data row exactly once.
+    Cell values are cleaned column-wise a chunk of rows at a time (NaN ->
+    blank, +/-inf -> +/-999999, date strings in *Date* columns -> dates), so
+    the row loop only hands values to xlsxwriter and memory stays bounded.
+    """
+
+    def __init__(self, buffer, created=None):
+        self.workbook = xlsxwriter.Workbook(buffer, {
+            'constant_memory': True,
+            'default_date_format': 'yyyy-mm-dd',
+        })
+        if created is not None:
+            # A fixed creation date keeps the bytes identical for an unchanged report
+            self.workbook.set_properties({'created': created})
+
+        add = self.workbook.add_format
+        self.header_format = add({'bold': True, 'text_wrap': True, 'valign': 'vcenter', 'align': 'center',
+                                  'bg_color': '#D7E4BC', 'border': 1, 'font_size': 10})
+        self.urgent_format = add({'bg_color': '#FFC7CE', 'font_color': '#9C0006', 'bold': True})
+        self.warning_format = add({'bg_color': '#FFEB9C', 'font_color': '#9C5700'})
+        self.good_format = add({'bg_color': '#C6EFCE', 'font_color': '#006100'})
+        self.date_format = add({'num_format': 'yyyy-mm-dd', 'align': 'center'})
+        self.number_format = add({'num_format': '#,##0', 'align': 'right'})
+        self.decimal_format = add({'num_format': '#,##0.0', 'align': 'right'})
+        self.currency_format = add({'num_format': '$#,##0', 'align': 'right'})
+        self.text_format = add({'text_wrap': True, 'valign': 'top'})
+        self.title_format = add({'bold': True, 'font_size': 16, 'align': 'center', 'valign': 'vcenter',
+                                 'bg_color': '#4472C4', 'font_color': 'white', 'border': 1})
+        self.section_format = add({'bold': True, 'font_size': 12, 'bg_color': '#D7E4BC', 'border': 1})
+        self.value_format = add({'font_size': 11, 'align': 'right'})
+
+    def close(self):
+        self.workbook.close()
+
+    def column_format(self, col_name):
+        if 'Date' in col_name:
+            return self.date_format
+        if col_name in REPORT_NUMBER_COLUMNS or 'Forecast_' in col_name:
+            return self.number_format
+        if col_name in REPORT_DECIMAL_COLUMNS:
+            return self.decimal_format
+        if col_name in REPORT_CURRENCY_COLUMNS or 'Value' in col_name:
+            return self.currency_format
+        return self.text_format
+
+    @staticmethod
+    def column_width(df, col_name):
+        if col_name in REPORT_COLUMN_WIDTHS:
+            return REPORT_COLUMN_WIDTHS[col_name]
+        if col_name.startswith('Forecast_'):
+            return 12
+        if any(month in col_name for month in MONTH_PREFIXES):
+            return 10
+        if col_name.startswith('Amazon_') or col_name.startswith('Shopify_'):
+            return 12
+        sample = df[col_name].head(10).dropna().astype(str).str.len()
+        max_len = max(len(col_name), int(sample.max()) if len(sample) else 0)
+        return min(max(max_len + 2, 8), 40)
+
+    @staticmethod
+    def _cell_columns(df):
+        """One list of ready-to-write Python values per column."""
+        columns = []
+        for col_name in df.columns:
+            col = df[col_name]
+            if pd.api.types.is_bool_dtype(col) or pd.api.types.is_datetime64_any_dtype(col):
+                pass
+            elif pd.api.types.is_numeric_dtype(col) or col.dtype == object:
+                col = col.replace({np.inf: 999999, -np.inf: -999999})
+            if 'Date' in str(col_name) and pd.api.types.is_string_dtype(col):
+                text = col.astype(str)
+                parsed = pd.to_datetime(text.where(text.str.len() > 0), errors='coerce', format='mixed')
+                col = parsed.astype(object).where(parsed.notna(), col)
+            col = col.astype(object).where(col.notna(), None)
+            columns.append(col.tolist())
+        return columns
+
+    def write_table(self, sheet_name, df, widths=None, freeze=(1, 0), autofilter=False,
+                    row_rules=(), cell_rules=()):
+        """
+        Write df as a formatted table and return the worksheet.
+
+        widths: list (by position) or dict (by column name) overriding the
+        default widths. row_rules: (column, operator, value, format) tuples
+        highlighting whole rows where the column compares to value; a column
+        of None highlights every row. cell_rules: (column, rule dict) pairs
+        passed to conditional_format for that column alone. Rules naming a
+        column df doesn't have are skipped.
+        """
+        worksheet = self.workbook.add_worksheet(sheet_name)
+        columns = [str(c) for c in df.columns]
+        n_rows, last_col = len(df), len(columns) - 1
+
+        for col_idx, col_name in enumerate(columns):
+            width = self.column_width(df, df.columns[col_idx])
+            if isinstance(widths, dict):
+                width = widths.get(col_name, width)
+            elif widths is not None and col_idx < len(widths):
+                width = widths[col_idx]
+            worksheet.set_column(col_idx, col_idx, width, self.column_format(col_name))
+
+        worksheet.set_row(0, 25)
+        worksheet.write_row(0, 0, columns, self.header_format)
+        for start in range(0, n_rows, REPORT_ROW_CHUNK):
+            chunk = df.iloc[start:start + REPORT_ROW_CHUNK]
+            for row_idx, row in enumerate(zip(*self._cell_columns(chunk)), start=start + 1):
+                worksheet.write_row(row_idx, 0, row)
+
+        if n_rows > 0:
+            for col_name, op, value, fmt in row_rules:
+                if col_name is None:
+                    criteria = '=TRUE'
+                elif col_name in columns:
+                    criteria = f'=${xl_col_to_name(columns.index(col_name))}2{op}"{value}"'
+                else:
+                    continue
+                worksheet.conditional_format(1, 0, n_rows, last_col,
+                                             {'type': 'formula', 'criteria': criteria, 'format': fmt})
+            for col_name, rule in cell_rules:
+                if col_name in columns:
+                    col_idx = columns.index(col_name)
+                    worksheet.conditional_format(1, col_idx, n_rows, col_idx, rule)
+            if autofilter:
+                worksheet.autofilter(0, 0, n_rows, last_col)
+
+        if freeze:
+            worksheet.freeze_panes(*freeze)
+        return worksheet
+
+    def write_data_sheet(self, sheet_name, df, **kwargs):
+        """Standard data tab: header + first two columns frozen on forecast tabs, autofilter."""
+        wide = any(key in sheet_name for key in ('All Forecasts', 'Amazon', 'Shopify'))
+        return self.write_table(sheet_name, df, freeze=(1, 2) if wide else (1, 0), autofilter=True, **kwargs)
+
+    def write_key_value_sheet(self, sheet_name, rows, title_row=0, section_rows=()):
+        """Two-column summary sheet: a merged title, merged section headers, right-aligned values."""
+        worksheet = self.workbook.add_worksheet(sheet_name)
+        worksheet.set_column('A:A', 35)
+        worksheet.set_column('B:B', 25)
+        for row_idx, (metric, value) in enumerate(rows):
+            if row_idx == title_row:
+                worksheet.set_row(row_idx, 30)
+                worksheet.merge_range(row_idx, 0, row_idx, 1, metric, self.title_format)
+            elif row_idx in section_rows:
+                worksheet.set_row(row_idx, 25)
+                worksheet.merge_range(row_idx, 0, row_idx, 1, metric, self.section_format)
+            else:
+                worksheet.write(row_idx, 0, metric)
+                if value != '':
+                    worksheet.write(row_idx, 1, value, self.value_format)
+        return worksheet
+
+
+FORECAST_SECTION_ROWS = (3, 7, 12, 16)  # section titles in the executive summary
+
+FINANCE_COLUMN_WIDTHS = {
+    'Order_Month': 12, 'Order_Date': 12, 'SKU': 15, 'Product_Name': 35, 'Velocity_Category': 10,
+    'Order_Quantity': 12, 'Order_Urgency': 15, 'Unit_Cost': 10, 'Total_Order_Value': 15, 'Supplier': 20,
+    'Payment_Terms': 15, 'Expected_Payment_Date': 18, 'Lead_Time': 10, 'Safety_Stock_Months': 12,
+    'Current_Inventory': 12, 'Months_of_Inventory': 12,
+}
+
+MATRIX_COLUMN_WIDTHS = {
+    'SKU': 15, 'Product_Name': 35, 'Velocity_Category': 10, 'Months_of_Inventory': 12, 'Priority_Score': 10,
+    'Action_Priority': 12, 'Action_Timeline': 15, 'Recommended_Action': 40, 'Order_Quantity': 12,
+    'Current_Inventory': 12, 'Next_Month_Forecast': 12,
+}
+
+
+def _write_forecast_sheet(report, sheet_name, df):
+    """Write one forecast tab with its layout; unknown tabs get the data-sheet layout."""
+    if sheet_name == '📊 Executive Summary':
+        report.write_key_value_sheet(sheet_name, df.itertuples(index=False, name=None),
+                                     section_rows=FORECAST_SECTION_ROWS)
+    elif sheet_name == '🚨 IMMEDIATE ACTIONS':
+        # Priority, SKU, Product, Action, Reason, Quantity, Impact, Contact
+        report.write_table(sheet_name, df, widths=[12, 15, 35, 40, 30, 10, 25, 35],
+                           row_rules=[('Priority', '=', 'CRITICAL', report.urgent_format),
+                                      ('Priority', '<>', 'CRITICAL', report.warning_format)])
+    elif sheet_name == '📋 Action Priority Matrix':
+        report.write_table(sheet_name, df,
+                           widths={col: MATRIX_COLUMN_WIDTHS.get(col, 15) for col in df.columns},
+                           row_rules=[('Action_Priority', '=', 'IMMEDIATE', report.urgent_format),
+                                      ('Action_Priority', '=', 'HIGH', report.warning_format)])
+    elif sheet_name == '📅 Weekly Actions':
+        # Priority, SKU, Product, Action, Reason, Quantity, By_Date, Notes
+        report.write_table(sheet_name, df, widths=[12, 15, 35, 25, 20, 10, 12, 30])
+    elif sheet_name == '⚠️ Risk Analysis':
+        # Risk_Level, SKU, Product, Issue, Potential_Loss, Mitigation
+        report.write_table(sheet_name, df, widths=[12, 15, 35, 35, 15, 40],
+                           row_rules=[('Risk_Level', '=', 'HIGH', report.warning_format)])
+    elif sheet_name == '💡 Cost Optimization':
+        # SKU, Product, Current_Order, Suggestion, Savings, Action
+        report.write_table(sheet_name, df, widths=[15, 35, 12, 30, 25, 35])
+    elif sheet_name == '🎯 Opportunities':
+        # Type, SKU, Product, Trend, Action, Potential
+        report.write_table(sheet_name, df, widths=[12, 15, 35, 20, 25, 30],
+                           row_rules=[(None, None, None, report.good_format)])
+    elif sheet_name == '📆 Monthly Actions':
+        # SKU, Product, Action, Order_Date, Quantity, Preparation, Budget_Impact
+        report.write_table(sheet_name, df, widths=[15, 35, 20, 12, 10, 25, 15])
+    elif sheet_name == '📈 All Forecasts':
+        report.write_data_sheet(sheet_name, df, cell_rules=[
+            ('Stock_Status', {'type': 'cell', 'criteria': '==', 'value': '"OUT OF STOCK"', 'format': report.urgent_format}),
+            ('Stock_Status', {'type': 'cell', 'criteria': '==', 'value': '"REORDER NOW"', 'format': report.warning_format}),
+            ('Stock_Status', {'type': 'cell', 'criteria': '==', 'value': '"NORMAL"', 'format': report.good_format}),
+            ('PO_Urgency', {'type': 'text', 'criteria': 'containing', 'value': 'HIGH', 'format': report.urgent_format}),
+            ('PO_Urgency', {'type': 'text', 'criteria': 'containing', 'value': 'MEDIUM', 'format': report.warning_format}),
+        ])
+    elif sheet_name == '💰 Finance Cash Flow':
+        worksheet = report.write_data_sheet(sheet_name, df, widths=FINANCE_COLUMN_WIDTHS)
+        # Add a note for finance team (below the table, so rows stay in order)
+        note_text = "Please fill in Unit_Cost, Supplier, and Payment_Terms for accurate cash flow planning"
+        worksheet.write(len(df) + 3, 0, "Note:", report.header_format)
+        worksheet.merge_range(len(df) + 3, 1, len(df) + 3, 6, note_text, report.text_format)
+    elif sheet_name == '❌ Out of Stock':
+        # Highlight all rows as critical
+        report.write_data_sheet(sheet_name, df, row_rules=[(None, None, None, report.urgent_format)])
+    elif sheet_name == '📦 Reorder Now':
+        # Highlight all rows as warning
+        report.write_data_sheet(sheet_name, df, row_rules=[(None, None, None, report.warning_format)])
+    elif sheet_name == '⚡ Velocity Analysis':
+        report.write_table(sheet_name, df, widths=[15, 12, 15, 18, 15], freeze=None)
+    elif sheet_name == '📅 Order Schedule':
+        # Order_Date, SKU, Product, Quantity, Lead_Time, Arrival_Date, Order_Value
+        report.write_table(sheet_name, df, widths=[12, 15, 35, 10, 10, 12, 12], autofilter=True)
     else:
-        buffer.seek(0)
-        media = MediaIoBaseUpload(buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            resumable=True
-        )
-        file_metadata = {
-            'name': FIXED_FILENAME,
-            'parents': [FOLDER_ID],
-            'driveId': SHARED_DRIVE_ID
-        }
-        uploaded_file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            supportsAllDrives=True,
-            fields='id'
-        ).execute()
-        file_id = uploaded_file.get('id')
-        print(f"✅ New file uploaded: {FIXED_FILENAME} (ID: {file_id})")
+        report.write_data_sheet(sheet_name, df)
 
-    # =============================================================================
-    # PART 2: NEW FUNCTIONALITY - Save timestamped copy to subfolder
-    # =============================================================================
-    
-    try:
-        print("📁 Starting timestamped backup process...")
-        
-        # Step 1: Find the existing subfolder (assumes it exists)
-        subfolder_query = f"'{FOLDER_ID}' in parents and name = '{SUBFOLDER_NAME}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        subfolder_result = drive_service.files().list(
-            q=subfolder_query,
-            fields="files(id, name)",
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True,
-            corpora="drive",
-            driveId=SHARED_DRIVE_ID
-        ).execute()
-        
-        subfolder_files = subfolder_result.get("files", [])
-        
-        if subfolder_files:
-            subfolder_id = subfolder_files[0]['id']
-            print(f"📂 Found subfolder: {SUBFOLDER_NAME} (ID: {subfolder_id})")
-        else:
-            raise FileNotFoundError(f"❌ Subfolder '{SUBFOLDER_NAME}' not found. Please create it manually in your Drive folder.")
-        
-        # Step 2: Generate timestamped filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        timestamped_filename = f"Forecasting_Backup_{timestamp}.xlsx"
-        print(f"🕒 Generated timestamped filename: {timestamped_filename}")
-        
-        # Step 3: Check if file with same timestamp already exists (overwrite if exists)
-        timestamp_query = f"'{subfolder_id}' in parents and name = '{timestamped_filename}' and trashed = false"
-        timestamp_result = drive_service.files().list(
-            q=timestamp_query,
-            fields="files(id)",
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True,
-            corpora="drive",
-            driveId=SHARED_DRIVE_ID
-        ).execute()
-        
-        existing_timestamp_files = timestamp_result.get("files", [])
-        
-        # Step 4: Upload or update timestamped file
-        buffer.seek(0)  # Reset buffer position
-        media = MediaIoBaseUpload(buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            resumable=True
-        )
-        
-        if existing_timestamp_files:
-            # Update existing timestamped file
-            timestamp_file_id = existing_timestamp_files[0]['id']
-            updated_timestamp_file = drive_service.files().update(
-                fileId=timestamp_file_id,
-                media_body=media,
-                supportsAllDrives=True
-            ).execute()
-            print(f"🔄 Overwritten existing timestamped backup: {timestamped_filename}")
-        else:
-            # Create new timestamped file
-            timestamp_file_metadata = {
-                'name': timestamped_filename,
-                'parents': [subfolder_id],
-                'driveId': SHARED_DRIVE_ID
-            }
-            uploaded_timestamp_file = drive_service.files().create(
-                body=timestamp_file_metadata,
-                media_body=media,
-                supportsAllDrives=True,
-                fields='id'
-            ).execute()
-            print(f"✅ New timestamped backup saved: {timestamped_filename}")
-            
-        print("📚 Timestamped backup process completed successfully!")
-        
-    except Exception as e:
-        print(f"⚠️ Warning: Failed to save timestamped backup: {str(e)}")
-        print("📝 Main file upload was successful, continuing...")
-        # Don't raise the exception - let the main functionality continue
-    
-    # Clean up temp file
+
+def render_forecast_workbook(sheet_frames, created=None):
+    """Stream the forecast tabs, in order, into a formatted workbook and return its bytes."""
+    buffer = BytesIO()
+    report = StreamingReportWriter(buffer, created=created)
     try:
-        os.remove(SERVICE_ACCOUNT_FILE)
-        print("🧹 Cleaned up temporary credentials file.")
-    except:
-        pass
+        for sheet_name, df in sheet_frames.items():
+            _write_forecast_sheet(report, sheet_name, df)
+    finally:
+        report.close()
+    return buffer.getvalue()
 
-    return file_id
 
-         
 def main():
 
     try:               
@@ -5370,14 +5460,35 @@ def main():
 
         USE_GOOGLE_SHEETS = True
 
+        # How weekly sales are rolled into months: 'week_start' or 'proportional' (split by days)
+        WEEK_TO_MONTH_ALLOCATION = "week_start"
+        if WEEK_TO_MONTH_ALLOCATION not in GoogleSheetsConnector.WEEK_ALLOCATION_MODES:
+            raise ValueError(f"Unknown week allocation mode: {WEEK_TO_MONTH_ALLOCATION}")
+
         print("Loading data files...")
 
         historical_sales_path = os.path.join(BASE_DIR, "historical_sales.csv")
-        historical_data = pd.read_csv(historical_sales_path, sep=',', dtype={'SKU': str}, encoding='utf-8')
+
+        # Consolidated history from the Parquet store, falling back to the CSV
+        history_store = None
+        if PARQUET_AVAILABLE:
+            try:
+                history_store = HistoricalSalesStore()
+                history_store.sync_base_from_csv(historical_sales_path)
+            except Exception as e:
+                print(f"⚠️ Parquet history store unavailable, reading CSV instead: {e}")
+                history_store = None
+
+        if history_store is not None:
+            historical_data = history_store.load()
+        else:
+            historical_data = pd.read_csv(historical_sales_path, sep=',', dtype={'SKU': str}, encoding='utf-8')
+
+            # Clean historical SKUs more thoroughly
+            historical_data['SKU'] = historical_data['SKU'].astype(str).str.strip()
+            historical_data = historical_data.drop_duplicates(subset=['SKU', 'Channel', 'Date'], keep='last', ignore_index=True)
         print(f"   Historical sales: {len(historical_data)} records")
 
-        # Clean historical SKUs more thoroughly
-        historical_data['SKU'] = historical_data['SKU'].astype(str).str.strip()
         print(f"   Sample historical SKUs: {historical_data['SKU'].unique()[:5]}")
 
         # MODIFIED SECTION - Load inventory from Google Sheets instead of CSV
@@ -5424,70 +5535,19 @@ def main():
                 print(f"   Lead times from Google Sheets: {len(lead_times)} SKUs")
                 print(f"   Launch dates from Google Sheets: {len([d for d in launch_dates.values() if d is not None])} SKUs")
 
-                # Step 1: Load and extend Amazon weekly
-                print(f"\nLoading Amazon FBA weekly sales data...")
-                amazon_weekly_df = gs_connector.get_amazon_fba_weekly_sales(WEEKLY_SALES_URL)
-
-                if not amazon_weekly_df.empty:
-                    amazon_weekly_monthly = gs_connector.convert_amazon_weekly_to_monthly(amazon_weekly_df)
-                    amazon_extended = gs_connector.extend_historical_data_with_amazon_weekly(historical_data.copy(), amazon_weekly_monthly)
-                    print(f"✅ Amazon FBA data extended")
-                else:
-                    amazon_extended = historical_data.copy()
-                    print("⚠️ No Amazon FBA weekly sales data found")
-
-                # Step 2: Load and extend Shopify weekly
-                print(f"\nLoading Shopify Main weekly sales data...")
-                shopify_weekly_df = gs_connector.get_shopify_main_weekly_sales(WEEKLY_SALES_URL)
-
-                if not shopify_weekly_df.empty:
-                    shopify_weekly_monthly = gs_connector.convert_shopify_weekly_to_monthly(shopify_weekly_df)
-                    shopify_extended = gs_connector.extend_historical_data_with_shopify_weekly(historical_data.copy(), shopify_weekly_monthly)
-                    print(f"✅ Shopify Main data extended")
-                else:
-                    shopify_extended = historical_data.copy()
-                    print("⚠️ No Shopify Main weekly sales data found")
-
-                ### Shopify Faire    
-                print(f"\nLoading Shopify Faire weekly sales data...")
-                shopify_faire_weekly_df = gs_connector.get_shopify_faire_weekly_sales(WEEKLY_SALES_URL)
-
-                if not shopify_faire_weekly_df.empty:
-                    shopify_faire_weekly_monthly = gs_connector.convert_shopify_faire_weekly_to_monthly(shopify_faire_weekly_df)
-                    shopify_faire_extended = gs_connector.extend_historical_data_with_shopify_faire_weekly(historical_data.copy(), shopify_faire_weekly_monthly)
-                    print(f"✅ Shopify Faire data extended")
-                else:
-                    shopify_faire_extended = historical_data.copy()
-                    print("⚠️ No Shopify Faire weekly sales data found")
-
-                ### Walmart FBM
-                print(f"\nLoading Walmart FBM weekly sales data...")
-                walmart_fbm_weekly_df = gs_connector.get_walmart_fbm_weekly_sales(WEEKLY_SALES_URL)
+                # Step 1: Load every weekly channel tab in one batch and convert to months with one groupby
+                print(f"\nLoading weekly sales data for all channels...")
+                weekly_df = gs_connector.get_all_weekly_sales(WEEKLY_SALES_URL)
+                weekly_monthly = gs_connector.convert_weekly_to_monthly(weekly_df, allocation=WEEK_TO_MONTH_ALLOCATION)
 
-                if not walmart_fbm_weekly_df.empty:
-                    walmart_fbm_weekly_monthly = gs_connector.convert_walmart_fbm_weekly_to_monthly(walmart_fbm_weekly_df)
-                    walmart_fbm_extended = gs_connector.extend_historical_data_with_walmart_fbm_weekly(historical_data.copy(), walmart_fbm_weekly_monthly)
-                    print(f"✅ Walmart FBM data extended")
+                # Step 2: Upsert the weekly months once and re-read the consolidated history
+                if history_store is not None:
+                    history_store.upsert_weekly_months(weekly_monthly)
+                    historical_data = history_store.load()
+                    print(f"✅ Consolidated history: {len(historical_data)} records")
                 else:
-                    walmart_fbm_extended = historical_data.copy()
-                    print("⚠️ No Walmart FBM weekly sales data found")
-
-                ### Amazon FBM
-                print(f"\nLoading Amazon FBM weekly sales data...")
-                amazon_fbm_weekly_df = gs_connector.get_amazon_fbm_weekly_sales(WEEKLY_SALES_URL)
-
-                if not amazon_fbm_weekly_df.empty:
-                    amazon_fbm_weekly_monthly = gs_connector.convert_amazon_fbm_weekly_to_monthly(amazon_fbm_weekly_df)
-                    amazon_fbm_extended = gs_connector.extend_historical_data_with_amazon_fbm_weekly(historical_data.copy(), amazon_fbm_weekly_monthly)
-                    print(f"✅ Amazon FBM data extended")
-                else:
-                    amazon_fbm_extended = historical_data.copy()
-                    print("⚠️ No Amazon FBM weekly sales data found")
-
-                # Step 3: Combine Amazon + Shopify extended data
-                historical_data = pd.concat([amazon_extended, shopify_extended, shopify_faire_extended, walmart_fbm_extended, amazon_fbm_extended], ignore_index=True)
-                historical_data = historical_data.drop_duplicates(subset=['SKU', 'Channel', 'Date'], keep='last')
-                historical_data = historical_data.sort_values(by=['SKU', 'Channel', 'Date'])
+                    # One append of the new channel rows onto the single base frame
+                    historical_data = gs_connector.extend_historical_data_with_weekly(historical_data, weekly_monthly, "all channels")
 
                 historical_skus = set(historical_data['SKU'].unique())
                 google_skus = set(product_info.keys())
@@ -5552,773 +5612,186 @@ def main():
         amazon_forecast = model.create_enhanced_forecast('Amazon', inventory, product_info, product_category, product_status)
         shopify_forecast = model.create_enhanced_forecast_shopify_special('Shopify', inventory, product_info, product_category, product_status)
         shopify_faire_forecast = model.create_enhanced_forecast_shopify_faire_special('Shopify Faire', inventory, product_info, product_category, product_status)
-        amazon_fbm_forecast = model.create_enhanced_forecast_amazon_fbm_special('Amazonfbm', inventory, product_info, product_category, product_status)
-        walmart_fbm_forecast = model.create_enhanced_forecast_walmart_fbm_special('Walmartfbm', inventory, product_info, product_category, product_status)
-
-        print("Creating combined channel analysis...")
-        combined_forecast = model.combine_channel_forecasts(amazon_forecast, shopify_forecast, shopify_faire_forecast, amazon_fbm_forecast, walmart_fbm_forecast)
-
-
-        # Generate actionable insights
-        print("Generating actionable insights...")
-        insights = model.generate_actionable_insights(combined_forecast)
-        executive_summary = model.create_executive_summary(combined_forecast, insights)
-        priority_matrix = model.create_action_priority_matrix(combined_forecast)
-
-        finance_forecast = model.create_finance_cash_flow_forecast(combined_forecast)
-
-        timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M")
-        data_source = "GoogleSheets" if USE_GOOGLE_SHEETS else "CSV"
-        filename = f'enhanced_forecast_COMPREHENSIVE_{data_source}_{timestamp}.xlsx'
-
-        print(f"Saving results to {filename}...")
-
-        # Create BytesIO buffer for Excel file (works for both CLI and Streamlit)
-        excel_buffer = BytesIO()
-
-        with pd.ExcelWriter(excel_buffer, engine='xlsxwriter',
-                           engine_kwargs={'options': {'nan_inf_to_errors': True}}) as writer:
-            # Get the xlsxwriter workbook and worksheet objects
-            workbook = writer.book
-
-            # Define formats
-            header_format = workbook.add_format({
-                'bold': True,
-                'text_wrap': True,
-                'valign': 'vcenter',
-                'align': 'center',
-                'bg_color': '#D7E4BC',
-                'border': 1,
-                'font_size': 10
-            })
-
-            urgent_format = workbook.add_format({
-                'bg_color': '#FFC7CE',
-                'font_color': '#9C0006',
-                'bold': True
-            })
-
-            warning_format = workbook.add_format({
-                'bg_color': '#FFEB9C',
-                'font_color': '#9C5700'
-            })
-
-            good_format = workbook.add_format({
-                'bg_color': '#C6EFCE',
-                'font_color': '#006100'
-            })
-
-            date_format = workbook.add_format({
-                'num_format': 'yyyy-mm-dd',
-                'align': 'center'
-            })
-
-            number_format = workbook.add_format({
-                'num_format': '#,##0',
-                'align': 'right'
-            })
-
-            decimal_format = workbook.add_format({
-                'num_format': '#,##0.0',
-                'align': 'right'
-            })
-
-            currency_format = workbook.add_format({
-                'num_format': '$#,##0',
-                'align': 'right'
-            })
-
-            text_format = workbook.add_format({
-                'text_wrap': True,
-                'valign': 'top'
-            })
-
-            # 1. EXECUTIVE SUMMARY SHEET (FIRST - MOST IMPORTANT)
-            exec_summary_data = pd.DataFrame([
-                ['INVENTORY PLANNING EXECUTIVE SUMMARY', ''],
-                ['Report Date:', executive_summary['date']],
-                ['', ''],
-                ['IMMEDIATE ACTIONS REQUIRED', ''],
-                ['Critical Actions (Today):', executive_summary['immediate_actions_required']],
-                ['High Priority (This Week):', executive_summary['weekly_actions_required']],
-                ['', ''],
-                ['INVENTORY HEALTH', ''],
-                ['Total SKUs:', executive_summary['total_skus']],
-                ['At-Risk SKUs (<2 months):', executive_summary['at_risk_skus']],
-                ['Overstock SKUs (>6 months):', executive_summary['overstock_skus']],
-                ['', ''],
-                ['FINANCIAL IMPACT', ''],
-                ['Current Inventory Value:', f"${executive_summary['total_inventory_value']:,.0f}"],
-                ['PO Value Needed (Immediate):', f"${executive_summary['total_po_value_needed']:,.0f}"],
-                ['', ''],
-                ['CASH FLOW PROJECTION', ''],
-                ['Next 30 Days:', f"${executive_summary['cash_flow_30_days']:,.0f}"],
-                ['Next 60 Days:', f"${executive_summary['cash_flow_60_days']:,.0f}"],
-                ['Next 90 Days:', f"${executive_summary['cash_flow_90_days']:,.0f}"],
-            ], columns=['Metric', 'Value'])
-
-            exec_summary_data.to_excel(writer, sheet_name='📊 Executive Summary', index=False, header=False)
-            worksheet = writer.sheets['📊 Executive Summary']
-
-            # Format executive summary with proper column widths
-            worksheet.set_column('A:A', 35)  # Metric column
-            worksheet.set_column('B:B', 25)  # Value column
-
-            # Format rows
-            title_format = workbook.add_format({
-                'bold': True,
-                'font_size': 16,
-                'align': 'center',
-                'valign': 'vcenter',
-                'bg_color': '#4472C4',
-                'font_color': 'white',
-                'border': 1
-            })
-
-            section_format = workbook.add_format({
-                'bold': True,
-                'font_size': 12,
-                'bg_color': '#D7E4BC',
-                'border': 1
-            })
+        amazon_fbm_forecast = model.create_enhanced_forecast_amazon_fbm_special('Amazonfbm', inventory, product_info, product_category, product_status)
+        walmart_fbm_forecast = model.create_enhanced_forecast_walmart_fbm_special('Walmartfbm', inventory, product_info, product_category, product_status)
 
-            value_format = workbook.add_format({
-                'font_size': 11,
-                'align': 'right'
-            })
+        print("Creating combined channel analysis...")
+        combined_forecast = model.combine_channel_forecasts(amazon_forecast, shopify_forecast, shopify_faire_forecast, amazon_fbm_forecast, walmart_fbm_forecast)
 
-            # Apply formatting
-            worksheet.merge_range(0, 0, 0, 1, 'INVENTORY PLANNING EXECUTIVE SUMMARY', title_format)
-            worksheet.set_row(0, 30)
-
-            # Format section headers
-            for row in [3, 7, 12, 16]:
-                if row < len(exec_summary_data):
-                    worksheet.merge_range(row, 0, row, 1, exec_summary_data.iloc[row, 0], section_format)
-                    worksheet.set_row(row, 25)
-
-            # Format data rows
-            for row in range(1, len(exec_summary_data)):
-                if row not in [0, 3, 7, 12, 16] and exec_summary_data.iloc[row, 1]:
-                    worksheet.write(row, 1, exec_summary_data.iloc[row, 1], value_format)
-
-            # 2. IMMEDIATE ACTIONS SHEET
-            immediate_actions_list = insights.get('immediate_actions', [])
-
-            print(f"📌 immediate_actions count: {len(immediate_actions_list)}")
-
-            if immediate_actions_list:
-                immediate_df = pd.DataFrame(immediate_actions_list)
-                immediate_df.to_excel(writer, sheet_name='🚨 IMMEDIATE ACTIONS', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['🚨 IMMEDIATE ACTIONS']
-
-                # Write headers safely
-                for col_num, column in enumerate(immediate_df.columns):
-                    worksheet.write(0, col_num, column, header_format)
-
-                # Set specific column widths
-                col_widths = {
-                    0: 12,  # Priority
-                    1: 15,  # SKU
-                    2: 35,  # Product
-                    3: 40,  # Action
-                    4: 30,  # Reason
-                    5: 10,  # Quantity
-                    6: 25,  # Impact
-                    7: 35   # Contact
-                }
 
-                for col, width in col_widths.items():
-                    if col < len(immediate_df.columns):
-                        worksheet.set_column(col, col, width)
+        # Generate actionable insights
+        print("Generating actionable insights...")
+        insights = model.generate_actionable_insights(combined_forecast)
+        executive_summary = model.create_executive_summary(combined_forecast, insights)
+        priority_matrix = model.create_action_priority_matrix(combined_forecast)
 
-                # Apply formatting
-                for row in range(1, len(immediate_df) + 1):
-                    priority = immediate_df.iloc[row-1]['Priority']
-                    fmt = urgent_format if priority == 'CRITICAL' else warning_format
-                    for col in range(len(immediate_df.columns)):
-                        worksheet.write(row, col, immediate_df.iloc[row-1, col], fmt)
+        finance_forecast = model.create_finance_cash_flow_forecast(combined_forecast)
 
-                worksheet.freeze_panes(1, 0)
+        timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M")
+        data_source = "GoogleSheets" if USE_GOOGLE_SHEETS else "CSV"
+        filename = f'enhanced_forecast_COMPREHENSIVE_{data_source}_{timestamp}.xlsx'
 
-            else:
-                print("⚠️ No immediate actions generated — skipping that sheet.")
-
-            # 3. ACTION PRIORITY MATRIX
-            if not priority_matrix.empty:
-                priority_matrix.to_excel(writer, sheet_name='📋 Action Priority Matrix', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['📋 Action Priority Matrix']
-
-                # Write headers
-                for col_num, column in enumerate(priority_matrix.columns):
-                    worksheet.write(0, col_num, column, header_format)
-
-                # Set column widths
-                matrix_widths = {
-                    'SKU': 15,
-                    'Product_Name': 35,
-                    'Velocity_Category': 10,
-                    'Months_of_Inventory': 12,
-                    'Priority_Score': 10,
-                    'Action_Priority': 12,
-                    'Action_Timeline': 15,
-                    'Recommended_Action': 40,
-                    'Order_Quantity': 12,
-                    'Current_Inventory': 12,
-                    'Next_Month_Forecast': 12
-                }
+        print(f"Preparing results for {filename}...")
+
+        # Same tables as the workbook tabs. The workbook, the Google Sheets tabs
+        # and the Parquet/CSV/Arrow artifacts are all rendered from these
+        sheet_frames = {}
+
+        # 1. EXECUTIVE SUMMARY SHEET (FIRST - MOST IMPORTANT)
+        exec_summary_data = pd.DataFrame([
+            ['INVENTORY PLANNING EXECUTIVE SUMMARY', ''],
+            ['Report Date:', executive_summary['date']],
+            ['', ''],
+            ['IMMEDIATE ACTIONS REQUIRED', ''],
+            ['Critical Actions (Today):', executive_summary['immediate_actions_required']],
+            ['High Priority (This Week):', executive_summary['weekly_actions_required']],
+            ['', ''],
+            ['INVENTORY HEALTH', ''],
+            ['Total SKUs:', executive_summary['total_skus']],
+            ['At-Risk SKUs (<2 months):', executive_summary['at_risk_skus']],
+            ['Overstock SKUs (>6 months):', executive_summary['overstock_skus']],
+            ['', ''],
+            ['FINANCIAL IMPACT', ''],
+            ['Current Inventory Value:', f"${executive_summary['total_inventory_value']:,.0f}"],
+            ['PO Value Needed (Immediate):', f"${executive_summary['total_po_value_needed']:,.0f}"],
+            ['', ''],
+            ['CASH FLOW PROJECTION', ''],
+            ['Next 30 Days:', f"${executive_summary['cash_flow_30_days']:,.0f}"],
+            ['Next 60 Days:', f"${executive_summary['cash_flow_60_days']:,.0f}"],
+            ['Next 90 Days:', f"${executive_summary['cash_flow_90_days']:,.0f}"],
+        ], columns=['Metric', 'Value'])
+        sheet_frames['📊 Executive Summary'] = exec_summary_data
+
+        # 2. IMMEDIATE ACTIONS SHEET
+        immediate_actions_list = insights.get('immediate_actions', [])
+
+        print(f"📌 immediate_actions count: {len(immediate_actions_list)}")
+
+        if immediate_actions_list:
+            sheet_frames['🚨 IMMEDIATE ACTIONS'] = pd.DataFrame(immediate_actions_list)
+        else:
+            print("⚠️ No immediate actions generated — skipping that sheet.")
 
-                for i, col in enumerate(priority_matrix.columns):
-                    width = matrix_widths.get(col, 15)
-                    worksheet.set_column(i, i, width)
-
-                # Apply conditional formatting for priority levels
-                for row in range(1, len(priority_matrix) + 1):
-                    priority = priority_matrix.iloc[row-1]['Action_Priority']
-                    if priority == 'IMMEDIATE':
-                        row_format = urgent_format
-                    elif priority == 'HIGH':
-                        row_format = warning_format
-                    else:
-                        row_format = None
-
-                    if row_format:
-                        for col in range(len(priority_matrix.columns)):
-                            worksheet.write(row, col, priority_matrix.iloc[row-1, col], row_format)
-
-                worksheet.freeze_panes(1, 0)
-
-            # 4. WEEKLY ACTIONS
-            if insights.get('weekly_actions'):
-                weekly_df = pd.DataFrame(insights.get('weekly_actions'))
-                weekly_df.to_excel(writer, sheet_name='📅 Weekly Actions', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['📅 Weekly Actions']
-
-                # Write headers and format
-                for col_num, column in enumerate(weekly_df.columns):
-                    worksheet.write(0, col_num, column, header_format)
-
-                # Set column widths
-                worksheet.set_column('A:A', 12)  # Priority
-                worksheet.set_column('B:B', 15)  # SKU
-                worksheet.set_column('C:C', 35)  # Product
-                worksheet.set_column('D:D', 25)  # Action
-                worksheet.set_column('E:E', 20)  # Reason
-                worksheet.set_column('F:F', 10)  # Quantity
-                worksheet.set_column('G:G', 12)  # By_Date
-                worksheet.set_column('H:H', 30)  # Notes
-
-                worksheet.freeze_panes(1, 0)
-
-            # 5. RISK ANALYSIS
-            if insights.get('risk_analysis'):
-                risk_df = pd.DataFrame(insights.get('risk_analysis'))
-                risk_df.to_excel(writer, sheet_name='⚠️ Risk Analysis', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['⚠️ Risk Analysis']
-
-                # Write headers
-                for col_num, column in enumerate(risk_df.columns):
-                    worksheet.write(0, col_num, column, header_format)
-
-                # Set column widths
-                worksheet.set_column('A:A', 12)  # Risk_Level
-                worksheet.set_column('B:B', 15)  # SKU
-                worksheet.set_column('C:C', 35)  # Product
-                worksheet.set_column('D:D', 35)  # Issue
-                worksheet.set_column('E:E', 15)  # Potential_Loss
-                worksheet.set_column('F:F', 40)  # Mitigation
-
-                # Highlight high-risk items
-                for row in range(1, len(risk_df) + 1):
-                    if risk_df.iloc[row-1]['Risk_Level'] == 'HIGH':
-                        for col in range(len(risk_df.columns)):
-                            value = risk_df.iloc[row-1, col]
-                            # Handle NaN/Inf values
-                            if pd.isna(value):
-                                value = ''
-                            elif isinstance(value, (int, float)):
-                                if value == float('inf'):
-                                    value = 999999
-                                elif value == float('-inf'):
-                                    value = -999999
-                            worksheet.write(row, col, value, warning_format)
-
-                worksheet.freeze_panes(1, 0)
-
-            # 7. COST OPTIMIZATION SHEET
-            if insights.get('cost_optimization'):
-                cost_df = pd.DataFrame(insights.get('cost_optimization'))
-                cost_df.to_excel(writer, sheet_name='💡 Cost Optimization', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['💡 Cost Optimization']
-
-                # Write headers
-                for col_num, column in enumerate(cost_df.columns):
-                    worksheet.write(0, col_num, column, header_format)
-
-                # Set column widths
-                worksheet.set_column('A:A', 15)  # SKU
-                worksheet.set_column('B:B', 35)  # Product
-                worksheet.set_column('C:C', 12)  # Current_Order
-                worksheet.set_column('D:D', 30)  # Suggestion
-                worksheet.set_column('E:E', 25)  # Savings
-                worksheet.set_column('F:F', 35)  # Action
-
-                worksheet.freeze_panes(1, 0)
-
-            # 6. OPPORTUNITIES SHEET
-            if insights.get('opportunities'):
-                opp_df = pd.DataFrame(insights.get('opportunities'))
-                opp_df.to_excel(writer, sheet_name='🎯 Opportunities', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['🎯 Opportunities']
-
-                # Write headers
-                for col_num, column in enumerate(opp_df.columns):
-                    worksheet.write(0, col_num, column, header_format)
-
-                # Set column widths
-                worksheet.set_column('A:A', 12)  # Type
-                worksheet.set_column('B:B', 15)  # SKU
-                worksheet.set_column('C:C', 35)  # Product
-                worksheet.set_column('D:D', 20)  # Trend
-                worksheet.set_column('E:E', 25)  # Action
-                worksheet.set_column('F:F', 30)  # Potential
-
-                # Apply good formatting to all opportunity rows
-                for row in range(1, len(opp_df) + 1):
-                    for col in range(len(opp_df.columns)):
-                        worksheet.write(row, col, opp_df.iloc[row-1, col], good_format)
-
-                worksheet.freeze_panes(1, 0)
-
-            # 8. MONTHLY ACTIONS SHEET
-            if insights.get('monthly_actions'):
-                monthly_df = pd.DataFrame(insights.get('monthly_actions'))
-                monthly_df.to_excel(writer, sheet_name='📆 Monthly Actions', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['📆 Monthly Actions']
-
-                # Write headers
-                for col_num, column in enumerate(monthly_df.columns):
-                    worksheet.write(0, col_num, column, header_format)
-
-                # Set column widths
-                worksheet.set_column('A:A', 15)  # SKU
-                worksheet.set_column('B:B', 35)  # Product
-                worksheet.set_column('C:C', 20)  # Action
-                worksheet.set_column('D:D', 12)  # Order_Date
-                worksheet.set_column('E:E', 10)  # Quantity
-                worksheet.set_column('F:F', 25)  # Preparation
-                worksheet.set_column('G:G', 15)  # Budget_Impact
-
-                worksheet.freeze_panes(1, 0)
-
-            # Function to format worksheet with proper column widths
-            def format_worksheet(worksheet, df, sheet_name):
-                # Write headers with formatting
-                for col_num, column in enumerate(df.columns):
-                    worksheet.write(0, col_num, column, header_format)
-
-                # Define optimal column widths based on column names and content
-                column_widths = {
-                    'SKU': 15,
-                    'Product_Name': 35,
-                    'Product': 35,
-                    'Launch_Date': 12,
-                    'Years_Since_Launch': 10,
-                    'Current_Inventory': 12,
-                    'Stock_Status': 15,
-                    'PO_Urgency': 25,
-                    'Recommended_PO_Qty': 15,
-                    'Next_Order_Date': 12,
-                    'Next_Order_Qty': 12,
-                    'Next_Arrival_Date': 12,
-                    'Months_of_Inventory': 12,
-                    'Velocity_Category': 10,
-                    'Safety_Stock_Months': 12,
-                    'Reorder_Point': 12,
-                    'Safety_Stock': 12,
-                    'Last_3_Months_Avg': 12,
-                    'Total_Sales': 12,
-                    'Growth_Rate': 10,
-                    'Order_2_Date': 12,
-                    'Order_2_Qty': 10,
-                    'Order_2_Arrival': 12,
-                    'Order_3_Date': 12,
-                    'Order_3_Qty': 10,
-                    'Order_3_Arrival': 12,
-                    'Lead_Time': 10,
-                    'Service_Level': 10,
-                    'Monthly_Velocity': 12,
-                    'Velocity_Rank': 10,
-                    'Channel': 10,
-                    'Forecast_Method': 20,
-                    'Priority': 12,
-                    'Action': 40,
-                    'Reason': 30,
-                    'Quantity': 10,
-                    'Impact': 30,
-                    'Contact': 35,
-                    'By_Date': 12,
-                    'Notes': 30,
-                    'Risk_Level': 12,
-                    'Issue': 35,
-                    'Potential_Loss': 15,
-                    'Mitigation': 40,
-                    'Order_Month': 12,
-                    'Order_Date': 12,
-                    'Order_Quantity': 12,
-                    'Order_Urgency': 15,
-                    'Unit_Cost': 10,
-                    'Total_Order_Value': 15,
-                    'Supplier': 20,
-                    'Payment_Terms': 15,
-                    'Expected_Payment_Date': 15,
-                    'Priority_Score': 10,
-                    'Action_Priority': 12,
-                    'Action_Timeline': 15,
-                    'Recommended_Action': 35,
-                    'Next_Month_Forecast': 12,
-                    'Type': 12,
-                    'Trend': 20,
-                    'Potential': 30,
-                    'Current_Order': 12,
-                    'Suggestion': 30,
-                    'Savings': 25,
-                    'Preparation': 30,
-                    'Budget_Impact': 15,
-                    'Metric': 30,
-                    'Value': 20,
-                    'Excess_Units': 12,
-                    'Excess_Value': 15,
-                    'SKU_Count': 10,
-                    'Inventory_Value': 15,
-                    'Order_Value': 12,
-                    'Arrival_Date': 12,
-                    'Mapping_Status': 20
-                }
+        # 3. ACTION PRIORITY MATRIX
+        if not priority_matrix.empty:
+            sheet_frames['📋 Action Priority Matrix'] = priority_matrix
 
-                # Set column widths
-                for i, col in enumerate(df.columns):
-                    # Check for specific column names first
-                    if col in column_widths:
-                        width = column_widths[col]
-                    # Check for forecast columns (dynamic month names)
-                    elif col.startswith('Forecast_'):
-                        width = 12
-                    # Check for month columns (Jan_2025, etc.)
-                    elif any(month in col for month in ['Jan_', 'Feb_', 'Mar_', 'Apr_', 'May_', 'Jun_', 'Jul_', 'Aug_', 'Sep_', 'Oct_', 'Nov_', 'Dec_']):
-                        width = 10
-                    # Check for Amazon/Shopify breakdown columns
-                    elif col.startswith('Amazon_') or col.startswith('Shopify_'):
-                        width = 12
-                    # Default widths based on data type
-                    else:
-                        # Calculate based on content
-                        max_len = len(str(col))
-                        for idx, value in enumerate(df[col][:10]):  # Check first 10 rows
-                            try:
-                                value_len = len(str(value)) if pd.notna(value) else 0
-                                max_len = max(max_len, value_len)
-                            except:
-                                pass
-                        width = min(max(max_len + 2, 8), 40)
-
-                    worksheet.set_column(i, i, width)
-
-                # Apply data formatting based on column type
-                for row_num in range(1, len(df) + 1):
-                    for col_num, col_name in enumerate(df.columns):
-                        value = df.iloc[row_num-1, col_num]
-
-                        # Handle NaN/Inf values
-                        if pd.isna(value):
-                            value = ''
-                        elif isinstance(value, (int, float)):
-                            if value == float('inf'):
-                                value = 999999
-                            elif value == float('-inf'):
-                                value = -999999
-                            elif pd.isna(value):
-                                value = 0
+        # 4. WEEKLY ACTIONS
+        if insights.get('weekly_actions'):
+            sheet_frames['📅 Weekly Actions'] = pd.DataFrame(insights.get('weekly_actions'))
 
-                        # Apply formatting based on column type
-                        if 'Date' in col_name and value != '':
-                            try:
-                                # Convert to datetime for proper Excel date formatting
-                                if isinstance(value, str) and value:
-                                    date_value = pd.to_datetime(value)
-                                    worksheet.write_datetime(row_num, col_num, date_value, date_format)
-                                else:
-                                    worksheet.write(row_num, col_num, value, text_format)
-                            except:
-                                worksheet.write(row_num, col_num, value, text_format)
-
-                        elif col_name in ['Current_Inventory', 'Recommended_PO_Qty', 'Next_Order_Qty',
-                                         'Order_2_Qty', 'Order_3_Qty', 'Safety_Stock', 'Reorder_Point',
-                                         'Order_Quantity', 'Quantity', 'Excess_Units', 'SKU_Count'] or 'Forecast_' in col_name:
-                            try:
-                                if isinstance(value, (int, float)) and pd.notna(value):
-                                    worksheet.write(row_num, col_num, value, number_format)
-                                else:
-                                    worksheet.write(row_num, col_num, value, text_format)
-                            except:
-                                worksheet.write(row_num, col_num, value, text_format)
-
-                        elif col_name in ['Months_of_Inventory', 'Last_3_Months_Avg', 'Growth_Rate',
-                                         'Monthly_Velocity', 'Years_Since_Launch', 'Safety_Stock_Months']:
-                            try:
-                                if isinstance(value, (int, float)) and pd.notna(value):
-                                    worksheet.write(row_num, col_num, value, decimal_format)
-                                else:
-                                    worksheet.write(row_num, col_num, value, text_format)
-                            except:
-                                worksheet.write(row_num, col_num, value, text_format)
-
-                        elif col_name in ['Total_Order_Value', 'Inventory_Value', 'Excess_Value',
-                                         'Order_Value', 'Potential_Loss', 'Budget_Impact'] or 'Value' in col_name:
-                            try:
-                                if isinstance(value, (int, float)) and pd.notna(value):
-                                    worksheet.write(row_num, col_num, value, currency_format)
-                                else:
-                                    worksheet.write(row_num, col_num, value, text_format)
-                            except:
-                                worksheet.write(row_num, col_num, value, text_format)
+        # 5. RISK ANALYSIS
+        if insights.get('risk_analysis'):
+            sheet_frames['⚠️ Risk Analysis'] = pd.DataFrame(insights.get('risk_analysis'))
 
-                        else:
-                            worksheet.write(row_num, col_num, value, text_format)
+        # 7. COST OPTIMIZATION SHEET
+        if insights.get('cost_optimization'):
+            sheet_frames['💡 Cost Optimization'] = pd.DataFrame(insights.get('cost_optimization'))
 
-                # Set row height for header
-                worksheet.set_row(0, 25)
+        # 6. OPPORTUNITIES SHEET
+        if insights.get('opportunities'):
+            sheet_frames['🎯 Opportunities'] = pd.DataFrame(insights.get('opportunities'))
 
-                # Freeze the header row and first two columns based on sheet type
-                if 'Executive' not in sheet_name:  # Don't freeze executive summary
-                    if 'All Forecasts' in sheet_name or 'Amazon' in sheet_name or 'Shopify' in sheet_name:
-                        worksheet.freeze_panes(1, 2)  # Freeze first 2 columns
-                    else:
-                        worksheet.freeze_panes(1, 0)  # Just freeze header row
-
-                # Add autofilter for data sheets
-                if len(df) > 0 and 'Executive' not in sheet_name:
-                    worksheet.autofilter(0, 0, len(df), len(df.columns) - 1)
-
-            # Write and format remaining sheets (after the special sheets)
-            if not combined_forecast.empty:
-                combined_forecast.to_excel(writer, sheet_name='📈 All Forecasts', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['📈 All Forecasts']
-                format_worksheet(worksheet, combined_forecast, '📈 All Forecasts')
-
-                # Add conditional formatting for Stock Status
-                status_col_idx = None
-                for i, col in enumerate(combined_forecast.columns):
-                    if col == 'Stock_Status':
-                        status_col_idx = i
-                        break
+        # 8. MONTHLY ACTIONS SHEET
+        if insights.get('monthly_actions'):
+            sheet_frames['📆 Monthly Actions'] = pd.DataFrame(insights.get('monthly_actions'))
 
-                if status_col_idx is not None:
-                    for row in range(1, len(combined_forecast) + 1):
-                        status = combined_forecast.iloc[row-1]['Stock_Status']
-                        if status == 'OUT OF STOCK':
-                            worksheet.write(row, status_col_idx, status, urgent_format)
-                        elif status == 'REORDER NOW':
-                            worksheet.write(row, status_col_idx, status, warning_format)
-                        elif status == 'NORMAL':
-                            worksheet.write(row, status_col_idx, status, good_format)
-
-                # Apply conditional formatting for PO_Urgency
-                urgency_col_idx = None
-                for i, col in enumerate(combined_forecast.columns):
-                    if col == 'PO_Urgency':
-                        urgency_col_idx = i
-                        break
+        # Remaining sheets (after the special sheets)
+        if not combined_forecast.empty:
+            sheet_frames['📈 All Forecasts'] = combined_forecast
 
-                if urgency_col_idx is not None:
-                    for row in range(1, len(combined_forecast) + 1):
-                        urgency = combined_forecast.iloc[row-1]['PO_Urgency']
-                        if 'HIGH' in urgency:
-                            worksheet.write(row, urgency_col_idx, urgency, urgent_format)
-                        elif 'MEDIUM' in urgency:
-                            worksheet.write(row, urgency_col_idx, urgency, warning_format)
-
-            if not finance_forecast.empty:
-                finance_forecast.to_excel(writer, sheet_name='💰 Finance Cash Flow', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['💰 Finance Cash Flow']
-                format_worksheet(worksheet, finance_forecast, '💰 Finance Cash Flow')
-
-                # Apply specific formatting for finance sheet
-                finance_widths = {
-                    'Order_Month': 12,
-                    'Order_Date': 12,
-                    'SKU': 15,
-                    'Product_Name': 35,
-                    'Velocity_Category': 10,
-                    'Order_Quantity': 12,
-                    'Order_Urgency': 15,
-                    'Unit_Cost': 10,
-                    'Total_Order_Value': 15,
-                    'Supplier': 20,
-                    'Payment_Terms': 15,
-                    'Expected_Payment_Date': 18,
-                    'Lead_Time': 10,
-                    'Safety_Stock_Months': 12,
-                    'Current_Inventory': 12,
-                    'Months_of_Inventory': 12
-                }
+        if not finance_forecast.empty:
+            sheet_frames['💰 Finance Cash Flow'] = finance_forecast
 
-                for i, col in enumerate(finance_forecast.columns):
-                    if col in finance_widths:
-                        worksheet.set_column(i, i, finance_widths[col])
-
-                # Add a note for finance team
-                note_text = "Please fill in Unit_Cost, Supplier, and Payment_Terms for accurate cash flow planning"
-                worksheet.write(len(finance_forecast) + 3, 0, "Note:", header_format)
-                worksheet.merge_range(len(finance_forecast) + 3, 1, len(finance_forecast) + 3, 6, note_text, text_format)
-
-            if not amazon_forecast.empty:
-                amazon_forecast.to_excel(writer, sheet_name='🛒 Amazon', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['🛒 Amazon']
-                format_worksheet(worksheet, amazon_forecast, '🛒 Amazon')
-
-            if not shopify_forecast.empty:
-                shopify_forecast.to_excel(writer, sheet_name='🛍️ Shopify', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['🛍️ Shopify']
-                format_worksheet(worksheet, shopify_forecast, '🛍️ Shopify')
-
-            if not shopify_faire_forecast.empty:
-                shopify_faire_forecast.to_excel(writer, sheet_name='🛍️ Shopify Faire', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['🛍️ Shopify Faire']
-                format_worksheet(worksheet, shopify_faire_forecast, '🛍️ Shopify Faire')
-
-            if not amazon_fbm_forecast.empty:
-                amazon_fbm_forecast.to_excel(writer, sheet_name='🛍️ Amazon FBM', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['🛍️ Amazon FBM']
-                format_worksheet(worksheet, amazon_fbm_forecast, '🛍️ Amazon FBM')
-
-            if not walmart_fbm_forecast.empty:
-                walmart_fbm_forecast.to_excel(writer, sheet_name='🛍️ Walmart FBM', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['🛍️ Walmart FBM']
-                format_worksheet(worksheet, walmart_fbm_forecast, '🛍️ Walmart FBM')
-
-            # Additional analysis sheets with proper formatting
-
-            # Out of Stock Analysis
-            if 'Stock_Status' in combined_forecast.columns:
-                out_of_stock = combined_forecast[combined_forecast['Stock_Status'] == 'OUT OF STOCK']
-                if not out_of_stock.empty:
-                    out_of_stock.to_excel(writer, sheet_name='❌ Out of Stock', index=False, header=False, startrow=1)
-                    worksheet = writer.sheets['❌ Out of Stock']
-                    format_worksheet(worksheet, out_of_stock, '❌ Out of Stock')
-                    # Highlight all rows as critical
-                    for row in range(1, len(out_of_stock) + 1):
-                        worksheet.set_row(row, None, urgent_format)
-
-            # Reorder Now Analysis
-            if 'Stock_Status' in combined_forecast.columns:
-                reorder_now = combined_forecast[combined_forecast['Stock_Status'] == 'REORDER NOW']
-                if not reorder_now.empty:
-                    reorder_now.to_excel(writer, sheet_name='📦 Reorder Now', index=False, header=False, startrow=1)
-                    worksheet = writer.sheets['📦 Reorder Now']
-                    format_worksheet(worksheet, reorder_now, '📦 Reorder Now')
-                    # Highlight all rows as warning
-                    for row in range(1, len(reorder_now) + 1):
-                        worksheet.set_row(row, None, warning_format)
-
-            # Overstock Analysis
-            if 'Months_of_Inventory' in combined_forecast.columns:
-                overstock = combined_forecast[combined_forecast['Months_of_Inventory'] > 6]
-                if not overstock.empty:
-                    overstock_analysis = overstock[['SKU', 'Product_Name', 'Current_Inventory', 'Months_of_Inventory',
-                                                   'Last_3_Months_Avg', 'Velocity_Category']].copy()
-                    overstock_analysis['Excess_Units'] = overstock_analysis['Current_Inventory'] - (overstock_analysis['Last_3_Months_Avg'] * 3)
-                    overstock_analysis['Excess_Value'] = overstock_analysis['Excess_Units'] * 30  # $30 cost assumption
-                    overstock_analysis.to_excel(writer, sheet_name='📈 Overstock Analysis', index=False, header=False, startrow=1)
-                    worksheet = writer.sheets['📈 Overstock Analysis']
-                    format_worksheet(worksheet, overstock_analysis, '📈 Overstock Analysis')
-
-            # Velocity Analysis
-            if 'Velocity_Category' in combined_forecast.columns:
-                velocity_summary = combined_forecast.groupby('Velocity_Category').agg({
-                    'SKU': 'count',
-                    'Current_Inventory': 'sum',
-                    'Recommended_PO_Qty': 'sum'
-                }).rename(columns={'SKU': 'SKU_Count'})
-                velocity_summary['Inventory_Value'] = velocity_summary['Current_Inventory'] * 30
-                velocity_summary.to_excel(writer, sheet_name='⚡ Velocity Analysis', startrow=1)
-                worksheet = writer.sheets['⚡ Velocity Analysis']
-                # Format velocity analysis
-                worksheet.write(0, 0, 'Velocity_Category', header_format)
-                worksheet.write(0, 1, 'SKU_Count', header_format)
-                worksheet.write(0, 2, 'Current_Inventory', header_format)
-                worksheet.write(0, 3, 'Recommended_PO_Qty', header_format)
-                worksheet.write(0, 4, 'Inventory_Value', header_format)
-                worksheet.set_column('A:A', 15)
-                worksheet.set_column('B:B', 12)
-                worksheet.set_column('C:C', 15)
-                worksheet.set_column('D:D', 18)
-                worksheet.set_column('E:E', 15)
-
-            # Monthly Order Schedule
-            order_schedule = []
-            for _, row in combined_forecast.iterrows():
-                if row['Next_Order_Date']:
-                    order_schedule.append({
-                        'Order_Date': row['Next_Order_Date'],
-                        'SKU': row['SKU'],
-                        'Product': row['Product_Name'],
-                        'Quantity': row['Next_Order_Qty'],
-                        'Lead_Time': row['Lead_Time'],
-                        'Arrival_Date': row['Next_Arrival_Date']
-                    })
-                if row['Order_2_Date']:
-                    order_schedule.append({
-                        'Order_Date': row['Order_2_Date'],
-                        'SKU': row['SKU'],
-                        'Product': row['Product_Name'],
-                        'Quantity': row['Order_2_Qty'],
-                        'Lead_Time': row['Lead_Time'],
-                        'Arrival_Date': row['Order_2_Arrival']
-                    })
+        channel_sheets = [
+            (FORECAST_CHANNEL_SHEETS['Amazon'], amazon_forecast),
+            (FORECAST_CHANNEL_SHEETS['Shopify'], shopify_forecast),
+            (FORECAST_CHANNEL_SHEETS['Shopify Faire'], shopify_faire_forecast),
+            (FORECAST_CHANNEL_SHEETS['Amazonfbm'], amazon_fbm_forecast),
+            (FORECAST_CHANNEL_SHEETS['Walmartfbm'], walmart_fbm_forecast),
+        ]
+        for sheet_name, channel_df in channel_sheets:
+            if not channel_df.empty:
+                sheet_frames[sheet_name] = channel_df
+
+        # Additional analysis sheets
+
+        # Out of Stock Analysis
+        if 'Stock_Status' in combined_forecast.columns:
+            out_of_stock = combined_forecast[combined_forecast['Stock_Status'] == 'OUT OF STOCK']
+            if not out_of_stock.empty:
+                sheet_frames['❌ Out of Stock'] = out_of_stock
+
+        # Reorder Now Analysis
+        if 'Stock_Status' in combined_forecast.columns:
+            reorder_now = combined_forecast[combined_forecast['Stock_Status'] == 'REORDER NOW']
+            if not reorder_now.empty:
+                sheet_frames['📦 Reorder Now'] = reorder_now
+
+        # Overstock Analysis
+        if 'Months_of_Inventory' in combined_forecast.columns:
+            overstock = combined_forecast[combined_forecast['Months_of_Inventory'] > 6]
+            if not overstock.empty:
+                overstock_analysis = overstock[['SKU', 'Product_Name', 'Current_Inventory', 'Months_of_Inventory',
+                                               'Last_3_Months_Avg', 'Velocity_Category']].copy()
+                overstock_analysis['Excess_Units'] = overstock_analysis['Current_Inventory'] - (overstock_analysis['Last_3_Months_Avg'] * 3)
+                overstock_analysis['Excess_Value'] = overstock_analysis['Excess_Units'] * 30  # $30 cost assumption
+                sheet_frames['📈 Overstock Analysis'] = overstock_analysis
+
+        # Velocity Analysis
+        if 'Velocity_Category' in combined_forecast.columns:
+            velocity_summary = combined_forecast.groupby('Velocity_Category').agg({
+                'SKU': 'count',
+                'Current_Inventory': 'sum',
+                'Recommended_PO_Qty': 'sum'
+            }).rename(columns={'SKU': 'SKU_Count'})
+            velocity_summary['Inventory_Value'] = velocity_summary['Current_Inventory'] * 30
+            sheet_frames['⚡ Velocity Analysis'] = velocity_summary.reset_index()
+
+        # Monthly Order Schedule
+        order_schedule = []
+        for _, row in combined_forecast.iterrows():
+            if row['Next_Order_Date']:
+                order_schedule.append({
+                    'Order_Date': row['Next_Order_Date'],
+                    'SKU': row['SKU'],
+                    'Product': row['Product_Name'],
+                    'Quantity': row['Next_Order_Qty'],
+                    'Lead_Time': row['Lead_Time'],
+                    'Arrival_Date': row['Next_Arrival_Date']
+                })
+            if row['Order_2_Date']:
+                order_schedule.append({
+                    'Order_Date': row['Order_2_Date'],
+                    'SKU': row['SKU'],
+                    'Product': row['Product_Name'],
+                    'Quantity': row['Order_2_Qty'],
+                    'Lead_Time': row['Lead_Time'],
+                    'Arrival_Date': row['Order_2_Arrival']
+                })
 
-            if order_schedule:
-                schedule_df = pd.DataFrame(order_schedule)
-                schedule_df['Order_Date'] = pd.to_datetime(schedule_df['Order_Date'])
-                schedule_df = schedule_df.sort_values('Order_Date')
-                schedule_df['Order_Value'] = schedule_df['Quantity'] * 30
-                # Convert back to string for Excel
-                schedule_df['Order_Date'] = schedule_df['Order_Date'].dt.strftime('%Y-%m-%d')
-                schedule_df.to_excel(writer, sheet_name='📅 Order Schedule', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['📅 Order Schedule']
-                # Write headers
-                headers = ['Order_Date', 'SKU', 'Product', 'Quantity', 'Lead_Time', 'Arrival_Date', 'Order_Value']
-                for col_num, header in enumerate(headers):
-                    worksheet.write(0, col_num, header, header_format)
-                # Set column widths
-                worksheet.set_column('A:A', 12)  # Order_Date
-                worksheet.set_column('B:B', 15)  # SKU
-                worksheet.set_column('C:C', 35)  # Product
-                worksheet.set_column('D:D', 10)  # Quantity
-                worksheet.set_column('E:E', 10)  # Lead_Time
-                worksheet.set_column('F:F', 12)  # Arrival_Date
-                worksheet.set_column('G:G', 12)  # Order_Value
-                # Format data
-                for row_num in range(1, len(schedule_df) + 1):
-                    for col_num in range(len(headers)):
-                        value = schedule_df.iloc[row_num-1, col_num]
-                        if headers[col_num] == 'Order_Value':
-                            worksheet.write(row_num, col_num, value, currency_format)
-                        elif headers[col_num] in ['Quantity', 'Lead_Time']:
-                            worksheet.write(row_num, col_num, value, number_format)
-                        else:
-                            worksheet.write(row_num, col_num, value, text_format)
-                worksheet.freeze_panes(1, 0)
-                worksheet.autofilter(0, 0, len(schedule_df), len(headers) - 1)
-
-            # Create a mapping report to show which SKUs were matched vs filtered out
-            if not combined_forecast.empty:
-                # Show only mapped products in the main report
-                mapping_report = combined_forecast[['SKU', 'Product_Name', 'Launch_Date', 'Years_Since_Launch']].copy()
-                mapping_report['Mapping_Status'] = 'SUCCESSFULLY_MAPPED'
-                mapping_report.to_excel(writer, sheet_name='🔗 Mapped Products', index=False, header=False, startrow=1)
-                worksheet = writer.sheets['🔗 Mapped Products']
-                format_worksheet(worksheet, mapping_report, '🔗 Mapped Products')
+        if order_schedule:
+            schedule_df = pd.DataFrame(order_schedule)
+            schedule_df['Order_Date'] = pd.to_datetime(schedule_df['Order_Date'])
+            schedule_df = schedule_df.sort_values('Order_Date')
+            schedule_df['Order_Value'] = schedule_df['Quantity'] * 30
+            # Convert back to string for Excel
+            schedule_df['Order_Date'] = schedule_df['Order_Date'].dt.strftime('%Y-%m-%d')
+            sheet_frames['📅 Order Schedule'] = schedule_df
+
+        # Create a mapping report to show which SKUs were matched vs filtered out
+        if not combined_forecast.empty:
+            # Show only mapped products in the main report
+            mapping_report = combined_forecast[['SKU', 'Product_Name', 'Launch_Date', 'Years_Since_Launch']].copy()
+            mapping_report['Mapping_Status'] = 'SUCCESSFULLY_MAPPED'
+            sheet_frames['🔗 Mapped Products'] = mapping_report
+
+        forecast_result = get_run_result_cache().put(ForecastRunResult(
+            sheet_frames, filename,
+            # Stamp the data cutoff rather than "now" into the workbook
+            workbook_created=model.data['Date'].max().to_pydatetime(),
+            history=model.data[HistoricalSalesStore.COLUMNS]
+        ))
 
         # For CLI execution - save to file
         try:
@@ -6330,7 +5803,7 @@ def main():
         if not is_streamlit:
             # Save to file for CLI execution
             with open(filename, 'wb') as f:
-                f.write(excel_buffer.getvalue())
+                f.write(forecast_result.excel_bytes())
 
         print(f"\n🎉 SUCCESS! Comprehensive enhanced forecasting complete!")
         print(f"Results saved to: {filename}")
@@ -6435,16 +5908,11 @@ def main():
 
         print("\n✅ Ready for inventory planning decisions!")
 
-        # Return the Excel buffer for Streamlit
-        excel_buffer.seek(0)
-
-        # Upload to Google Sheets before returning
-        upload_excel_to_google_sheet(excel_buffer)
+        # Publish to Google Sheets and Drive in the background
+        publish_job = submit_publish_job("forecast", sheet_frames, FORECAST_OUTPUT_SHEET_ID,
+                                         forecast_result.excel_bytes, upload_to_google_drive_from_buffer)
 
-        # Upload to Google Drive (NEW)
-        drive_file_id = upload_to_google_drive_from_buffer(excel_buffer)
-
-        return excel_buffer, filename, drive_file_id
+        return forecast_result, filename, publish_job
 
 
     except FileNotFoundError as e:
@@ -6454,13 +5922,13 @@ def main():
         print("   - current_inventory.csv (if not using Google Sheets)")
         print("   - lead_times.csv")
         print("   - product_info.csv")
-        return None, None
+        return None, None, None
 
     except Exception as e:
         print(f"Unexpected error: {e}")
         import traceback
         traceback.print_exc()
-        return None, None
+        return None, None, None
 
 # ==============================================================================
 # API LAYER (FastAPI)
@@ -6486,8 +5954,867 @@ api_app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory job storage (replace with Redis in production if needed)
-api_jobs_store: Dict[str, Dict[str, Any]] = {}
+# ------------------------------------------------------------------------------
+# Job Store (SQLite, WAL)
+# ------------------------------------------------------------------------------
+# Jobs live in a SQLite database in WAL mode so every uvicorn worker sees the
+# same jobs and they survive restarts. Result payloads are stored as
+# zlib-compressed JSON and only loaded when a result is requested; finished
+# jobs are evicted after JOB_TTL_SECONDS or when the stored results exceed
+# JOB_STORE_MAX_BYTES (oldest first).
+
+API_STATE_DIR = os.environ.get("HG_API_STATE_DIR", os.path.join(BASE_DIR, ".api_state"))
+JOB_DB_PATH = os.path.join(API_STATE_DIR, "jobs.sqlite3")
+JOB_TTL_SECONDS = 7 * 24 * 3600
+JOB_STORE_MAX_BYTES = 256 * 1024 * 1024   # compressed result bytes kept on disk
+JOB_EVICT_INTERVAL_SECONDS = 300
+JOB_STALE_SECONDS = 60   # an active job not heartbeated for this long has lost its worker
+
+JOB_COLUMNS = ("job_id", "request_id", "input_hash", "status", "progress_percent", "started_at", "completed_at", "error",
+               "erp_version")
+ACTIVE_JOB_STATUSES = ("pending", "processing")
+JOB_EVENT_COLUMNS = ("seq", "stage", "percent", "stage_seconds", "elapsed_seconds", "message", "created_at")
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+class SQLiteStore:
+    """A SQLite database in WAL mode with one connection per thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self):
+        return _WriteTransaction(self._conn())
+
+
+class JobStore(SQLiteStore):
+    """SQLite-backed job table."""
+
+    def __init__(self, path=JOB_DB_PATH):
+        super().__init__(path)
+        self._last_evict = 0.0
+        with self._write() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    request_id TEXT,
+                    input_hash TEXT,
+                    status TEXT NOT NULL,
+                    progress_percent INTEGER NOT NULL DEFAULT 0,
+                    started_at TEXT,
+                    completed_at TEXT,
+                    error TEXT,
+                    result BLOB,
+                    result_bytes INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL
+                )""")
+            existing_columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "input_hash" not in existing_columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN input_hash TEXT")
+            if "erp_version" not in existing_columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN erp_version INTEGER")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    stage TEXT NOT NULL,
+                    percent INTEGER,
+                    stage_seconds REAL,
+                    elapsed_seconds REAL,
+                    message TEXT,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_webhooks (
+                    job_id TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    notified_at REAL,
+                    PRIMARY KEY (job_id, url)
+                )""")
+            if "notified_at" not in {row["name"] for row in conn.execute("PRAGMA table_info(job_webhooks)")}:
+                conn.execute("ALTER TABLE job_webhooks ADD COLUMN notified_at REAL")
+            # Every request_id that created or joined a job, so a replay finds the same run
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS request_ids (
+                    request_id TEXT PRIMARY KEY,
+                    job_id TEXT NOT NULL
+                )""")
+            conn.execute("INSERT OR IGNORE INTO request_ids (request_id, job_id) "
+                         "SELECT request_id, job_id FROM jobs WHERE request_id IS NOT NULL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_request_ids_job ON request_ids (job_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, completed_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_input_hash ON jobs (input_hash, status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs (updated_at)")
+        self._ensure_request_id_unique()
+
+    def _ensure_request_id_unique(self):
+        """request_id -> job is one-to-one; rows share the jobs' TTL/size eviction."""
+        try:
+            with self._write() as conn:
+                conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_request_id_unique "
+                             "ON jobs (request_id) WHERE request_id IS NOT NULL")
+                conn.execute("DROP INDEX IF EXISTS idx_jobs_request_id")
+        except sqlite3.IntegrityError:
+            # Older store with duplicate request_ids: keep a plain index until they are evicted
+            print("⚠️ Duplicate request_ids in job store; idempotency index is not unique yet")
+            with self._write() as conn:
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_request_id ON jobs (request_id)")
+
+    @staticmethod
+    def _job_dict(row):
+        return {col: row[col] for col in JOB_COLUMNS} if row is not None else None
+
+    @staticmethod
+    def _insert(conn, job):
+        columns = [col for col in JOB_COLUMNS if job.get(col) is not None] + ["updated_at"]
+        conn.execute(f"INSERT INTO jobs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                     [job[col] for col in columns[:-1]] + [time.time()])
+
+    def create(self, job):
+        with self._write() as conn:
+            self._insert(conn, job)
+        self.evict()
+
+    def create_or_join(self, job):
+        """
+        Insert `job` unless a job with the same request_id exists (any
+        status: idempotent replay) or a live job with the same input_hash is
+        pending or processing; returns (job, created). Runs in one write
+        transaction, so concurrent requests from any worker collapse onto a
+        single job. The request_id is recorded for the created or joined job
+        alike.
+        """
+        request_id = job.get("request_id")
+        with self._write() as conn:
+            if request_id is not None:
+                row = self._select_by_request_id(conn, request_id)
+                if row is not None:
+                    return self._job_dict(row), False
+            row = conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE input_hash = ? AND status IN (?, ?) "
+                "AND updated_at >= ? ORDER BY updated_at DESC LIMIT 1",
+                (job["input_hash"], *ACTIVE_JOB_STATUSES, time.time() - JOB_STALE_SECONDS)).fetchone()
+            if row is not None:
+                joined = self._job_dict(row)
+            else:
+                self._insert(conn, job)
+                joined = None
+            if request_id is not None:
+                conn.execute("INSERT INTO request_ids (request_id, job_id) VALUES (?, ?)",
+                             (request_id, (joined or job)["job_id"]))
+        if joined is not None:
+            return joined, False
+        self.evict()
+        return job, True
+
+    def delete(self, job_id):
+        """Remove a job that never ran (refused at submission), with its request_ids, events and webhooks."""
+        with self._write() as conn:
+            for table in ("jobs", "request_ids", "job_events", "job_webhooks"):
+                conn.execute(f"DELETE FROM {table} WHERE job_id = ?", (job_id,))
+
+    def update(self, job_id, result=None, active_only=False, **fields):
+        """
+        Update job columns; a `result` dict is compressed into the result blob.
+        With active_only the update only applies to a pending/processing job,
+        so a cancelled or timed-out job is never overwritten by its worker.
+        Returns whether a row was updated.
+        """
+        fields = {col: value for col, value in fields.items() if col in JOB_COLUMNS}
+        if result is not None:
+            blob = zlib.compress(json.dumps(result, default=_json_default).encode("utf-8"), 6)
+            fields["result"] = blob
+            fields["result_bytes"] = len(blob)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{col} = ?" for col in fields)
+        condition = "job_id = ?" + (" AND status IN (?, ?)" if active_only else "")
+        params = list(fields.values()) + [job_id] + (list(ACTIVE_JOB_STATUSES) if active_only else [])
+        with self._write() as conn:
+            return conn.execute(f"UPDATE jobs SET {assignments} WHERE {condition}", params).rowcount > 0
+
+    def add_event(self, job_id, stage, percent=None, stage_seconds=None, elapsed_seconds=None, message=None):
+        """Append a progress event; `percent` also becomes the job's progress_percent."""
+        with self._write() as conn:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?",
+                               (job_id,)).fetchone()[0]
+            conn.execute("INSERT INTO job_events (job_id, seq, stage, percent, stage_seconds, elapsed_seconds, "
+                         "message, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (job_id, seq, stage, percent, stage_seconds, elapsed_seconds, message, time.time()))
+            if percent is not None:
+                conn.execute("UPDATE jobs SET progress_percent = ?, updated_at = ? "
+                             "WHERE job_id = ? AND status IN (?, ?)",
+                             (percent, time.time(), job_id, *ACTIVE_JOB_STATUSES))
+        return seq
+
+    def events_after(self, job_id, after_seq=0):
+        rows = self._conn().execute(f"SELECT {', '.join(JOB_EVENT_COLUMNS)} FROM job_events "
+                                    "WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, after_seq)).fetchall()
+        return [{col: row[col] for col in JOB_EVENT_COLUMNS} for row in rows]
+
+    def add_webhook(self, job_id, url):
+        """Register `url` for one delivery of the job's outcome (again, if it was already notified)."""
+        with self._write() as conn:
+            conn.execute("INSERT INTO job_webhooks (job_id, url) VALUES (?, ?) "
+                         "ON CONFLICT (job_id, url) DO UPDATE SET notified_at = NULL", (job_id, url))
+
+    def claim_webhooks(self, job_id):
+        """URLs registered since the last delivery, marked notified; each is claimed by one caller only."""
+        with self._write() as conn:
+            rows = conn.execute("UPDATE job_webhooks SET notified_at = ? WHERE job_id = ? AND notified_at IS NULL "
+                                "RETURNING url", (time.time(), job_id)).fetchall()
+        return [row["url"] for row in rows]
+
+    def heartbeat(self, job_ids):
+        """Mark the given active jobs as still owned by a live worker."""
+        if not job_ids:
+            return
+        with self._write() as conn:
+            conn.execute(f"UPDATE jobs SET updated_at = ? WHERE status IN (?, ?) "
+                         f"AND job_id IN ({', '.join('?' * len(job_ids))})",
+                         [time.time(), *ACTIVE_JOB_STATUSES, *job_ids])
+
+    def cancelled_among(self, job_ids):
+        if not job_ids:
+            return set()
+        rows = self._conn().execute(f"SELECT job_id FROM jobs WHERE status = 'cancelled' "
+                                    f"AND job_id IN ({', '.join('?' * len(job_ids))})", list(job_ids)).fetchall()
+        return {row["job_id"] for row in rows}
+
+    def fail_stale(self):
+        """Fail active jobs whose worker stopped heartbeating (e.g. the API process restarted)."""
+        with self._write() as conn:
+            return conn.execute("UPDATE jobs SET status = 'failed', error = 'Job worker stopped before finishing', "
+                                "completed_at = ?, updated_at = ? WHERE status IN (?, ?) AND updated_at < ?",
+                                (datetime.now().isoformat() + "Z", time.time(), *ACTIVE_JOB_STATUSES,
+                                 time.time() - JOB_STALE_SECONDS)).rowcount
+
+    def get(self, job_id):
+        row = self._conn().execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._job_dict(row)
+
+    def get_result(self, job_id):
+        row = self._conn().execute("SELECT result FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None or row["result"] is None:
+            return None
+        return json.loads(zlib.decompress(row["result"]))
+
+    @staticmethod
+    def _select_by_request_id(conn, request_id):
+        return conn.execute(f"SELECT {', '.join('jobs.' + col for col in JOB_COLUMNS)} FROM request_ids "
+                            "JOIN jobs ON jobs.job_id = request_ids.job_id WHERE request_ids.request_id = ?",
+                            (request_id,)).fetchone()
+
+    def find_by_request_id(self, request_id):
+        """The job a request_id created or joined."""
+        return self._job_dict(self._select_by_request_id(self._conn(), request_id))
+
+    def latest_completed(self, kind="bom"):
+        """Newest completed job of `kind` (the job_id prefix, e.g. 'bom' or 'forecast')."""
+        row = self._conn().execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs "
+                                   "WHERE status = 'completed' AND result IS NOT NULL AND job_id LIKE ? "
+                                   "ORDER BY completed_at DESC LIMIT 1", (f"{kind}-%",)).fetchone()
+        return self._job_dict(row)
+
+    def evict(self, force=False):
+        """Drop finished jobs past their TTL, then the oldest results over the size budget."""
+        now = time.time()
+        if not force and now - self._last_evict < JOB_EVICT_INTERVAL_SECONDS:
+            return 0
+        self._last_evict = now
+        with self._write() as conn:
+            removed = conn.execute("DELETE FROM jobs WHERE status IN ('completed', 'failed', 'cancelled') AND updated_at < ?",
+                                   (now - JOB_TTL_SECONDS,)).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(result_bytes), 0) FROM jobs").fetchone()[0]
+            if total > JOB_STORE_MAX_BYTES:
+                for row in conn.execute("SELECT job_id, result_bytes FROM jobs WHERE status IN ('completed', 'failed', 'cancelled') "
+                                        "ORDER BY updated_at").fetchall():
+                    conn.execute("DELETE FROM jobs WHERE job_id = ?", (row["job_id"],))
+                    removed += 1
+                    total -= row["result_bytes"]
+                    if total <= JOB_STORE_MAX_BYTES:
+                        break
+            if removed:
+                conn.execute("DELETE FROM job_events WHERE job_id NOT IN (SELECT job_id FROM jobs)")
+                conn.execute("DELETE FROM job_webhooks WHERE job_id NOT IN (SELECT job_id FROM jobs)")
+                conn.execute("DELETE FROM request_ids WHERE job_id NOT IN (SELECT job_id FROM jobs)")
+        if removed:
+            print(f"🧹 Evicted {removed} job(s) from the job store")
+        return removed
+
+
+class _WriteTransaction:
+    """`with` block running its statements in one IMMEDIATE (write-locked) transaction."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """The process-wide JobStore, opened on first use."""
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore()
+        return _job_store
+
+# ------------------------------------------------------------------------------
+# State Backend (shared across API workers)
+# ------------------------------------------------------------------------------
+# Jobs and ERP data live in SQLite files every worker on the host opens. The
+# remaining shared state (forecast overrides, BOM run tables for
+# /api/v1/runs, version counters) goes through a StateBackend, so
+# `uvicorn --workers N` serves the same data from every worker. Per-process
+# caches (the requirements view) revalidate by comparing a version counter
+# instead of re-querying on a timer. HG_STATE_BACKEND selects the backend:
+# "sqlite" (default, one host) or "redis" (HG_REDIS_URL, several hosts).
+#
+# Concurrency limits are not shared: every worker runs its own BOM job
+# executor and /bom/run-sync slots, so with N workers up to
+# N * HG_BOM_JOB_WORKERS jobs run at once, N * HG_BOM_JOB_QUEUE_DEPTH may
+# queue and N * RUN_SYNC_MAX_CONCURRENT callers may wait. Size those
+# settings per worker.
+
+STATE_BACKEND = os.environ.get("HG_STATE_BACKEND", "sqlite")
+REDIS_URL = os.environ.get("HG_REDIS_URL", "redis://localhost:6379/0")
+STATE_DB_PATH = os.path.join(API_STATE_DIR, "state.sqlite3")
+STATE_PURGE_INTERVAL_SECONDS = 300
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+class StateBackend(ABC):
+    """
+    Namespaced bytes values with optional TTL, plus version counters. Every
+    change to a namespace bumps the counter of the same name, atomically with
+    the change.
+    """
+
+    @abstractmethod
+    def get(self, namespace, key):
+        ...
+
+    @abstractmethod
+    def put(self, namespace, key, value, ttl=None):
+        ...
+
+    @abstractmethod
+    def put_many(self, namespace, items, replace=False, ttl=None):
+        """Store {key: value}; with replace, every other key in the namespace is dropped."""
+
+    @abstractmethod
+    def delete(self, namespace, key=None):
+        """Delete one key, or the whole namespace."""
+
+    @abstractmethod
+    def items(self, namespace):
+        """{key: value} of the namespace's live keys."""
+
+    @abstractmethod
+    def bump(self, counter):
+        ...
+
+    @abstractmethod
+    def version(self, counter):
+        ...
+
+
+class SQLiteStateBackend(SQLiteStore, StateBackend):
+    """StateBackend in a SQLite file shared by the workers on one host."""
+
+    def __init__(self, path=STATE_DB_PATH):
+        super().__init__(path)
+        self._last_purge = 0.0
+        with self._write() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS state_kv (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_state_kv_expires_at ON state_kv (expires_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS state_versions (
+                    counter TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )""")
+
+    @staticmethod
+    def _bump(conn, counter):
+        conn.execute("INSERT INTO state_versions (counter, version) VALUES (?, 1) "
+                     "ON CONFLICT (counter) DO UPDATE SET version = version + 1", (counter,))
+        return conn.execute("SELECT version FROM state_versions WHERE counter = ?", (counter,)).fetchone()[0]
+
+    def _purge(self):
+        now = time.time()
+        if now - self._last_purge < STATE_PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = now
+        with self._write() as conn:
+            conn.execute("DELETE FROM state_kv WHERE expires_at < ?", (now,))
+
+    def get(self, namespace, key):
+        row = self._conn().execute("SELECT value FROM state_kv WHERE namespace = ? AND key = ? "
+                                   "AND (expires_at IS NULL OR expires_at >= ?)",
+                                   (namespace, key, time.time())).fetchone()
+        return row["value"] if row else None
+
+    def put(self, namespace, key, value, ttl=None):
+        self.put_many(namespace, {key: value}, ttl=ttl)
+
+    def put_many(self, namespace, items, replace=False, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._write() as conn:
+            if replace:
+                conn.execute("DELETE FROM state_kv WHERE namespace = ?", (namespace,))
+            conn.executemany("INSERT OR REPLACE INTO state_kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                             [(namespace, key, value, expires_at) for key, value in items.items()])
+            self._bump(conn, namespace)
+        self._purge()
+
+    def delete(self, namespace, key=None):
+        with self._write() as conn:
+            if key is None:
+                conn.execute("DELETE FROM state_kv WHERE namespace = ?", (namespace,))
+            else:
+                conn.execute("DELETE FROM state_kv WHERE namespace = ? AND key = ?", (namespace, key))
+            self._bump(conn, namespace)
+
+    def items(self, namespace):
+        rows = self._conn().execute("SELECT key, value FROM state_kv WHERE namespace = ? "
+                                    "AND (expires_at IS NULL OR expires_at >= ?) ORDER BY key",
+                                    (namespace, time.time())).fetchall()
+        return {row["key"]: row["value"] for row in rows}
+
+    def bump(self, counter):
+        with self._write() as conn:
+            return self._bump(conn, counter)
+
+    def version(self, counter):
+        row = self._conn().execute("SELECT version FROM state_versions WHERE counter = ?", (counter,)).fetchone()
+        return row["version"] if row else 0
+
+
+class RedisStateBackend(StateBackend):
+    """
+    StateBackend on Redis: a value per key (`hg:<namespace>:<key>`, with EX for
+    a TTL), a set indexing each namespace's keys, and INCR counters; changes
+    run in one MULTI/EXEC pipeline.
+    """
+
+    def __init__(self, url=REDIS_URL, prefix="hg"):
+        if not REDIS_AVAILABLE:
+            raise RuntimeError("HG_STATE_BACKEND=redis requires the 'redis' package")
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, namespace, key):
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def _index(self, namespace):
+        return f"{self.prefix}:{namespace}:__keys__"
+
+    def _counter(self, counter):
+        return f"{self.prefix}:__version__:{counter}"
+
+    def _keys(self, namespace):
+        return sorted(key.decode("utf-8") for key in self._redis.smembers(self._index(namespace)))
+
+    def get(self, namespace, key):
+        return self._redis.get(self._key(namespace, key))
+
+    def put(self, namespace, key, value, ttl=None):
+        self.put_many(namespace, {key: value}, ttl=ttl)
+
+    def put_many(self, namespace, items, replace=False, ttl=None):
+        stale = set(self._keys(namespace)) - set(items) if replace else set()
+        with self._redis.pipeline(transaction=True) as pipe:
+            for key in stale:
+                pipe.delete(self._key(namespace, key))
+            if stale:
+                pipe.srem(self._index(namespace), *stale)
+            for key, value in items.items():
+                pipe.set(self._key(namespace, key), value, ex=ttl)
+            if items:
+                pipe.sadd(self._index(namespace), *items)
+            pipe.incr(self._counter(namespace))
+            pipe.execute()
+
+    def delete(self, namespace, key=None):
+        keys = self._keys(namespace) if key is None else [key]
+        with self._redis.pipeline(transaction=True) as pipe:
+            for name in keys:
+                pipe.delete(self._key(namespace, name))
+            if keys:
+                pipe.srem(self._index(namespace), *keys)
+            pipe.incr(self._counter(namespace))
+            pipe.execute()
+
+    def items(self, namespace):
+        keys = self._keys(namespace)
+        values = self._redis.mget([self._key(namespace, key) for key in keys]) if keys else []
+        expired = [key for key, value in zip(keys, values) if value is None]
+        if expired:
+            self._redis.srem(self._index(namespace), *expired)
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def bump(self, counter):
+        return int(self._redis.incr(self._counter(counter)))
+
+    def version(self, counter):
+        return int(self._redis.get(self._counter(counter)) or 0)
+
+
+_state_backend = None
+_state_backend_lock = threading.Lock()
+
+
+def get_state_backend():
+    """The process-wide StateBackend selected by HG_STATE_BACKEND."""
+    global _state_backend
+    with _state_backend_lock:
+        if _state_backend is None:
+            if STATE_BACKEND == "redis":
+                _state_backend = RedisStateBackend()
+            elif STATE_BACKEND == "sqlite":
+                _state_backend = SQLiteStateBackend()
+            else:
+                raise ValueError(f"Unknown HG_STATE_BACKEND '{STATE_BACKEND}' (use 'sqlite' or 'redis')")
+        return _state_backend
+
+
+RUNS_NAMESPACE = "runs"
+COMPLETED_JOBS_COUNTER = "completed_jobs"
+FORECAST_RUNS_COUNTER = "forecast_runs"
+
+
+def encode_run_result(run) -> bytes:
+    """
+    A BOM or forecast run as bytes: a JSON header, then every table as an
+    Arrow IPC stream, each part length-prefixed. Runs cross the state backend
+    (possibly a Redis other hosts write to), so they are never pickled:
+    decoding these bytes cannot run code.
+    """
+    if not PARQUET_AVAILABLE:
+        raise ImportError("pyarrow is required to share run results")
+    header = {"kind": run.kind, "run_id": run.run_id, "filename": run.filename,
+              "created_at": run.created_at.isoformat(), "sheets": list(run.sheet_frames)}
+    tables = list(run.sheet_frames.values())
+    if isinstance(run, ForecastRunResult):
+        header["workbook_created"] = run.workbook_created.isoformat() if run.workbook_created else None
+        header["history"] = run.history is not None
+        if run.history is not None:
+            tables.append(run.history)
+
+    parts = [json.dumps(header).encode("utf-8")]
+    for df in tables:
+        table = _arrow_table(df)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        parts.append(sink.getvalue().to_pybytes())
+    return zlib.compress(b"".join(len(part).to_bytes(8, "big") + part for part in parts), 1)
+
+
+def decode_run_result(blob):
+    data = memoryview(zlib.decompress(blob))
+    parts, pos = [], 0
+    while pos < len(data):
+        size = int.from_bytes(data[pos:pos + 8], "big")
+        parts.append(data[pos + 8:pos + 8 + size])
+        pos += 8 + size
+    header = json.loads(bytes(parts[0]))
+    frames = [pa.ipc.open_stream(pa.py_buffer(part)).read_all().to_pandas() for part in parts[1:]]
+    sheet_frames = dict(zip(header["sheets"], frames))
+    created_at = datetime.fromisoformat(header["created_at"])
+    if header["kind"] == ForecastRunResult.kind:
+        workbook_created = header.get("workbook_created")
+        return ForecastRunResult(sheet_frames, header["filename"], created_at, header["run_id"],
+                                 workbook_created=datetime.fromisoformat(workbook_created) if workbook_created else None,
+                                 history=frames[-1] if header.get("history") else None)
+    return BOMAnalysisResult(sheet_frames, header["filename"], created_at, header["run_id"])
+
+
+def share_run_result(run, blob=None):
+    """Make a job's run tables available to /api/v1/runs in every worker (`blob`: the run, already encoded)."""
+    get_state_backend().put(RUNS_NAMESPACE, run.run_id, blob or encode_run_result(run), ttl=JOB_TTL_SECONDS)
+
+
+def find_run_result(run_id):
+    """A run from this process's cache, else from the state backend (then cached)."""
+    run = get_run_result_cache().get(run_id)
+    if run is not None:
+        return run
+    blob = get_state_backend().get(RUNS_NAMESPACE, run_id)
+    if blob is None:
+        return None
+    return get_run_result_cache().put(decode_run_result(blob))
+
+# ------------------------------------------------------------------------------
+# Latest Requirements View
+# ------------------------------------------------------------------------------
+# /api/v1/requirements/latest answers from a materialized copy of the newest
+# completed job's requirement rows: the status as a small integer enum, numeric
+# columns as float arrays, and row-index arrays per status, ABC class, supplier
+# and component type. It is rebuilt when a newer job completes, so a filtered
+# query is an index intersection plus a slice rather than a pass over dicts.
+
+ORDER_STATUS_CODES = {"urgent_reorder": 0, "reorder_soon": 1, "ok": 2}
+ORDER_STATUS_MARKERS = (("🔴", 0), ("🟡", 1), ("🟢", 2))
+UNKNOWN_ORDER_STATUS = 3
+REQUIREMENT_INDEX_COLUMNS = ("ABC_Class", "Supplier", "Component_Type")
+
+
+class RequirementsView:
+    """Columnar, indexed copy of one job's requirement rows."""
+
+    def __init__(self, job, result):
+        self.job_id = job["job_id"]
+        self.generated_at = job["completed_at"]
+        self.summary = result.get("summary")
+        self.rows = result.get("requirements", [])
+        self.fields = list(dict.fromkeys(field for row in self.rows for field in row))
+        frame = pd.DataFrame.from_records(self.rows, columns=self.fields)
+
+        status_text = frame["Order_Status"].astype(str) if "Order_Status" in frame else pd.Series([""] * len(frame))
+        self.status = np.full(len(frame), UNKNOWN_ORDER_STATUS, dtype=np.int8)
+        for marker, code in ORDER_STATUS_MARKERS:
+            self.status[status_text.str.contains(marker, regex=False).to_numpy()] = code
+
+        # Numeric columns (blanks allowed) as float arrays; everything else sorts as text
+        self.numeric = {}
+        for col in self.fields:
+            values = pd.to_numeric(frame[col].replace("", np.nan), errors="coerce")
+            if values.notna().sum() == frame[col].replace("", np.nan).notna().sum():
+                self.numeric[col] = values.to_numpy(dtype=np.float64)
+        self.cost = (np.nan_to_num(self.numeric["Procurement_Cost"]) if "Procurement_Cost" in self.numeric
+                     else np.zeros(len(frame)))
+
+        self.indexes = {"status": {code: np.flatnonzero(self.status == code) for code in range(UNKNOWN_ORDER_STATUS + 1)}}
+        for col in REQUIREMENT_INDEX_COLUMNS:
+            if col in frame:
+                self.indexes[col] = {key: np.asarray(positions, dtype=np.int64)
+                                     for key, positions in frame.groupby(frame[col].astype(str)).indices.items()}
+        self._frame = frame
+        self._ranks = {}
+
+    def _rank(self, field):
+        """Dense rank of every row by `field`, ties equal, -1 for blanks (computed once per field)."""
+        if field not in self._ranks:
+            if field in self.numeric:
+                keys = self.numeric[field]
+                missing = np.isnan(keys)
+            else:
+                keys = self._frame[field].astype(str).to_numpy()
+                missing = self._frame[field].isna().to_numpy() | (keys == "")
+            ranks = np.full(len(keys), -1, dtype=np.int64)
+            ranks[~missing] = np.unique(keys[~missing], return_inverse=True)[1].reshape(-1)
+            self._ranks[field] = ranks
+        return self._ranks[field]
+
+    def query(self, status=None, min_cost=None, filters=None, sort=None, offset=0, limit=None, fields=None):
+        """Returns (total matching rows, requested page of rows)."""
+        selections = []
+        if status in ORDER_STATUS_CODES:
+            selections.append(self.indexes["status"][ORDER_STATUS_CODES[status]])
+        for col, value in (filters or {}).items():
+            if value is not None:
+                selections.append(self.indexes.get(col, {}).get(value, np.empty(0, dtype=np.int64)))
+
+        if selections:
+            selections.sort(key=len)
+            positions = selections[0]
+            for other in selections[1:]:
+                positions = np.intersect1d(positions, other, assume_unique=True)
+        else:
+            positions = np.arange(len(self.rows))
+
+        if min_cost is not None:
+            positions = positions[self.cost[positions] >= min_cost]
+
+        if sort:
+            field = sort.lstrip("-")
+            if field not in self.fields:
+                raise KeyError(field)
+            ranks = self._rank(field)[positions]
+            # Blanks go last in either direction
+            present, missing = positions[ranks >= 0], positions[ranks < 0]
+            ranks = ranks[ranks >= 0]
+            positions = np.concatenate([present[np.argsort(-ranks if sort.startswith("-") else ranks, kind="stable")],
+                                        missing])
+
+        total = len(positions)
+        page = positions[offset:offset + limit if limit is not None else None]
+        if fields:
+            return total, [{field: self.rows[i].get(field, "") for field in fields} for i in page]
+        return total, [self.rows[i] for i in page]
+
+
+_requirements_view = None
+_requirements_view_version = -1   # COMPLETED_JOBS_COUNTER the view was checked at
+_requirements_view_lock = threading.Lock()
+
+
+def get_requirements_view(force=False):
+    """The view of the newest completed job, rebuilt when a newer one exists; None if no job has completed."""
+    global _requirements_view, _requirements_view_version
+    # Any worker's job completion bumps the counter, so an unchanged counter means an up-to-date view
+    version = get_state_backend().version(COMPLETED_JOBS_COUNTER)
+    with _requirements_view_lock:
+        if not force and _requirements_view is not None and version == _requirements_view_version:
+            return _requirements_view
+        _requirements_view_version = version
+        jobs = get_job_store()
+        latest_job = jobs.latest_completed()
+        if latest_job is None:
+            return _requirements_view
+        if _requirements_view is None or _requirements_view.job_id != latest_job["job_id"]:
+            started = time.time()
+            _requirements_view = RequirementsView(latest_job, jobs.get_result(latest_job["job_id"]) or {})
+            print(f"📇 Built requirements view for {latest_job['job_id']} "
+                  f"({len(_requirements_view.rows)} rows, {time.time() - started:.2f}s)")
+        return _requirements_view
+
+# ------------------------------------------------------------------------------
+# Forecast Service (warm model)
+# ------------------------------------------------------------------------------
+# The forecast endpoints answer from the newest completed forecast job's run
+# held in memory: the combined and per-channel forecast rows keyed by SKU, and
+# the history the model was fitted on, sorted and indexed by SKU. Looking up a
+# SKU is a dict access plus a slice, so nothing is refitted per request; the
+# service is rebuilt when any worker completes a newer forecast job.
+
+FORECAST_INDEX_COLUMNS = ("Velocity_Category", "Stock_Status")
+
+
+class ForecastService:
+    """Indexed, in-memory copy of one forecast run."""
+
+    def __init__(self, job, run):
+        self.job_id = job["job_id"]
+        self.generated_at = job["completed_at"]
+        self.run_id = run.run_id
+        self.summary = run.summary()
+
+        forecasts = run.forecasts
+        self.rows = BOMAnalysisResult.records(forecasts)
+        self.by_sku = {str(row["SKU"]): i for i, row in enumerate(self.rows)}
+        self.indexes = {}
+        for col in FORECAST_INDEX_COLUMNS:
+            if col in forecasts:
+                self.indexes[col] = {key: np.asarray(positions, dtype=np.int64)
+                                     for key, positions in forecasts.groupby(forecasts[col].astype(str)).indices.items()}
+
+        self.channels = {}   # SKU -> {channel: forecast row}
+        for channel, sheet_name in FORECAST_CHANNEL_SHEETS.items():
+            channel_df = run.sheet_frames.get(sheet_name)
+            if channel_df is None or 'SKU' not in channel_df.columns:
+                continue
+            for row in BOMAnalysisResult.records(channel_df):
+                self.channels.setdefault(str(row["SKU"]), {})[channel] = row
+
+        history = run.history if run.history is not None else pd.DataFrame(columns=HistoricalSalesStore.COLUMNS)
+        history = history.assign(SKU=history['SKU'].astype(str), Channel=history['Channel'].astype(str))
+        history = history.sort_values(['SKU', 'Channel', 'Date'], kind='stable', ignore_index=True)
+        self._history_sku = history['SKU'].to_numpy()
+        self._history_channel = history['Channel'].to_numpy()
+        self._history_date = history['Date'].dt.strftime('%Y-%m-%d').to_numpy()
+        self._history_sales = history['Sales'].to_numpy(dtype=np.float64)
+        # Rows of one SKU are contiguous after the sort: SKU -> (start, stop)
+        skus, starts, counts = np.unique(self._history_sku, return_index=True, return_counts=True)
+        self.history_bounds = {sku: (start, start + count) for sku, start, count in zip(skus, starts, counts)}
+
+    def __contains__(self, sku):
+        return sku in self.by_sku or sku in self.history_bounds
+
+    def forecast(self, sku):
+        i = self.by_sku.get(sku)
+        return self.rows[i] if i is not None else None
+
+    def history(self, sku, channel=None):
+        start, stop = self.history_bounds.get(sku, (0, 0))
+        return [{"channel": self._history_channel[i], "date": self._history_date[i], "sales": self._history_sales[i]}
+                for i in range(start, stop) if channel is None or self._history_channel[i] == channel]
+
+    def query(self, filters=None, offset=0, limit=None):
+        """Returns (total matching SKUs, requested page of combined forecast rows)."""
+        selections = [self.indexes.get(col, {}).get(value, np.empty(0, dtype=np.int64))
+                      for col, value in (filters or {}).items() if value is not None]
+        if selections:
+            selections.sort(key=len)
+            positions = selections[0]
+            for other in selections[1:]:
+                positions = np.intersect1d(positions, other, assume_unique=True)
+        else:
+            positions = np.arange(len(self.rows))
+        page = positions[offset:offset + limit if limit is not None else None]
+        return len(positions), [self.rows[i] for i in page]
+
+
+_forecast_service = None
+_forecast_service_version = -1   # FORECAST_RUNS_COUNTER the service was checked at
+_forecast_service_lock = threading.Lock()
+
+
+def get_forecast_service(force=False):
+    """The service for the newest completed forecast job, rebuilt when a newer one exists; None if none has completed."""
+    global _forecast_service, _forecast_service_version
+    version = get_state_backend().version(FORECAST_RUNS_COUNTER)
+    with _forecast_service_lock:
+        if not force and _forecast_service is not None and version == _forecast_service_version:
+            return _forecast_service
+        _forecast_service_version = version
+        jobs = get_job_store()
+        latest_job = jobs.latest_completed("forecast")
+        if latest_job is None or (_forecast_service is not None and _forecast_service.job_id == latest_job["job_id"]):
+            return _forecast_service
+        run_id = (jobs.get_result(latest_job["job_id"]) or {}).get("run_id")
+        run = find_run_result(run_id) if run_id else None
+        if not isinstance(run, ForecastRunResult):
+            print(f"⚠️ Forecast run {run_id} of {latest_job['job_id']} is no longer available")
+            return _forecast_service
+        started = time.time()
+        _forecast_service = ForecastService(latest_job, run)
+        print(f"🔮 Warmed forecast service from {latest_job['job_id']} "
+              f"({len(_forecast_service.rows)} SKUs, {time.time() - started:.2f}s)")
+        return _forecast_service
 
 # ------------------------------------------------------------------------------
 # Pydantic Models for Request/Response Validation
@@ -6498,6 +6825,11 @@ class BOMExplodeRequest(BaseModel):
     sku_list: Optional[List[str]] = None
     forecast_source: str = "google_sheets"
     include_procurement: bool = True
+    callback_url: Optional[str] = None   # POSTed the job outcome when it finishes
+
+class ForecastRunRequest(BaseModel):
+    request_id: Optional[str] = Field(default_factory=lambda: str(uuid.uuid4()))
+    callback_url: Optional[str] = None   # POSTed the job outcome when it finishes
 
 class JobResponse(BaseModel):
     success: bool
@@ -6514,6 +6846,7 @@ class JobStatusResponse(BaseModel):
     completed_at: Optional[str] = None
     result_url: Optional[str] = None
     error: Optional[str] = None
+    erp_version: Optional[int] = None   # ERP version current when the job started
 
 class HealthResponse(BaseModel):
     status: str
@@ -6526,72 +6859,88 @@ class RequirementsResponse(BaseModel):
     generated_at: Optional[str] = None
     job_id: Optional[str] = None
     total_count: int = 0
+    offset: int = 0
+    limit: Optional[int] = None
     summary: Optional[Dict[str, Any]] = None
     requirements: List[Dict[str, Any]] = []
 
+class ForecastLatestResponse(BaseModel):
+    success: bool
+    generated_at: Optional[str] = None
+    job_id: Optional[str] = None
+    run_id: Optional[str] = None
+    total_count: int = 0
+    offset: int = 0
+    limit: Optional[int] = None
+    summary: Optional[Dict[str, Any]] = None
+    forecasts: List[Dict[str, Any]] = []
+
+class SKUForecastResponse(BaseModel):
+    sku: str
+    generated_at: Optional[str] = None
+    job_id: Optional[str] = None
+    run_id: Optional[str] = None
+    forecast: Optional[Dict[str, Any]] = None       # combined across channels
+    channels: Dict[str, Dict[str, Any]] = {}
+    history: List[Dict[str, Any]] = []
+
 # ------------------------------------------------------------------------------
 # API Wrapper Function for BOM Explosion
 # ------------------------------------------------------------------------------
 
-def api_run_bom_explosion() -> dict:
+def api_run_bom_explosion(progress_callback=None) -> dict:
     """
     API-compatible wrapper for BOM explosion.
-    Returns structured dict instead of Excel buffer.
+    Serializes the BOMAnalysisResult tables directly; no workbook is rendered.
+    `progress_callback` receives each pipeline stage event.
     """
     try:
         # Call existing function
-        excel_buffer, filename = run_forecast_bom_analysis(gc_client=None)
+        bom_result, filename, _ = run_forecast_bom_analysis(gc_client=None, progress_callback=progress_callback)
         
-        if excel_buffer is None:
+        if bom_result is None:
             return {"success": False, "error": "BOM analysis failed - no data returned"}
         
-        # Parse Excel buffer to extract data for API response
-        excel_buffer.seek(0)
-        all_sheets = pd.read_excel(excel_buffer, sheet_name=None, engine="openpyxl")
-        
         # Build structured response
         result = {
             "success": True,
-            "summary": {},
-            "requirements": [],
-            "urgent_reorders": []
+            "run_id": bom_result.run_id,
+            "erp_version": _job_erp_version if _job_erp_version is not None else get_erp_store().current_version(),
+            "artifacts_url": f"/api/v1/runs/{bom_result.run_id}",
+            "summary": bom_result.summary(),
+            "requirements": BOMAnalysisResult.records(bom_result.requirements),
+            "urgent_reorders": BOMAnalysisResult.records(bom_result.urgent_reorders)
         }
         
-        # Find MRP Requirements sheet (handle different possible names)
-        mrp_sheet_names = ["📦 MRP Requirements", "MRP_Requirements", "MRP Requirements"]
-        mrp_df = None
-        for name in mrp_sheet_names:
-            if name in all_sheets:
-                mrp_df = all_sheets[name]
-                break
+        return result
         
-        if mrp_df is not None:
-            # Clean up DataFrame for JSON serialization
-            mrp_df = mrp_df.fillna("")
-            result["requirements"] = mrp_df.to_dict(orient="records")
-            
-            # Build summary
-            urgent_count = len(mrp_df[mrp_df["Order_Status"].astype(str).str.contains("🔴", na=False)]) if "Order_Status" in mrp_df.columns else 0
-            soon_count = len(mrp_df[mrp_df["Order_Status"].astype(str).str.contains("🟡", na=False)]) if "Order_Status" in mrp_df.columns else 0
-            ok_count = len(mrp_df[mrp_df["Order_Status"].astype(str).str.contains("🟢", na=False)]) if "Order_Status" in mrp_df.columns else 0
-            
-            result["summary"] = {
-                "total_components": len(mrp_df),
-                "urgent_reorders": urgent_count,
-                "reorder_soon": soon_count,
-                "ok": ok_count,
-                "total_procurement_cost": float(mrp_df["Procurement_Cost"].sum()) if "Procurement_Cost" in mrp_df.columns else 0
-            }
+    except Exception as e:
+        import traceback
+        return {
+            "success": False, 
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }
+
+
+def api_run_forecast() -> dict:
+    """
+    API-compatible wrapper for the forecasting pipeline (main()).
+    The forecast rows stay with the run; the job result only points at it.
+    """
+    try:
+        output = main()
+        forecast_result = output[0] if output else None
         
-        # Find Urgent Reorders sheet
-        urgent_sheet_names = ["🔴 Urgent Reorders", "Urgent_Reorders", "Urgent Reorders"]
-        for name in urgent_sheet_names:
-            if name in all_sheets:
-                urgent_df = all_sheets[name].fillna("")
-                result["urgent_reorders"] = urgent_df.to_dict(orient="records")
-                break
+        if forecast_result is None:
+            return {"success": False, "error": "Forecast run failed - no data returned"}
         
-        return result
+        return {
+            "success": True,
+            "run_id": forecast_result.run_id,
+            "artifacts_url": f"/api/v1/runs/{forecast_result.run_id}",
+            "summary": forecast_result.summary()
+        }
         
     except Exception as e:
         import traceback
@@ -6607,25 +6956,333 @@ def api_run_bom_explosion() -> dict:
 
 def run_bom_explosion_task(job_id: str, request: BOMExplodeRequest):
     """Background task that runs BOM explosion."""
+    jobs = get_job_store()
+    result = None
+    try:
+        if not jobs.update(job_id, active_only=True, status="processing", progress_percent=5):
+            return None   # cancelled while queued
+        jobs.add_event(job_id, "started", 5)
+        
+        # Run actual BOM explosion; each finished stage becomes a job event
+        result = api_run_bom_explosion(progress_callback=lambda event: jobs.add_event(job_id, **event))
+        
+        if result.get("success"):
+            jobs.add_event(job_id, "completed", 100)
+            if jobs.update(job_id, result=result, active_only=True, status="completed", progress_percent=100,
+                           completed_at=datetime.now().isoformat() + "Z"):
+                get_state_backend().bump(COMPLETED_JOBS_COUNTER)
+        else:
+            jobs.add_event(job_id, "failed", message=result.get("error", "Unknown error"))
+            jobs.update(job_id, active_only=True, status="failed", error=result.get("error", "Unknown error"))
+        
+    except Exception as e:
+        jobs.add_event(job_id, "failed", message=str(e))
+        jobs.update(job_id, active_only=True, status="failed", error=str(e))
+    return result
+
+
+def run_forecast_task(job_id: str, request: ForecastRunRequest):
+    """Background task that runs the forecasting pipeline."""
+    jobs = get_job_store()
+    result = None
     try:
-        api_jobs_store[job_id]["status"] = "processing"
-        api_jobs_store[job_id]["progress_percent"] = 10
+        if not jobs.update(job_id, active_only=True, status="processing", progress_percent=5):
+            return None   # cancelled while queued
+        jobs.add_event(job_id, "started", 5)
         
-        # Run actual BOM explosion
-        result = api_run_bom_explosion()
+        result = api_run_forecast()
         
         if result.get("success"):
-            api_jobs_store[job_id]["status"] = "completed"
-            api_jobs_store[job_id]["progress_percent"] = 100
-            api_jobs_store[job_id]["completed_at"] = datetime.now().isoformat() + "Z"
-            api_jobs_store[job_id]["result"] = result
+            jobs.add_event(job_id, "completed", 100)
+            jobs.update(job_id, result=result, active_only=True, status="completed", progress_percent=100,
+                        completed_at=datetime.now().isoformat() + "Z")
         else:
-            api_jobs_store[job_id]["status"] = "failed"
-            api_jobs_store[job_id]["error"] = result.get("error", "Unknown error")
+            jobs.add_event(job_id, "failed", message=result.get("error", "Unknown error"))
+            jobs.update(job_id, active_only=True, status="failed", error=result.get("error", "Unknown error"))
         
     except Exception as e:
-        api_jobs_store[job_id]["status"] = "failed"
-        api_jobs_store[job_id]["error"] = str(e)
+        jobs.add_event(job_id, "failed", message=str(e))
+        jobs.update(job_id, active_only=True, status="failed", error=str(e))
+    return result
+
+# ------------------------------------------------------------------------------
+# Job Completion Webhooks
+# ------------------------------------------------------------------------------
+# A request's callback_url is POSTed the job outcome once the job finishes, so
+# ERP clients need not poll. Delivery runs on a daemon thread with retries;
+# with HG_WEBHOOK_SECRET set, the body is signed in X-HG-Signature.
+
+WEBHOOK_SECRET = os.environ.get("HG_WEBHOOK_SECRET")
+WEBHOOK_TIMEOUT_SECONDS = 10
+WEBHOOK_RETRIES = 3
+WEBHOOK_BACKOFF_SECONDS = 2
+
+
+def _job_webhook_payload(job):
+    payload = {
+        "job_id": job["job_id"],
+        "request_id": job.get("request_id"),
+        "status": job["status"],
+        "completed_at": job.get("completed_at"),
+        "error": job.get("error"),
+        "status_url": f"/api/v1/jobs/{job['job_id']}",
+        "result_url": f"/api/v1/jobs/{job['job_id']}/result" if job["status"] == "completed" else None,
+    }
+    if job["status"] == "completed":
+        result = get_job_store().get_result(job["job_id"]) or {}
+        payload["run_id"] = result.get("run_id")
+        payload["summary"] = result.get("summary")
+    return payload
+
+
+def _post_webhook(url, body):
+    headers = {"Content-Type": "application/json", "User-Agent": "hg-bom-api"}
+    if WEBHOOK_SECRET:
+        digest = hmac.new(WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        headers["X-HG-Signature"] = f"sha256={digest}"
+    for attempt in range(1, WEBHOOK_RETRIES + 1):
+        try:
+            req = urllib.request.Request(url, data=body, headers=headers, method="POST")
+            with urllib.request.urlopen(req, timeout=WEBHOOK_TIMEOUT_SECONDS) as response:
+                print(f"📨 Webhook {url} -> {response.status}")
+                return True
+        except Exception as e:
+            print(f"⚠️ Webhook {url} attempt {attempt}/{WEBHOOK_RETRIES} failed: {e}")
+            if attempt < WEBHOOK_RETRIES:
+                time.sleep(WEBHOOK_BACKOFF_SECONDS * 2 ** (attempt - 1))
+    return False
+
+
+def notify_job_webhooks(job_id):
+    """POST the finished job's outcome, in the background, to the callback URLs not yet notified."""
+    jobs = get_job_store()
+    job = jobs.get(job_id)
+    if job is None or job["status"] in ACTIVE_JOB_STATUSES:
+        return
+    # Claimed only once the job has finished, so a URL registered while the
+    # monitor is delivering goes out exactly once, by whichever caller claims it
+    urls = jobs.claim_webhooks(job_id)
+    if not urls:
+        return
+
+    def deliver():
+        try:
+            body = _dumps(_job_webhook_payload(job))
+            for url in urls:
+                _post_webhook(url, body)
+        except Exception as e:
+            print(f"❌ Webhook delivery for job {job_id} failed: {e}")
+            traceback.print_exc()
+
+    threading.Thread(target=deliver, name=f"webhook-{job_id}", daemon=True).start()
+
+
+# ------------------------------------------------------------------------------
+# BOM Job Executor (one process per job)
+# ------------------------------------------------------------------------------
+# Each BOM job runs in its own forked process, outside the API's threads, so
+# it can be cancelled or timed out by terminating it. At most BOM_JOB_WORKERS
+# jobs run at once and BOM_JOB_QUEUE_DEPTH more may wait; further submissions
+# are refused with 429. Requests with identical inputs join the job that is
+# already queued or running (single flight, via JobStore.create_or_join).
+# These limits apply per API worker (see State Backend).
+
+BOM_JOB_WORKERS = int(os.environ.get("HG_BOM_JOB_WORKERS", "2"))
+BOM_JOB_QUEUE_DEPTH = int(os.environ.get("HG_BOM_JOB_QUEUE_DEPTH", "8"))
+BOM_JOB_TIMEOUT_SECONDS = int(os.environ.get("HG_BOM_JOB_TIMEOUT_SECONDS", "900"))
+BOM_JOB_POLL_SECONDS = 0.5
+BOM_JOB_HEARTBEAT_SECONDS = 10
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def bom_request_hash(request: BOMExplodeRequest) -> str:
+    """Hash of the inputs that determine a BOM run's output (request_id excluded)."""
+    payload = {   # callback_url only changes who is told about the outcome
+        "sku_list": sorted(request.sku_list) if request.sku_list else None,
+        "forecast_source": request.forecast_source,
+        "include_procurement": request.include_procurement,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def forecast_request_hash(request: ForecastRunRequest) -> str:
+    """Forecast runs take no inputs beyond the data sources, so concurrent requests share one job."""
+    return hashlib.sha256(json.dumps({"kind": "forecast"}).encode("utf-8")).hexdigest()
+
+
+def _bom_job_process(job_id, request, result_conn, erp_version):
+    """Entry point of a forked BOM (or forecast) job process."""
+    global _job_store, _job_store_lock, _erp_store, _erp_store_lock, _job_erp_version
+    global _state_backend, _state_backend_lock
+    # Nothing SQLite- or thread-related survives fork safely: open our own
+    # store connections and upload workers instead of the parent's
+    _job_store, _job_store_lock = None, threading.Lock()
+    _erp_store, _erp_store_lock = None, threading.Lock()
+    _state_backend, _state_backend_lock = None, threading.Lock()
+    get_publish_executor.clear()
+    # A request thread may have held the run cache's lock at fork time
+    get_run_result_cache.clear()
+    # ERP syncs during the run publish new versions; the result reports the one it started at
+    _job_erp_version = erp_version
+
+    task = run_forecast_task if isinstance(request, ForecastRunRequest) else run_bom_explosion_task
+    result = task(job_id, request)
+    run = get_run_result_cache().get(result.get("run_id")) if result else None
+    if run is not None:
+        # Hand the tables back so /api/v1/runs/{run_id} works in the API process
+        result_conn.send_bytes(encode_run_result(run))
+    result_conn.close()
+
+    # Let the background Sheets/Drive uploads finish before the process exits
+    get_publish_executor().shutdown(wait=True)
+
+
+class BOMJobExecutor:
+    """Bounded queue of BOM and forecast jobs, each run in a child process by a monitor thread."""
+
+    def __init__(self, max_workers=BOM_JOB_WORKERS, queue_depth=BOM_JOB_QUEUE_DEPTH,
+                 timeout=BOM_JOB_TIMEOUT_SECONDS):
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._ctx = multiprocessing.get_context("fork")
+        self._pending = deque()      # (job_id, request)
+        self._running = {}           # job_id -> (process, result_conn, started_at)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._last_heartbeat = 0.0
+        threading.Thread(target=self._monitor, name="bom-jobs", daemon=True).start()
+
+    def has_capacity(self):
+        with self._lock:
+            return len(self._pending) < self.queue_depth
+
+    def submit(self, job_id, request):
+        with self._lock:
+            if len(self._pending) >= self.queue_depth:
+                raise JobQueueFull(f"{len(self._pending)} jobs already queued")
+            self._pending.append((job_id, request))
+        self.wake()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _monitor(self):
+        while True:
+            self._wakeup.wait(BOM_JOB_POLL_SECONDS)
+            self._wakeup.clear()
+            try:
+                self._reap()
+                self._start_pending()
+                self._heartbeat()
+            except Exception as e:
+                print(f"❌ BOM job monitor error: {e}")
+                traceback.print_exc()
+
+    def _reap(self):
+        jobs = get_job_store()
+        with self._lock:
+            running = list(self._running.items())
+            pending_ids = [job_id for job_id, _ in self._pending]
+        cancelled = jobs.cancelled_among([job_id for job_id, _ in running] + pending_ids)
+
+        if cancelled & set(pending_ids):
+            with self._lock:
+                self._pending = deque(item for item in self._pending if item[0] not in cancelled)
+            for job_id in cancelled & set(pending_ids):
+                notify_job_webhooks(job_id)
+
+        for job_id, (process, result_conn, started_at) in running:
+            if result_conn.poll():
+                self._receive_run(result_conn)
+
+            if job_id in cancelled:
+                process.terminate()
+                print(f"🛑 Cancelled BOM job {job_id}")
+            elif process.exitcode is None and time.time() - started_at > self.timeout:
+                process.terminate()
+                jobs.add_event(job_id, "failed", message=f"Timed out after {self.timeout} seconds")
+                jobs.update(job_id, active_only=True, status="failed",
+                            error=f"Timed out after {self.timeout} seconds",
+                            completed_at=datetime.now().isoformat() + "Z")
+                print(f"⏱️ BOM job {job_id} timed out after {self.timeout}s")
+            elif process.exitcode is None:
+                continue
+
+            process.join(5)
+            if result_conn.poll():   # sent just before the process exited
+                self._receive_run(result_conn)
+            result_conn.close()
+            if process.exitcode == 0 and job_id.startswith("forecast-"):
+                # Only now is the run shared, so other workers can warm from it too
+                get_state_backend().bump(FORECAST_RUNS_COUNTER)
+                get_forecast_service(force=True)
+            elif process.exitcode == 0:
+                get_requirements_view(force=True)   # warm the view for the next /requirements/latest
+            elif process.exitcode is not None and job_id not in cancelled:
+                # Crashed or terminated before recording an outcome
+                if jobs.update(job_id, active_only=True, status="failed",
+                               error=f"Job worker exited with code {process.exitcode}",
+                               completed_at=datetime.now().isoformat() + "Z"):
+                    jobs.add_event(job_id, "failed", message=f"Job worker exited with code {process.exitcode}")
+            with self._lock:
+                self._running.pop(job_id, None)
+            notify_job_webhooks(job_id)
+
+    def _receive_run(self, result_conn):
+        try:
+            blob = result_conn.recv_bytes()
+            share_run_result(get_run_result_cache().put(decode_run_result(blob)), blob)
+        except (EOFError, OSError):
+            pass
+
+    def _start_pending(self):
+        with self._lock:
+            if not self._pending or len(self._running) >= self.max_workers:
+                return
+        # Recorded on the job; the runs themselves don't read the ERP tables
+        erp_version = get_erp_store().current_version()
+        started = []
+        with self._lock:
+            while self._pending and len(self._running) < self.max_workers:
+                job_id, request = self._pending.popleft()
+                receiver, sender = self._ctx.Pipe(duplex=False)
+                process = self._ctx.Process(target=_bom_job_process, args=(job_id, request, sender, erp_version),
+                                            name=f"bom-job-{job_id}", daemon=True)
+                process.start()
+                sender.close()
+                self._running[job_id] = (process, receiver, time.time())
+                started.append(job_id)
+                print(f"⚙️ Started job {job_id} (pid {process.pid}, ERP v{erp_version})")
+        jobs = get_job_store()
+        for job_id in started:
+            jobs.update(job_id, active_only=True, erp_version=erp_version)
+
+    def _heartbeat(self):
+        if time.time() - self._last_heartbeat < BOM_JOB_HEARTBEAT_SECONDS:
+            return
+        self._last_heartbeat = time.time()
+        with self._lock:
+            job_ids = list(self._running) + [job_id for job_id, _ in self._pending]
+        jobs = get_job_store()
+        jobs.heartbeat(job_ids)
+        jobs.fail_stale()
+
+
+_bom_job_executor = None
+_bom_job_executor_lock = threading.Lock()
+
+
+def get_bom_job_executor():
+    global _bom_job_executor
+    with _bom_job_executor_lock:
+        if _bom_job_executor is None:
+            _bom_job_executor = BOMJobExecutor()
+        return _bom_job_executor
+
 
 # ------------------------------------------------------------------------------
 # API Endpoints
@@ -6642,86 +7299,279 @@ async def health_check():
     )
 
 
+def _enqueue_bom_job(request) -> Tuple[dict, bool]:
+    """
+    Create (or join) the BOM or forecast job for `request` (a BOMExplodeRequest
+    or ForecastRunRequest) and queue it; returns (job, created). 429 when the
+    queue is full.
+    """
+    if request.callback_url and not re.match(r"^https?://", request.callback_url):
+        raise HTTPException(status_code=422, detail="callback_url must be an http(s) URL")
+    
+    # Idempotent replay of a known request_id (unique index lookup)
+    existing_job = get_job_store().find_by_request_id(request.request_id)
+    if existing_job is not None:
+        _register_callback(existing_job, request)
+        return existing_job, False
+    
+    is_forecast = isinstance(request, ForecastRunRequest)
+    job_id = f"{'forecast' if is_forecast else 'bom'}-{uuid.uuid4()}"
+    executor = get_bom_job_executor()
+    if not executor.has_capacity():
+        raise HTTPException(status_code=429, detail="Too many jobs queued, retry later",
+                            headers={"Retry-After": "30"})
+    
+    # Create new job, or join the in-flight job with identical inputs
+    job, created = get_job_store().create_or_join({
+        "job_id": job_id,
+        "request_id": request.request_id,
+        "input_hash": forecast_request_hash(request) if is_forecast else bom_request_hash(request),
+        "status": "pending",
+        "progress_percent": 0,
+        "started_at": datetime.now().isoformat() + "Z",
+        "completed_at": None,
+        "error": None
+    })
+    
+    if created:
+        get_job_store().add_event(job_id, "queued", 0)
+    _register_callback(job, request)
+    
+    if created:
+        try:
+            executor.submit(job_id, request)
+        except JobQueueFull:
+            # Drop the job entirely, so a retry with the same request_id is queued afresh
+            get_job_store().delete(job_id)
+            raise HTTPException(status_code=429, detail="Too many jobs queued, retry later",
+                                headers={"Retry-After": "30"})
+    
+    return job, created
+
+
+def _register_callback(job, request):
+    """Attach the request's callback_url to `job`; a finished job is reported at once."""
+    if not request.callback_url:
+        return
+    get_job_store().add_webhook(job["job_id"], request.callback_url)
+    # `job` may be stale: the job can have finished since it was read
+    notify_job_webhooks(job["job_id"])
+
+
 @api_app.post("/api/v1/bom/explode", response_model=JobResponse, tags=["BOM"])
-async def explode_bom(request: BOMExplodeRequest, background_tasks: BackgroundTasks):
+async def explode_bom(request: BOMExplodeRequest):
     """
     Trigger BOM explosion asynchronously.
-    Returns job_id for status polling.
+    Returns job_id for status polling. A request with the same inputs as a
+    job that is still queued or running returns that job instead of starting
+    another; 429 when the job queue is full.
     
     **Example Request:**
 ```json
     {
         "request_id": "my-unique-id-123",
         "forecast_source": "google_sheets",
-        "include_procurement": true
+        "include_procurement": true,
+        "callback_url": "https://erp.example.com/hooks/bom"
     }
 ```
     """
-    job_id = f"bom-{uuid.uuid4()}"
-    
-    # Check for idempotency (same request_id returns existing job)
-    for existing_job in api_jobs_store.values():
-        if existing_job.get("request_id") == request.request_id:
-            return JobResponse(
-                success=True,
-                job_id=existing_job["job_id"],
-                status=existing_job["status"],
-                poll_url=f"/api/v1/jobs/{existing_job['job_id']}",
-                estimated_duration_seconds=0
-            )
-    
-    # Create new job
-    api_jobs_store[job_id] = {
-        "job_id": job_id,
-        "request_id": request.request_id,
-        "status": "pending",
-        "progress_percent": 0,
-        "started_at": datetime.now().isoformat() + "Z",
-        "completed_at": None,
-        "result": None,
-        "error": None
-    }
-    
-    # Start background task
-    background_tasks.add_task(run_bom_explosion_task, job_id, request)
+    # Same request_id returns the existing job (idempotency)
+    job, created = await asyncio.to_thread(_enqueue_bom_job, request)
     
     return JobResponse(
         success=True,
-        job_id=job_id,
-        status="pending",
-        poll_url=f"/api/v1/jobs/{job_id}",
-        estimated_duration_seconds=45
+        job_id=job["job_id"],
+        status=job["status"],
+        poll_url=f"/api/v1/jobs/{job['job_id']}",
+        estimated_duration_seconds=45 if created else 0
+    )
+
+
+@api_app.get("/api/v1/jobs/{job_id}", response_model=JobStatusResponse, tags=["Jobs"])
+async def get_job_status(job_id: str):
+    """
+    Get status of a running or completed job. Prefer `/api/v1/jobs/{job_id}/events`
+    (Server-Sent Events) or a `callback_url` on the request over polling this.
+    
+    **Status Values:**
+    - `pending`: Job queued but not started
+    - `processing`: Job currently running
+    - `completed`: Job finished successfully
+    - `failed`: Job encountered an error or timed out
+    - `cancelled`: Job was cancelled
+    """
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return JobStatusResponse(
+        job_id=job["job_id"],
+        status=job["status"],
+        progress_percent=job["progress_percent"],
+        started_at=job["started_at"],
+        completed_at=job["completed_at"],
+        result_url=f"/api/v1/jobs/{job_id}/result" if job["status"] == "completed" else None,
+        error=job.get("error"),
+        erp_version=job.get("erp_version")
     )
 
 
-@api_app.get("/api/v1/jobs/{job_id}", response_model=JobStatusResponse, tags=["Jobs"])
-async def get_job_status(job_id: str):
+@api_app.post("/api/v1/jobs/{job_id}/cancel", response_model=JobStatusResponse, tags=["Jobs"])
+async def cancel_job(job_id: str):
+    """
+    Cancel a pending or processing job. A running job's worker process is
+    terminated by whichever API worker owns it; finished jobs are unchanged.
+    """
+    jobs = get_job_store()
+    if await asyncio.to_thread(jobs.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if await asyncio.to_thread(jobs.update, job_id, active_only=True, status="cancelled",
+                               completed_at=datetime.now().isoformat() + "Z"):
+        await asyncio.to_thread(jobs.add_event, job_id, "cancelled")
+        get_bom_job_executor().wake()
+    
+    return await get_job_status(job_id)
+
+
+JOB_EVENTS_POLL_SECONDS = 1.0
+JOB_EVENTS_KEEPALIVE_SECONDS = 15
+
+
+def _sse_frame(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", "data: " + _dumps(data).decode("utf-8")]
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+@api_app.get("/api/v1/jobs/{job_id}/events", tags=["Jobs"])
+async def stream_job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-Sent Events stream of a job's progress.
+    
+    Each pipeline stage (`queued`, `started`, `fetch_bom`, `build_structure`,
+    `forecast_lookup`, `explode`, `abc`, `procurement`, `export`, `upload_queued`)
+    is sent as a `progress` event with `percent`, `stage_seconds` and
+    `elapsed_seconds`; a terminal `completed`/`failed`/`cancelled` stage
+    follows, then an `end` event carrying the job status, after which the
+    stream closes. Reconnecting clients resume via `Last-Event-ID`.
+    """
+    jobs = get_job_store()
+    if await asyncio.to_thread(jobs.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    after_seq = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    
+    async def events():
+        nonlocal after_seq
+        last_sent = time.time()
+        yield b"retry: 2000\n\n"
+        while True:
+            # Read the status first: events written before a terminal status are then never missed
+            job = await asyncio.to_thread(jobs.get, job_id)
+            for event in await asyncio.to_thread(jobs.events_after, job_id, after_seq):
+                after_seq = event["seq"]
+                last_sent = time.time()
+                yield _sse_frame("progress", {"job_id": job_id, **event}, after_seq)
+            if job is None or job["status"] not in ACTIVE_JOB_STATUSES:
+                yield _sse_frame("end", {
+                    "job_id": job_id,
+                    "status": job["status"] if job else "expired",
+                    "error": job.get("error") if job else None,
+                    "result_url": f"/api/v1/jobs/{job_id}/result" if job and job["status"] == "completed" else None,
+                })
+                return
+            if time.time() - last_sent >= JOB_EVENTS_KEEPALIVE_SECONDS:
+                last_sent = time.time()
+                yield b": keepalive\n\n"
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ------------------------------------------------------------------------------
+# Result Encoding (Accept negotiation)
+# ------------------------------------------------------------------------------
+# Job results can hold every requirement row, so /jobs/{id}/result streams
+# them instead of building one JSON document: NDJSON (one row per line) or an
+# Arrow IPC stream of record batches. Plain JSON is encoded with orjson when it
+# is installed. GZipMiddleware compresses any of these for clients that ask,
+# except Server-Sent Events, which must reach the client frame by frame.
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+RESULT_STREAM_BATCH_ROWS = 5000
+
+
+class EventStreamAwareGZipMiddleware(GZipMiddleware):
     """
-    Get status of a running or completed job.
-    
-    **Status Values:**
-    - `pending`: Job queued but not started
-    - `processing`: Job currently running
-    - `completed`: Job finished successfully
-    - `failed`: Job encountered an error
+    GZipMiddleware that never touches the SSE routes. Older Starlette releases
+    compress (and so buffer) text/event-stream too, which stalls the stream.
     """
-    if job_id not in api_jobs_store:
-        raise HTTPException(status_code=404, detail="Job not found")
-    
-    job = api_jobs_store[job_id]
-    return JobStatusResponse(
-        job_id=job["job_id"],
-        status=job["status"],
-        progress_percent=job["progress_percent"],
-        started_at=job["started_at"],
-        completed_at=job["completed_at"],
-        result_url=f"/api/v1/jobs/{job_id}/result" if job["status"] == "completed" else None,
-        error=job.get("error")
-    )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith("/events"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+api_app.add_middleware(EventStreamAwareGZipMiddleware, minimum_size=1024)
+
+
+def _dumps(obj) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=_json_default).encode("utf-8")
+
+
+def _result_media_type(accept):
+    accept = (accept or "").lower()
+    if "application/x-ndjson" in accept or "application/ndjson" in accept:
+        return NDJSON_MEDIA_TYPE
+    if ARROW_STREAM_MEDIA_TYPE in accept:
+        return ARROW_STREAM_MEDIA_TYPE
+    return "application/json"
+
+
+def _ndjson_result_lines(meta, result):
+    """A meta line, then one line per requirement and per urgent reorder."""
+    yield _dumps({"type": "meta", **meta}) + b"\n"
+    for section, row_type in (("requirements", "requirement"), ("urgent_reorders", "urgent_reorder")):
+        rows = result.get(section) or []
+        for start in range(0, len(rows), RESULT_STREAM_BATCH_ROWS):
+            yield b"".join(_dumps({"type": row_type, "data": row}) + b"\n"
+                           for row in rows[start:start + RESULT_STREAM_BATCH_ROWS])
+
+
+def _arrow_result_stream(meta, result):
+    """The requirements as Arrow record batches; meta travels in the schema metadata."""
+    # Blanks stand in for missing values in stored results; as nulls, numeric columns keep their type
+    frame = pd.DataFrame.from_records(result.get("requirements") or []).replace("", None)
+    table = _arrow_table(frame)
+    table = table.replace_schema_metadata({"hg_meta": _dumps(meta)})
+    buffer = BytesIO()
+    with pa.ipc.new_stream(buffer, table.schema) as writer:
+        yield buffer.getvalue()
+        for batch in table.to_batches(max_chunksize=RESULT_STREAM_BATCH_ROWS):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.write_batch(batch)
+            yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()   # end-of-stream marker
 
 
 @api_app.get("/api/v1/jobs/{job_id}/result", tags=["Jobs"])
-async def get_job_result(job_id: str):
+async def get_job_result(job_id: str, accept: Optional[str] = Header(None)):
     """
     Get results of a completed job.
     
@@ -6729,12 +7579,20 @@ async def get_job_result(job_id: str):
     - Summary statistics
     - All component requirements
     - Urgent reorders list
+    
+    **Response format** (by `Accept` header):
+    - `application/json` (default): one JSON document
+    - `application/x-ndjson`: streamed lines, `{"type": "meta", ...}` first, then
+      `{"type": "requirement" | "urgent_reorder", "data": {...}}` per row
+    - `application/vnd.apache.arrow.stream`: the requirements as an Arrow IPC
+      stream; job_id, summary etc. are in the schema metadata under `hg_meta`
+    
+    Send `Accept-Encoding: gzip` for a compressed response.
     """
-    if job_id not in api_jobs_store:
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    job = api_jobs_store[job_id]
-    
     if job["status"] == "failed":
         raise HTTPException(
             status_code=500,
@@ -6747,17 +7605,35 @@ async def get_job_result(job_id: str):
             detail=f"Job not completed. Current status: {job['status']}"
         )
     
-    return {
-        "job_id": job_id,
-        "completed_at": job["completed_at"],
-        **job["result"]
-    }
+    result = await asyncio.to_thread(get_job_store().get_result, job_id) or {}
+    media_type = _result_media_type(accept)
+    
+    if media_type == "application/json":
+        return Response(
+            content=_dumps({"job_id": job_id, "completed_at": job["completed_at"], **result}),
+            media_type=media_type
+        )
+    
+    meta = {"job_id": job_id, "completed_at": job["completed_at"],
+            **{key: value for key, value in result.items() if key not in ("requirements", "urgent_reorders")}}
+    if media_type == ARROW_STREAM_MEDIA_TYPE:
+        if not PARQUET_AVAILABLE:
+            raise HTTPException(status_code=406, detail="Arrow responses need pyarrow on the server")
+        return StreamingResponse(_arrow_result_stream(meta, result), media_type=media_type)
+    return StreamingResponse(_ndjson_result_lines(meta, result), media_type=media_type)
 
 
 @api_app.get("/api/v1/requirements/latest", response_model=RequirementsResponse, tags=["Requirements"])
 async def get_latest_requirements(
     status: Optional[str] = None,
-    min_cost: Optional[float] = None
+    min_cost: Optional[float] = None,
+    abc_class: Optional[str] = None,
+    supplier: Optional[str] = None,
+    component_type: Optional[str] = None,
+    sort: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    fields: Optional[str] = None
 ):
     """
     Get latest MRP requirements from most recent completed BOM run.
@@ -6765,71 +7641,249 @@ async def get_latest_requirements(
     **Query Parameters:**
     - `status`: Filter by order status (`urgent_reorder`, `reorder_soon`, `ok`)
     - `min_cost`: Minimum procurement cost threshold
+    - `abc_class`, `supplier`, `component_type`: Exact-match filters
+    - `sort`: Column to sort by, prefix with `-` for descending (e.g. `-Order_Priority_Score`)
+    - `offset`, `limit`: Pagination; `total_count` is the number of matching rows
+    - `fields`: Comma-separated columns to return (default: all)
     
-    **Example:** `/api/v1/requirements/latest?status=urgent_reorder&min_cost=1000`
+    **Example:** `/api/v1/requirements/latest?status=urgent_reorder&min_cost=1000&sort=-Order_Priority_Score&limit=50`
     """
-    # Find the most recent completed BOM job
-    completed_jobs = [
-        j for j in api_jobs_store.values()
-        if j["status"] == "completed" and j.get("result")
-    ]
+    view = await asyncio.to_thread(get_requirements_view)
     
-    if not completed_jobs:
+    if view is None:
         return RequirementsResponse(
             success=False,
             total_count=0,
             requirements=[]
         )
     
-    # Get most recent
-    latest_job = max(completed_jobs, key=lambda j: j["completed_at"] or "")
-    result = latest_job["result"]
+    try:
+        total_count, requirements = view.query(
+            status=status,
+            min_cost=min_cost,
+            filters={"ABC_Class": abc_class, "Supplier": supplier, "Component_Type": component_type},
+            sort=sort,
+            offset=offset,
+            limit=limit,
+            fields=[f.strip() for f in fields.split(",") if f.strip()] if fields else None
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown sort column: {e.args[0]}")
     
-    requirements = result.get("requirements", [])
+    return RequirementsResponse(
+        success=True,
+        generated_at=view.generated_at,
+        job_id=view.job_id,
+        total_count=total_count,
+        offset=offset,
+        limit=limit,
+        summary=view.summary,
+        requirements=requirements
+    )
+
+
+@api_app.post("/api/v1/forecast/run", response_model=JobResponse, tags=["Forecast"])
+async def run_forecast(request: ForecastRunRequest):
+    """
+    Run the forecasting pipeline asynchronously.
+    Returns job_id for status polling (`/api/v1/jobs/{job_id}`, `/events`). A
+    forecast run already queued or running is joined instead of starting
+    another. When it completes, `/api/v1/forecast/latest` and
+    `/api/v1/forecast/sku/{sku}` answer from the new run.
     
-    # Apply filters
-    if status:
-        status_map = {"urgent_reorder": "🔴", "reorder_soon": "🟡", "ok": "🟢"}
-        filter_emoji = status_map.get(status, "")
-        if filter_emoji:
-            requirements = [
-                r for r in requirements 
-                if filter_emoji in str(r.get("Order_Status", ""))
-            ]
+    **Example Request:**
+```json
+    {
+        "request_id": "nightly-forecast-2025-06-01",
+        "callback_url": "https://erp.example.com/hooks/forecast"
+    }
+```
+    """
+    job, created = await asyncio.to_thread(_enqueue_bom_job, request)
     
-    if min_cost is not None:
-        requirements = [
-            r for r in requirements 
-            if float(r.get("Procurement_Cost", 0) or 0) >= min_cost
-        ]
+    return JobResponse(
+        success=True,
+        job_id=job["job_id"],
+        status=job["status"],
+        poll_url=f"/api/v1/jobs/{job['job_id']}",
+        estimated_duration_seconds=120 if created else 0
+    )
+
+
+@api_app.get("/api/v1/forecast/latest", response_model=ForecastLatestResponse, tags=["Forecast"])
+async def get_latest_forecast(
+    velocity_category: Optional[str] = None,
+    stock_status: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1)
+):
+    """
+    Get the combined (all channels) forecast of the most recent completed forecast run.
     
-    return RequirementsResponse(
+    **Query Parameters:**
+    - `velocity_category`: Filter by velocity class (`A`, `B`, `C`, `D`)
+    - `stock_status`: Filter by stock status (e.g. `REORDER NOW`, `OUT OF STOCK`)
+    - `offset`, `limit`: Pagination; `total_count` is the number of matching SKUs
+    """
+    service = await asyncio.to_thread(get_forecast_service)
+    
+    if service is None:
+        return ForecastLatestResponse(success=False)
+    
+    total_count, forecasts = service.query(
+        filters={"Velocity_Category": velocity_category, "Stock_Status": stock_status},
+        offset=offset,
+        limit=limit
+    )
+    
+    return ForecastLatestResponse(
         success=True,
-        generated_at=latest_job["completed_at"],
-        job_id=latest_job["job_id"],
-        total_count=len(requirements),
-        summary=result.get("summary"),
-        requirements=requirements
+        generated_at=service.generated_at,
+        job_id=service.job_id,
+        run_id=service.run_id,
+        total_count=total_count,
+        offset=offset,
+        limit=limit,
+        summary=service.summary,
+        forecasts=forecasts
+    )
+
+
+@api_app.get("/api/v1/forecast/sku/{sku}", response_model=SKUForecastResponse, tags=["Forecast"])
+async def get_sku_forecast(sku: str, channel: Optional[str] = None, include_history: bool = True):
+    """
+    Get one SKU's forecast from the most recent completed forecast run.
+    
+    Returns the combined forecast row, the per-channel forecast rows and the
+    monthly sales history the model was fitted on (`channel` limits the
+    history to one channel, e.g. `Amazon`; `include_history=false` omits it).
+    """
+    service = await asyncio.to_thread(get_forecast_service)
+    if service is None:
+        raise HTTPException(status_code=404, detail="No completed forecast run yet; POST /api/v1/forecast/run")
+    
+    sku = sku.strip()
+    if sku not in service:
+        raise HTTPException(status_code=404, detail=f"SKU '{sku}' not found in forecast run {service.run_id}")
+    
+    return SKUForecastResponse(
+        sku=sku,
+        generated_at=service.generated_at,
+        job_id=service.job_id,
+        run_id=service.run_id,
+        forecast=service.forecast(sku),
+        channels=service.channels.get(sku, {}),
+        history=service.history(sku, channel.strip().title() if channel else None) if include_history else []
     )
 
 
+RUN_SYNC_TIMEOUT_SECONDS = int(os.environ.get("HG_RUN_SYNC_TIMEOUT_SECONDS", "120"))
+RUN_SYNC_MAX_CONCURRENT = 2   # per API worker
+RUN_SYNC_POLL_SECONDS = 1.0
+
+_run_sync_slots = None
+
+
 @api_app.get("/api/v1/bom/run-sync", tags=["BOM"])
 async def run_bom_sync():
     """
-    Run BOM explosion synchronously (blocking).
+    Run BOM explosion and wait for the result.
     Use this for testing or when you need immediate results.
     
+    The run goes through the BOM job executor like `/api/v1/bom/explode`; this
+    request only waits for it, so other clients are not blocked. Returns 429
+    when RUN_SYNC_MAX_CONCURRENT callers are already waiting and 504 (with the
+    job's poll_url; the job keeps running) after RUN_SYNC_TIMEOUT_SECONDS.
+    
     **Warning:** This may take 30-60 seconds. For production, use `/api/v1/bom/explode` instead.
     """
-    result = api_run_bom_explosion()
+    global _run_sync_slots
+    if _run_sync_slots is None:
+        _run_sync_slots = asyncio.Semaphore(RUN_SYNC_MAX_CONCURRENT)
+    if _run_sync_slots.locked():
+        raise HTTPException(status_code=429, detail="Too many synchronous BOM runs in progress, use /api/v1/bom/explode",
+                            headers={"Retry-After": "30"})
+    
+    jobs = get_job_store()
+    async with _run_sync_slots:
+        job_id = (await asyncio.to_thread(_enqueue_bom_job, BOMExplodeRequest()))[0]["job_id"]
+        deadline = time.monotonic() + RUN_SYNC_TIMEOUT_SECONDS
+        while True:
+            job = await asyncio.to_thread(jobs.get, job_id)
+            if job is None or job["status"] not in ACTIVE_JOB_STATUSES:
+                break
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=504,
+                    detail={
+                        "error": f"BOM run did not finish within {RUN_SYNC_TIMEOUT_SECONDS} seconds",
+                        "job_id": job_id,
+                        "poll_url": f"/api/v1/jobs/{job_id}"
+                    }
+                )
+            await asyncio.sleep(RUN_SYNC_POLL_SECONDS)
     
-    if not result.get("success"):
+    if job is None or job["status"] != "completed":
         raise HTTPException(
             status_code=500,
-            detail=result.get("error", "BOM explosion failed")
+            detail=(job or {}).get("error") or "BOM explosion failed"
         )
     
-    return result
+    return await asyncio.to_thread(jobs.get_result, job_id)
+
+
+@api_app.get("/api/v1/runs/{run_id}", tags=["Runs"])
+async def get_run(run_id: str):
+    """
+    Describe a recent forecast or BOM run and the artifacts it can render.
+    
+    Recent runs are cached in memory; BOM runs from API jobs are also kept in
+    the state backend, so any worker can serve them. Tables are addressed by
+    key, e.g. `mrp_requirements` or `all_forecasts`.
+    """
+    run = await asyncio.to_thread(find_run_result, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Run not found or no longer cached")
+    
+    return {
+        "run_id": run.run_id,
+        "kind": run.kind,
+        "created_at": run.created_at.isoformat(),
+        "filename": run.filename,
+        "tables": run.tables(),
+        "formats": list(ARTIFACT_FORMATS),
+        "artifact_url": f"/api/v1/runs/{run_id}/artifacts/{{format}}?table={{table}}"
+    }
+
+
+@api_app.get("/api/v1/runs/{run_id}/artifacts/{fmt}", tags=["Runs"])
+def get_run_artifact(run_id: str, fmt: str, table: Optional[str] = None):
+    """
+    Download a run artifact, rendered on first request and cached with the run.
+    
+    **Formats:**
+    - `xlsx`: the formatted workbook (all tabs)
+    - `parquet`, `csv`, `arrow` (Arrow IPC stream): one table, the main
+      requirements/forecast table unless `table` is given
+    """
+    run = find_run_result(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Run not found or no longer cached")
+    if fmt not in ARTIFACT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format. Use one of: {', '.join(ARTIFACT_FORMATS)}")
+    
+    try:
+        content = run.artifact(fmt, table)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Table '{table}' not found in run {run_id}")
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    
+    return Response(
+        content=content,
+        media_type=ARTIFACT_FORMATS[fmt][0],
+        headers={"Content-Disposition": f'attachment; filename="{run.artifact_filename(fmt, table)}"'}
+    )
 
 # ==============================================================================
 # ADDITIONAL PYDANTIC MODELS FOR ERP INTEGRATION
@@ -6956,20 +8010,633 @@ class ProcurementParamsSyncResponse(BaseModel):
     failed_items: List[Dict[str, Any]] = []
     message: str
 
+class BOMLine(BaseModel):
+    """One component of one BOM, as a flat row for bulk ingest."""
+    parent_sku_id: str
+    parent_sku_name: Optional[str] = None
+    component_id: str
+    component_name: str
+    quantity_required: float
+    uom: Optional[str] = "EA"
+    wastage_pct: Optional[float] = 0.0
+    unit_cost: Optional[float] = 0.0
+
+class BulkIngestResponse(BaseModel):
+    success: bool
+    request_id: str
+    entity: str
+    sync_mode: str
+    rows_received: int
+    rows_processed: int
+    rows_failed: int
+    batches: int
+    duration_seconds: float
+    failed_rows: List[Dict[str, Any]] = []
+    message: str
+
 
 # ==============================================================================
-# IN-MEMORY DATA STORES FOR ERP SYNC (Replace with database in production)
+# ERP DATA STORE (SQLite, WAL)
 # ==============================================================================
+# Inventory, products, BOMs and procurement parameters received from the ERP
+# are upserted into their own SQLite database next to the job store, keyed by
+# the upper-cased component/SKU id, so they survive restarts and every API
+# worker sees the same data. Each row remembers the ingest that last wrote it:
+# a `replace_all` sync deletes the rows its ingest did not touch only after it
+# has finished, so readers never see a half-emptied table. Rows of a bulk push
+# are staged in <table>_staged tables, keyed by ingest, and merged into the
+# live tables only when the push is published, so no reader (nor a snapshot
+# built from scratch) ever sees half a push.
+#
+# Every sync publishes a new ERP version in the same transaction as its last
+# write. Readers use immutable ERPSnapshots (get_erp_snapshot) instead of the
+# tables: a snapshot is rebuilt only when the version moved, and entities
+# whose version did not change are shared with the previous snapshot. The BOM
+# pipeline reads its inputs from Google Sheets, not the ERP tables, so a job
+# only records the ERP version current when it started.
+
+ERP_DB_PATH = os.path.join(API_STATE_DIR, "erp.sqlite3")
+ERP_ENTITIES = ("inventory", "products", "bom", "procurement_params")
+ERP_KEY_CHUNK = 500   # keys per IN (...) lookup
+
+ERP_INVENTORY_COLUMNS = ("quantity", "warehouse", "uom")
+ERP_PRODUCT_COLUMNS = ("sku_id", "sku_name", "upc", "category", "status", "unit_cost", "lead_time_days", "launch_date")
+ERP_BOM_COMPONENT_COLUMNS = ("component_id", "component_name", "quantity_required", "uom", "wastage_pct", "unit_cost")
+ERP_PROCUREMENT_COLUMNS = ("lead_time_days", "moq", "eoq", "safety_stock_pct", "reorder_point",
+                           "supplier_id", "supplier_name")
+ERP_SYNC_COLUMNS = ("updated_at", "source", "ingest_id")
+ERP_VERSION_HISTORY = 1000   # rows kept in erp_versions
+ERP_STAGE_MAX_AGE_SECONDS = 24 * 3600   # staged rows of an abandoned push are dropped after this
+ERP_STAGE_CLEANUP_INTERVAL_SECONDS = 300
+
+# entity -> (table, key column); BOM components follow their parent row
+ERP_TABLES = {
+    "inventory": ("erp_inventory", "component_key"),
+    "products": ("erp_products", "sku_key"),
+    "bom": ("erp_bom_parents", "parent_key"),
+    "procurement_params": ("erp_procurement_params", "component_key"),
+}
+
+
+class ERPStore(SQLiteStore):
+    """ERP master data pushed through the sync endpoints, one table per entity."""
+
+    def __init__(self, path=ERP_DB_PATH):
+        super().__init__(path)
+        self._last_stage_cleanup = 0.0
+        with self._write() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS erp_inventory (
+                    component_key TEXT PRIMARY KEY,
+                    quantity REAL NOT NULL,
+                    warehouse TEXT,
+                    uom TEXT,
+                    updated_at TEXT,
+                    source TEXT,
+                    ingest_id TEXT
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS erp_products (
+                    sku_key TEXT PRIMARY KEY,
+                    sku_id TEXT NOT NULL,
+                    sku_name TEXT,
+                    upc TEXT,
+                    category TEXT,
+                    status TEXT,
+                    unit_cost REAL,
+                    lead_time_days INTEGER,
+                    launch_date TEXT,
+                    updated_at TEXT,
+                    source TEXT,
+                    ingest_id TEXT
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS erp_bom_parents (
+                    parent_key TEXT PRIMARY KEY,
+                    parent_sku_id TEXT NOT NULL,
+                    parent_sku_name TEXT,
+                    updated_at TEXT,
+                    source TEXT,
+                    ingest_id TEXT
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS erp_bom_components (
+                    parent_key TEXT NOT NULL,
+                    line_no INTEGER NOT NULL,
+                    component_key TEXT NOT NULL,
+                    component_id TEXT NOT NULL,
+                    component_name TEXT,
+                    quantity_required REAL NOT NULL,
+                    uom TEXT,
+                    wastage_pct REAL,
+                    unit_cost REAL,
+                    PRIMARY KEY (parent_key, line_no)
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS erp_procurement_params (
+                    component_key TEXT PRIMARY KEY,
+                    lead_time_days INTEGER,
+                    moq REAL,
+                    eoq REAL,
+                    safety_stock_pct REAL,
+                    reorder_point REAL,
+                    supplier_id TEXT,
+                    supplier_name TEXT,
+                    updated_at TEXT,
+                    source TEXT,
+                    ingest_id TEXT
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_erp_bom_components_component "
+                         "ON erp_bom_components (component_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_erp_products_upc ON erp_products (upc)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_erp_procurement_supplier "
+                         "ON erp_procurement_params (supplier_id)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS erp_versions (
+                    version INTEGER PRIMARY KEY AUTOINCREMENT,
+                    entities TEXT NOT NULL,
+                    ingest_id TEXT,
+                    created_at REAL NOT NULL
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS erp_entity_versions (
+                    entity TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )""")
+            for table, key in list(ERP_TABLES.values()) + [("erp_bom_components", "parent_key, line_no")]:
+                self._create_stage_table(conn, table, key)
+            self._drop_stale_stages(conn, force=True)
+
+    @staticmethod
+    def _stage(table):
+        return f"{table}_staged"
+
+    @classmethod
+    def _create_stage_table(cls, conn, table, key):
+        """
+        A copy of `table`'s columns keyed by (ingest_id, key), for unpublished
+        rows, plus the server time each row was staged at.
+        """
+        columns = [(row["name"], row["type"]) for row in conn.execute(f"PRAGMA table_info({table})")]
+        if "ingest_id" not in {name for name, _ in columns}:
+            columns.append(("ingest_id", "TEXT"))
+        stage = cls._stage(table)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {stage} "
+                     f"({', '.join(f'{name} {col_type}' for name, col_type in columns)}, staged_at REAL, "
+                     f"PRIMARY KEY (ingest_id, {key}))")
+        if "staged_at" not in {row["name"] for row in conn.execute(f"PRAGMA table_info({stage})")}:
+            # Stage tables from before staged_at: their rows age from now
+            conn.execute(f"ALTER TABLE {stage} ADD COLUMN staged_at REAL")
+            conn.execute(f"UPDATE {stage} SET staged_at = ?", (time.time(),))
+
+    def _drop_stale_stages(self, conn, force=False):
+        """
+        Staged rows of pushes that never published (client gone, worker killed).
+        Aged by staged_at, not updated_at, which is the client's timestamp.
+        """
+        now = time.time()
+        if not force and now - self._last_stage_cleanup < ERP_STAGE_CLEANUP_INTERVAL_SECONDS:
+            return
+        self._last_stage_cleanup = now
+        for table, _ in list(ERP_TABLES.values()) + [("erp_bom_components", None)]:
+            conn.execute(f"DELETE FROM {self._stage(table)} WHERE staged_at < ?",
+                         (now - ERP_STAGE_MAX_AGE_SECONDS,))
+
+    @staticmethod
+    def _publish(conn, entities, ingest_id=None):
+        """Bump the ERP version for `entities` inside the caller's write transaction."""
+        version = conn.execute("INSERT INTO erp_versions (entities, ingest_id, created_at) VALUES (?, ?, ?)",
+                               (",".join(entities), ingest_id, time.time())).lastrowid
+        conn.executemany("INSERT INTO erp_entity_versions (entity, version) VALUES (?, ?) "
+                         "ON CONFLICT (entity) DO UPDATE SET version = excluded.version",
+                         [(entity, version) for entity in entities])
+        conn.execute("DELETE FROM erp_versions WHERE version <= ?", (version - ERP_VERSION_HISTORY,))
+        return version
+
+    def publish(self, entity, ingest_id=None):
+        """Merge the rows staged by `ingest_id` (written with publish=False) and publish them as a new version."""
+        with self._write() as conn:
+            if ingest_id is not None:
+                self._merge_staged(conn, entity, ingest_id)
+            return self._publish(conn, [entity], ingest_id)
+
+    def discard(self, ingest_id):
+        """Drop whatever `ingest_id` staged and did not publish."""
+        with self._write() as conn:
+            for table, _ in list(ERP_TABLES.values()) + [("erp_bom_components", None)]:
+                conn.execute(f"DELETE FROM {self._stage(table)} WHERE ingest_id = ?", (ingest_id,))
+
+    def _merge_staged(self, conn, entity, ingest_id):
+        """Upsert an ingest's staged rows into the live table, inside the caller's write transaction."""
+        table, key = ERP_TABLES[entity]
+        stage = self._stage(table)
+        columns, keep_existing = {
+            "inventory": (ERP_INVENTORY_COLUMNS, False),
+            "products": (ERP_PRODUCT_COLUMNS, False),
+            "bom": (("parent_sku_id", "parent_sku_name"), False),
+            "procurement_params": (ERP_PROCUREMENT_COLUMNS, True),
+        }[entity]
+        all_columns = ", ".join((key,) + tuple(columns) + ERP_SYNC_COLUMNS)
+        conn.execute(f"INSERT INTO {table} ({all_columns}) SELECT {all_columns} FROM {stage} "
+                     f"WHERE ingest_id = ? ORDER BY rowid "
+                     f"ON CONFLICT ({key}) DO UPDATE SET {', '.join(self._updates(columns, keep_existing))}",
+                     (ingest_id,))
+        if entity == "bom":
+            # A staged parent carries its complete component list
+            component_columns = "parent_key, line_no, component_key, " + ", ".join(ERP_BOM_COMPONENT_COLUMNS)
+            conn.execute(f"DELETE FROM erp_bom_components WHERE parent_key IN "
+                         f"(SELECT parent_key FROM {stage} WHERE ingest_id = ?)", (ingest_id,))
+            conn.execute(f"INSERT INTO erp_bom_components ({component_columns}) SELECT {component_columns} "
+                         f"FROM {self._stage('erp_bom_components')} WHERE ingest_id = ?", (ingest_id,))
+            conn.execute(f"DELETE FROM {self._stage('erp_bom_components')} WHERE ingest_id = ?", (ingest_id,))
+        conn.execute(f"DELETE FROM {stage} WHERE ingest_id = ?", (ingest_id,))
+
+    def current_version(self):
+        return self._conn().execute("SELECT COALESCE(MAX(version), 0) FROM erp_entity_versions").fetchone()[0]
+
+    def snapshot(self, previous=None):
+        """
+        An ERPSnapshot of all entities, read in one transaction; entities
+        unchanged since `previous` reuse its tables.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            versions = {row["entity"]: row["version"]
+                        for row in conn.execute("SELECT entity, version FROM erp_entity_versions")}
+            tables = {}
+            for entity in ERP_ENTITIES:
+                if previous is not None and previous.entity_versions.get(entity, 0) == versions.get(entity, 0):
+                    tables[entity] = previous.tables[entity]
+                else:
+                    tables[entity] = MappingProxyType(self.export(entity))
+        finally:
+            conn.execute("COMMIT")
+        return ERPSnapshot(version=max(versions.values(), default=0),
+                           entity_versions=MappingProxyType(versions),
+                           tables=MappingProxyType(tables))
+
+    @staticmethod
+    def _updates(columns, keep_existing=False):
+        """SET clauses of an upsert; with keep_existing, NULLs leave stored values alone."""
+        if keep_existing:
+            updates = [f"{col} = COALESCE(excluded.{col}, {col})" for col in columns]
+        else:
+            updates = [f"{col} = excluded.{col}" for col in columns]
+        return updates + [f"{col} = excluded.{col}" for col in ERP_SYNC_COLUMNS]
+
+    def _upsert(self, conn, table, key, columns, rows, keep_existing=False, staged=False):
+        """INSERT ... ON CONFLICT DO UPDATE into `table`, or into its stage table when staged."""
+        all_columns = (key,) + tuple(columns) + ERP_SYNC_COLUMNS
+        updates = self._updates(columns, keep_existing)
+        if staged:
+            self._drop_stale_stages(conn)
+            table, key = self._stage(table), f"ingest_id, {key}"
+            all_columns += ("staged_at",)
+            updates.append("staged_at = excluded.staged_at")
+            staged_at = time.time()
+            rows = [row + (staged_at,) for row in rows]
+        conn.executemany(f"INSERT INTO {table} ({', '.join(all_columns)}) "
+                         f"VALUES ({', '.join('?' * len(all_columns))}) "
+                         f"ON CONFLICT ({key}) DO UPDATE SET {', '.join(updates)}",
+                         rows)
+
+    @staticmethod
+    def _existing_keys(conn, table, key, keys, ingest_id=None):
+        """`keys` present in `table` (of the given ingest only, for a stage table)."""
+        keys = list(keys)
+        found = set()
+        ingest_clause = " AND ingest_id = ?" if ingest_id is not None else ""
+        for start in range(0, len(keys), ERP_KEY_CHUNK):
+            chunk = keys[start:start + ERP_KEY_CHUNK]
+            found.update(row[0] for row in conn.execute(
+                f"SELECT {key} FROM {table} WHERE {key} IN ({', '.join('?' * len(chunk))}){ingest_clause}",
+                chunk + ([ingest_id] if ingest_id is not None else [])))
+        return found
+
+    # Writers publish a new version unless publish=False: then the rows are
+    # staged under their ingest_id until publish() or prune() merges them (a
+    # bulk push or a replace_all publishes once, when it is complete)
+
+    def upsert_inventory(self, items, source, timestamp, ingest_id, publish=True):
+        rows = [(item.component_id.upper(), item.quantity, item.warehouse, item.uom, timestamp, source, ingest_id)
+                for item in items]
+        with self._write() as conn:
+            self._upsert(conn, "erp_inventory", "component_key", ERP_INVENTORY_COLUMNS, rows, staged=not publish)
+            if publish:
+                self._publish(conn, ["inventory"], ingest_id)
+        return len(rows)
+
+    def upsert_products(self, products, source, timestamp, ingest_id, publish=True):
+        """Returns (created, updated)."""
+        rows = [(product.sku_id.upper(),) + tuple(getattr(product, col) for col in ERP_PRODUCT_COLUMNS)
+                + (timestamp, source, ingest_id) for product in products]
+        with self._write() as conn:
+            keys = {row[0] for row in rows}
+            seen = self._existing_keys(conn, "erp_products", "sku_key", keys)
+            if not publish:   # or written earlier in this ingest
+                seen |= self._existing_keys(conn, self._stage("erp_products"), "sku_key", keys, ingest_id)
+            created = 0
+            for row in rows:
+                if row[0] not in seen:
+                    seen.add(row[0])
+                    created += 1
+            self._upsert(conn, "erp_products", "sku_key", ERP_PRODUCT_COLUMNS, rows, staged=not publish)
+            if publish:
+                self._publish(conn, ["products"], ingest_id)
+        return created, len(rows) - created
+
+    def upsert_boms(self, bom_items, source, timestamp, ingest_id, continuing=frozenset(), publish=True):
+        """
+        Replace each item's component list. Parents in `continuing` already had
+        their list replaced earlier in this ingest, so their components are appended.
+        Returns the number of components written.
+        """
+        parents = {}
+        for item in bom_items:
+            parents.setdefault(item.parent_sku_id.upper(), item)
+        components = 0
+        # Staged components are scoped to this ingest; live ones are not
+        component_table = "erp_bom_components" if publish else self._stage("erp_bom_components")
+        scope_clause, scope = ("", ()) if publish else (" AND ingest_id = ?", (ingest_id,))
+        stamp = () if publish else (ingest_id, time.time())
+        with self._write() as conn:
+            self._upsert(conn, "erp_bom_parents", "parent_key", ("parent_sku_id", "parent_sku_name"),
+                         [(key, item.parent_sku_id, item.parent_sku_name, timestamp, source, ingest_id)
+                          for key, item in parents.items()], staged=not publish)
+            replaced = [key for key in parents if key not in continuing]
+            for start in range(0, len(replaced), ERP_KEY_CHUNK):
+                chunk = replaced[start:start + ERP_KEY_CHUNK]
+                conn.execute(f"DELETE FROM {component_table} "
+                             f"WHERE parent_key IN ({', '.join('?' * len(chunk))}){scope_clause}", chunk + list(scope))
+            next_line = {}
+            rows = []
+            for item in bom_items:
+                key = item.parent_sku_id.upper()
+                if key not in next_line:
+                    next_line[key] = conn.execute(f"SELECT COALESCE(MAX(line_no), 0) FROM {component_table} "
+                                                  f"WHERE parent_key = ?{scope_clause}", (key,) + scope).fetchone()[0]
+                for comp in item.components:
+                    next_line[key] += 1
+                    rows.append((key, next_line[key], comp.component_id.upper())
+                                + tuple(getattr(comp, col) for col in ERP_BOM_COMPONENT_COLUMNS) + stamp)
+            conn.executemany(f"INSERT INTO {component_table} (parent_key, line_no, component_key, "
+                             f"{', '.join(ERP_BOM_COMPONENT_COLUMNS)}{', ingest_id, staged_at' if stamp else ''}) "
+                             f"VALUES ({', '.join('?' * (3 + len(ERP_BOM_COMPONENT_COLUMNS) + len(stamp)))})", rows)
+            components = len(rows)
+            if publish:
+                self._publish(conn, ["bom"], ingest_id)
+        return components
+
+    def upsert_procurement_params(self, params, source, timestamp, ingest_id, publish=True):
+        """Only provided (non-null) fields overwrite stored values."""
+        rows = [(param.component_id.upper(),) + tuple(getattr(param, col) for col in ERP_PROCUREMENT_COLUMNS)
+                + (timestamp, source, ingest_id) for param in params]
+        with self._write() as conn:
+            self._upsert(conn, "erp_procurement_params", "component_key", ERP_PROCUREMENT_COLUMNS, rows,
+                         keep_existing=True, staged=not publish)
+            if publish:
+                self._publish(conn, ["procurement_params"], ingest_id)
+        return len(rows)
+
+    def prune(self, entity, ingest_id):
+        """
+        Finish a replace_all sync: merge its staged rows, drop the entity's
+        rows written by any other ingest, and publish. Raises if the ingest
+        has nothing staged, rather than emptying the entity.
+        """
+        table, _ = ERP_TABLES[entity]
+        with self._write() as conn:
+            if not conn.execute(f"SELECT 1 FROM {self._stage(table)} WHERE ingest_id = ? LIMIT 1",
+                                (ingest_id,)).fetchone():
+                raise RuntimeError(f"No staged {entity} rows for ingest {ingest_id}; replace_all aborted")
+            self._merge_staged(conn, entity, ingest_id)
+            removed = conn.execute(f"DELETE FROM {table} WHERE ingest_id IS NOT ?", (ingest_id,)).rowcount
+            if entity == "bom":
+                conn.execute("DELETE FROM erp_bom_components "
+                             "WHERE parent_key NOT IN (SELECT parent_key FROM erp_bom_parents)")
+            self._publish(conn, [entity], ingest_id)
+        return removed
+
+    def clear(self, entities=ERP_ENTITIES):
+        with self._write() as conn:
+            for entity in entities:
+                conn.execute(f"DELETE FROM {ERP_TABLES[entity][0]}")
+                if entity == "bom":
+                    conn.execute("DELETE FROM erp_bom_components")
+            self._publish(conn, list(entities))
+
+    def count(self, entity):
+        table, _ = ERP_TABLES[entity]
+        return self._conn().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def export(self, entity):
+        """{key: record} in the shape the /current endpoints have always returned."""
+        conn = self._conn()
+        table, key = ERP_TABLES[entity]
+        columns = {
+            "inventory": ERP_INVENTORY_COLUMNS,
+            "products": ERP_PRODUCT_COLUMNS,
+            "bom": ("parent_sku_id", "parent_sku_name"),
+            "procurement_params": ERP_PROCUREMENT_COLUMNS,
+        }[entity] + ("updated_at", "source")
+        records = {}
+        for row in conn.execute(f"SELECT {key}, {', '.join(columns)} FROM {table} ORDER BY {key}"):
+            record = {col: row[col] for col in columns}
+            if entity == "procurement_params":
+                # Only the fields the ERP has ever sent
+                record = {col: value for col, value in record.items() if value is not None}
+            elif entity == "bom":
+                record = {"parent_sku_id": record["parent_sku_id"], "parent_sku_name": record["parent_sku_name"],
+                          "components": [], "updated_at": record["updated_at"], "source": record["source"]}
+            records[row[key]] = record
+        if entity == "bom":
+            for row in conn.execute(f"SELECT parent_key, {', '.join(ERP_BOM_COMPONENT_COLUMNS)} "
+                                    "FROM erp_bom_components ORDER BY parent_key, line_no"):
+                records[row["parent_key"]]["components"].append(
+                    {col: row[col] for col in ERP_BOM_COMPONENT_COLUMNS})
+        return records
+
+
+@dataclass(frozen=True)
+class ERPSnapshot:
+    """One published ERP version: read-only {key: record} tables per entity."""
+    version: int
+    entity_versions: Mapping
+    tables: Mapping
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def inventory(self):
+        return self.tables["inventory"]
+
+    @property
+    def products(self):
+        return self.tables["products"]
+
+    @property
+    def bom(self):
+        return self.tables["bom"]
+
+    @property
+    def procurement_params(self):
+        return self.tables["procurement_params"]
+
+
+_erp_store = None
+_erp_store_lock = threading.Lock()
+_erp_snapshot = None
+_erp_snapshot_lock = threading.Lock()
+_job_erp_version = None   # set in a BOM job process: the ERP version when it started
+
+
+def get_erp_store():
+    """The process-wide ERPStore, opened on first use."""
+    global _erp_store
+    with _erp_store_lock:
+        if _erp_store is None:
+            _erp_store = ERPStore()
+        return _erp_store
+
+
+def get_erp_snapshot():
+    """
+    The latest ERPSnapshot. Readers share the current snapshot without
+    locking; only a version change rebuilds it.
+    """
+    global _erp_snapshot
+    store = get_erp_store()
+    snapshot = _erp_snapshot
+    if snapshot is not None and snapshot.version == store.current_version():
+        return snapshot
+    with _erp_snapshot_lock:
+        if _erp_snapshot is None or _erp_snapshot.version != store.current_version():
+            started = time.time()
+            _erp_snapshot = store.snapshot(previous=_erp_snapshot)
+            print(f"📸 ERP snapshot v{_erp_snapshot.version} ready ({time.time() - started:.2f}s)")
+        return _erp_snapshot
+
+
+# Forecast overrides are kept in the state backend, one JSON value per SKU
+FORECAST_OVERRIDES_NAMESPACE = "forecast_overrides"
+
+
+def get_forecast_override_map():
+    return {sku: json.loads(value)
+            for sku, value in get_state_backend().items(FORECAST_OVERRIDES_NAMESPACE).items()}
 
-# These stores hold data received from ERP until next BOM run
-erp_inventory_store: Dict[str, Dict[str, Any]] = {}
-erp_forecast_overrides: Dict[str, Dict[str, Any]] = {}
-erp_products_store: Dict[str, Dict[str, Any]] = {}
-erp_bom_store: Dict[str, Dict[str, Any]] = {}
-erp_procurement_params_store: Dict[str, Dict[str, Any]] = {}
 
-# Sync history for audit trail
-sync_history: List[Dict[str, Any]] = []
+# ==============================================================================
+# SYNC AUDIT LOG
+# ==============================================================================
+# Every sync is recorded in an append-only sync_audit table in the ERP
+# database, indexed by type, source and time, so /api/v1/sync/history can
+# filter and page without holding the history in memory. Entries older than
+# SYNC_AUDIT_RETENTION_DAYS, or beyond the newest SYNC_AUDIT_MAX_ROWS, are
+# pruned. If a write fails (e.g. the database is locked for too long) the
+# entry waits in a bounded in-memory ring and is written with the next one.
+
+SYNC_AUDIT_MAX_ROWS = 100_000
+SYNC_AUDIT_RETENTION_DAYS = 90
+SYNC_AUDIT_PRUNE_INTERVAL_SECONDS = 300
+SYNC_AUDIT_BUFFER_SIZE = 1000
+SYNC_AUDIT_MAX_PAGE = 1000
+
+
+class SyncAuditLog(SQLiteStore):
+    """Append-only log of sync operations with retention limits."""
+
+    def __init__(self, path=ERP_DB_PATH):
+        super().__init__(path)
+        self._unwritten = deque(maxlen=SYNC_AUDIT_BUFFER_SIZE)
+        self._buffer_lock = threading.Lock()
+        self._last_prune = 0.0
+        with self._write() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_audit (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    type TEXT NOT NULL,
+                    request_id TEXT,
+                    source TEXT,
+                    created_at REAL NOT NULL,
+                    entry TEXT NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sync_audit_type ON sync_audit (type, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sync_audit_source ON sync_audit (source, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sync_audit_created_at ON sync_audit (created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sync_audit_request_id ON sync_audit (request_id)")
+
+    def record(self, entry):
+        """Append one history entry (a dict with at least `type`)."""
+        row = (entry.get("type", "unknown"), entry.get("request_id"), entry.get("source"), time.time(),
+               json.dumps(entry, default=_json_default))
+        with self._buffer_lock:
+            self._unwritten.append(row)
+            rows = list(self._unwritten)
+            try:
+                with self._write() as conn:
+                    conn.executemany("INSERT INTO sync_audit (type, request_id, source, created_at, entry) "
+                                     "VALUES (?, ?, ?, ?, ?)", rows)
+                self._unwritten.clear()
+            except sqlite3.Error as e:
+                print(f"⚠️ Sync audit write failed, {len(rows)} entries buffered: {e}")
+                return
+        self.prune()
+
+    def prune(self, force=False):
+        now = time.time()
+        if not force and now - self._last_prune < SYNC_AUDIT_PRUNE_INTERVAL_SECONDS:
+            return 0
+        self._last_prune = now
+        with self._write() as conn:
+            removed = conn.execute("DELETE FROM sync_audit WHERE created_at < ?",
+                                   (now - SYNC_AUDIT_RETENTION_DAYS * 86400,)).rowcount
+            removed += conn.execute("DELETE FROM sync_audit WHERE id <= (SELECT id FROM sync_audit "
+                                    "ORDER BY id DESC LIMIT 1 OFFSET ?)", (SYNC_AUDIT_MAX_ROWS,)).rowcount
+        if removed:
+            print(f"🧹 Pruned {removed} sync audit entries")
+        return removed
+
+    def query(self, entry_type=None, source=None, request_id=None, since=None, until=None,
+              before_id=None, limit=50):
+        """
+        (total, entries) for the newest `limit` entries matching the filters,
+        older than `before_id` when paging; entries are oldest first, each with its `id`.
+        """
+        where, params = [], []
+        for column, value in (("type", entry_type), ("source", source), ("request_id", request_id)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(until)
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM sync_audit {clause}", params).fetchone()[0]
+        if before_id is not None:
+            clause += (" AND " if clause else "WHERE ") + "id < ?"
+            params.append(before_id)
+        rows = conn.execute(f"SELECT id, entry FROM sync_audit {clause} ORDER BY id DESC LIMIT ?",
+                            params + [limit]).fetchall()
+        entries = [{"id": row["id"], **json.loads(row["entry"])} for row in reversed(rows)]
+        return total, entries
+
+
+_sync_audit_log = None
+_sync_audit_log_lock = threading.Lock()
+
+
+def get_sync_audit_log():
+    """The process-wide SyncAuditLog, opened on first use."""
+    global _sync_audit_log
+    with _sync_audit_log_lock:
+        if _sync_audit_log is None:
+            _sync_audit_log = SyncAuditLog()
+        return _sync_audit_log
 
 
 # ==============================================================================
@@ -7000,31 +8667,23 @@ async def sync_inventory(request: InventorySyncRequest):
     - Stores inventory data for use in next BOM explosion
     - Validates component IDs against known components
     - Returns count of successfully processed items
+    
+    For full pushes use `/api/v1/inventory/sync/bulk` (NDJSON or CSV stream).
     """
     items_processed = 0
     items_failed = 0
     failed_items = []
     
-    for item in request.inventory_items:
-        try:
-            # Store in memory (replace with database in production)
-            erp_inventory_store[item.component_id.upper()] = {
-                "quantity": item.quantity,
-                "warehouse": item.warehouse,
-                "uom": item.uom,
-                "updated_at": request.timestamp,
-                "source": request.source
-            }
-            items_processed += 1
-        except Exception as e:
-            items_failed += 1
-            failed_items.append({
-                "component_id": item.component_id,
-                "error": str(e)
-            })
+    try:
+        items_processed = await asyncio.to_thread(
+            get_erp_store().upsert_inventory, request.inventory_items,
+            request.source, request.timestamp, uuid.uuid4().hex)
+    except Exception as e:
+        items_failed = len(request.inventory_items)
+        failed_items = [{"component_id": item.component_id, "error": str(e)} for item in request.inventory_items]
     
     # Log sync event
-    sync_history.append({
+    await asyncio.to_thread(get_sync_audit_log().record, {
         "type": "inventory_sync",
         "request_id": request.request_id,
         "timestamp": request.timestamp,
@@ -7070,14 +8729,13 @@ async def override_forecast(request: ForecastOverrideRequest):
     - If `replace_existing=true`, clears all previous overrides
     - Overrides take precedence over calculated forecasts
     """
-    if request.replace_existing:
-        erp_forecast_overrides.clear()
+    overrides = {}
     
     items_applied = 0
     
     for override in request.overrides:
         try:
-            erp_forecast_overrides[override.sku_id.upper()] = {
+            overrides[override.sku_id.upper()] = {
                 "forecast_quantity": override.forecast_quantity,
                 "period": override.period,
                 "reason": override.reason,
@@ -7088,8 +8746,13 @@ async def override_forecast(request: ForecastOverrideRequest):
         except Exception as e:
             print(f"Error applying forecast override for {override.sku_id}: {e}")
     
+    # One atomic write; replace_existing drops the other SKUs in the same transaction
+    await asyncio.to_thread(get_state_backend().put_many, FORECAST_OVERRIDES_NAMESPACE,
+                            {sku: json.dumps(value).encode("utf-8") for sku, value in overrides.items()},
+                            replace=request.replace_existing)
+    
     # Log sync event
-    sync_history.append({
+    await asyncio.to_thread(get_sync_audit_log().record, {
         "type": "forecast_override",
         "request_id": request.request_id,
         "timestamp": request.timestamp,
@@ -7138,47 +8801,28 @@ async def sync_products(request: ProductSyncRequest):
     **Sync Modes:**
     - `upsert`: Update existing products, insert new ones
     - `replace_all`: Clear all products and replace with provided list
-    """
-    if request.sync_mode == "replace_all":
-        erp_products_store.clear()
     
+    For full pushes use `/api/v1/products/sync/bulk` (NDJSON or CSV stream).
+    """
     products_created = 0
     products_updated = 0
     products_failed = 0
     failed_items = []
     
-    for product in request.products:
-        try:
-            sku_key = product.sku_id.upper()
-            is_new = sku_key not in erp_products_store
-            
-            erp_products_store[sku_key] = {
-                "sku_id": product.sku_id,
-                "sku_name": product.sku_name,
-                "upc": product.upc,
-                "category": product.category,
-                "status": product.status,
-                "unit_cost": product.unit_cost,
-                "lead_time_days": product.lead_time_days,
-                "launch_date": product.launch_date,
-                "updated_at": request.timestamp,
-                "source": request.source
-            }
-            
-            if is_new:
-                products_created += 1
-            else:
-                products_updated += 1
-                
-        except Exception as e:
-            products_failed += 1
-            failed_items.append({
-                "sku_id": product.sku_id,
-                "error": str(e)
-            })
+    ingest_id = uuid.uuid4().hex
+    try:
+        store = get_erp_store()
+        products_created, products_updated = await asyncio.to_thread(
+            store.upsert_products, request.products, request.source, request.timestamp, ingest_id,
+            publish=request.sync_mode != "replace_all")
+        if request.sync_mode == "replace_all":
+            await asyncio.to_thread(store.prune, "products", ingest_id)
+    except Exception as e:
+        products_failed = len(request.products)
+        failed_items = [{"sku_id": product.sku_id, "error": str(e)} for product in request.products]
     
     # Log sync event
-    sync_history.append({
+    await asyncio.to_thread(get_sync_audit_log().record, {
         "type": "product_sync",
         "request_id": request.request_id,
         "timestamp": request.timestamp,
@@ -7230,44 +8874,26 @@ async def sync_bom(request: BOMSyncRequest):
     **Sync Modes:**
     - `upsert`: Update existing BOMs, insert new ones
     - `replace_all`: Clear all BOMs and replace with provided list
-    """
-    if request.sync_mode == "replace_all":
-        erp_bom_store.clear()
     
+    For full pushes use `/api/v1/bom/sync/bulk` (NDJSON or CSV stream).
+    """
     bom_items_processed = 0
     total_components_processed = 0
     
-    for bom_item in request.bom_items:
-        try:
-            sku_key = bom_item.parent_sku_id.upper()
-            
-            components_list = []
-            for comp in bom_item.components:
-                components_list.append({
-                    "component_id": comp.component_id,
-                    "component_name": comp.component_name,
-                    "quantity_required": comp.quantity_required,
-                    "uom": comp.uom,
-                    "wastage_pct": comp.wastage_pct,
-                    "unit_cost": comp.unit_cost
-                })
-                total_components_processed += 1
-            
-            erp_bom_store[sku_key] = {
-                "parent_sku_id": bom_item.parent_sku_id,
-                "parent_sku_name": bom_item.parent_sku_name,
-                "components": components_list,
-                "updated_at": request.timestamp,
-                "source": request.source
-            }
-            
-            bom_items_processed += 1
-            
-        except Exception as e:
-            print(f"Error processing BOM for {bom_item.parent_sku_id}: {e}")
+    ingest_id = uuid.uuid4().hex
+    try:
+        store = get_erp_store()
+        total_components_processed = await asyncio.to_thread(
+            store.upsert_boms, request.bom_items, request.source, request.timestamp, ingest_id,
+            publish=request.sync_mode != "replace_all")
+        bom_items_processed = len(request.bom_items)
+        if request.sync_mode == "replace_all":
+            await asyncio.to_thread(store.prune, "bom", ingest_id)
+    except Exception as e:
+        print(f"Error processing BOM sync {request.request_id}: {e}")
     
     # Log sync event
-    sync_history.append({
+    await asyncio.to_thread(get_sync_audit_log().record, {
         "type": "bom_sync",
         "request_id": request.request_id,
         "timestamp": request.timestamp,
@@ -7317,49 +8943,23 @@ async def sync_procurement_params(request: ProcurementParamsSyncRequest):
     - Updates procurement parameters for specified components
     - Only provided fields are updated (null fields are ignored)
     - Parameters are used in next BOM/MRP calculation
+    
+    For full pushes use `/api/v1/procurement-params/sync/bulk` (NDJSON or CSV stream).
     """
     items_updated = 0
     items_failed = 0
     failed_items = []
     
-    for param in request.parameters:
-        try:
-            comp_key = param.component_id.upper()
-            
-            # Get existing params or create new
-            existing = erp_procurement_params_store.get(comp_key, {})
-            
-            # Update only provided fields (not None)
-            if param.lead_time_days is not None:
-                existing["lead_time_days"] = param.lead_time_days
-            if param.moq is not None:
-                existing["moq"] = param.moq
-            if param.eoq is not None:
-                existing["eoq"] = param.eoq
-            if param.safety_stock_pct is not None:
-                existing["safety_stock_pct"] = param.safety_stock_pct
-            if param.reorder_point is not None:
-                existing["reorder_point"] = param.reorder_point
-            if param.supplier_id is not None:
-                existing["supplier_id"] = param.supplier_id
-            if param.supplier_name is not None:
-                existing["supplier_name"] = param.supplier_name
-            
-            existing["updated_at"] = request.timestamp
-            existing["source"] = request.source
-            
-            erp_procurement_params_store[comp_key] = existing
-            items_updated += 1
-            
-        except Exception as e:
-            items_failed += 1
-            failed_items.append({
-                "component_id": param.component_id,
-                "error": str(e)
-            })
+    try:
+        items_updated = await asyncio.to_thread(
+            get_erp_store().upsert_procurement_params, request.parameters,
+            request.source, request.timestamp, uuid.uuid4().hex)
+    except Exception as e:
+        items_failed = len(request.parameters)
+        failed_items = [{"component_id": param.component_id, "error": str(e)} for param in request.parameters]
     
     # Log sync event
-    sync_history.append({
+    await asyncio.to_thread(get_sync_audit_log().record, {
         "type": "procurement_params_sync",
         "request_id": request.request_id,
         "timestamp": request.timestamp,
@@ -7380,6 +8980,293 @@ async def sync_procurement_params(request: ProcurementParamsSyncRequest):
     )
 
 
+# ==============================================================================
+# ERP BULK INGEST (NDJSON / CSV streams)
+# ==============================================================================
+# The /sync endpoints above take one JSON document, so a nightly push of tens
+# of thousands of rows is parsed and validated in one piece. The /sync/bulk
+# endpoints read the body as a stream instead: one record per line, as NDJSON
+# or CSV (with a header row), validated and upserted BULK_INGEST_BATCH_ROWS at
+# a time, each batch in its own transaction. Memory stays bounded by the batch
+# size. Batches are staged under the push's ingest_id and become visible to
+# ERP snapshots as one version once the body has been read. A disconnect or a
+# failed write discards what the push staged, so none of it is published;
+# staged rows a killed worker leaves behind age out after
+# ERP_STAGE_MAX_AGE_SECONDS.
+
+BULK_INGEST_BATCH_ROWS = 5000
+BULK_INGEST_MAX_FAILED_REPORTED = 100
+CSV_MEDIA_TYPES = ("text/csv", "application/csv")
+SYNC_MODES = ("upsert", "replace_all")
+
+BULK_INGEST_MODELS = {
+    "inventory": InventoryItem,
+    "products": ProductItem,
+    "bom": BOMLine,
+    "procurement_params": ProcurementParam,
+}
+_bulk_ingest_adapters = {entity: TypeAdapter(List[model]) for entity, model in BULK_INGEST_MODELS.items()}
+
+
+async def _body_lines(request: Request):
+    """(line_no, text) for each non-blank line of the request body, read chunk by chunk."""
+    pending = b""
+    line_no = 0
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_no += 1
+            text = line.decode("utf-8-sig" if line_no == 1 else "utf-8").strip()
+            if text:
+                yield line_no, text
+    text = pending.decode("utf-8-sig" if line_no == 0 else "utf-8").strip()
+    if text:
+        yield line_no + 1, text
+
+
+async def _ingest_records(request: Request, csv_body: bool, entity: str):
+    """
+    (line_no, record dict or error message); a CSV body's first line is its
+    header. A nested BOM record yields one flat record per component.
+    """
+    header = None
+    async for line_no, text in _body_lines(request):
+        try:
+            if csv_body:
+                values = next(csv.reader([text]))
+                if header is None:
+                    header = [name.strip() for name in values]
+                    continue
+                # Empty cells fall back to the model defaults
+                record = {name: value for name, value in zip(header, values) if value != ""}
+            else:
+                record = orjson.loads(text) if ORJSON_AVAILABLE else json.loads(text)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+        except Exception as e:
+            yield line_no, f"Unparseable line: {e}"
+            continue
+        try:
+            records = _bom_lines(record) if entity == "bom" else [record]
+        except ValueError as e:
+            yield line_no, f"Invalid BOM record: {e}"
+            continue
+        for record in records:
+            yield line_no, record
+
+
+def _bom_lines(record):
+    """A BOM record is either one flat BOMLine or a BOMItem with nested components."""
+    if "components" not in record:
+        return [record]
+    components = record["components"] or []
+    if not isinstance(components, list) or not all(isinstance(component, dict) for component in components):
+        raise ValueError("components must be a list of objects")
+    parent = {key: value for key, value in record.items() if key != "components"}
+    return [{**parent, **component} for component in components]
+
+
+def _validate_ingest_batch(entity, batch):
+    """Validate [(line_no, record)]; returns ([model], [failure])."""
+    records = [record for _, record in batch]
+    try:
+        return _bulk_ingest_adapters[entity].validate_python(records), []
+    except ValidationError:
+        pass
+    # Re-validate row by row to keep the good rows and report the bad ones
+    model = BULK_INGEST_MODELS[entity]
+    valid, failed = [], []
+    for line_no, record in batch:
+        try:
+            valid.append(model.model_validate(record))
+        except ValidationError as e:
+            failed.append({"line": line_no, "error": "; ".join(
+                f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors())})
+    return valid, failed
+
+
+def _write_ingest_batch(store, entity, models, ingest):
+    """Upsert one validated batch, unpublished; returns the number of rows written."""
+    meta = (ingest["source"], ingest["timestamp"], ingest["ingest_id"])
+    if entity == "inventory":
+        return store.upsert_inventory(models, *meta, publish=False)
+    if entity == "products":
+        created, updated = store.upsert_products(models, *meta, publish=False)
+        ingest["created"] += created
+        ingest["updated"] += updated
+        return created + updated
+    if entity == "procurement_params":
+        return store.upsert_procurement_params(models, *meta, publish=False)
+
+    # BOM lines -> one BOMItem per parent, in order of appearance
+    items = {}
+    for line in models:
+        key = line.parent_sku_id.upper()
+        if key not in items:
+            items[key] = BOMItem(parent_sku_id=line.parent_sku_id, parent_sku_name=line.parent_sku_name,
+                                 components=[])
+        items[key].components.append(BOMComponent(**line.model_dump(exclude={"parent_sku_id", "parent_sku_name"})))
+    written = store.upsert_boms(list(items.values()), *meta, continuing=ingest["parents"] & items.keys(),
+                                publish=False)
+    ingest["parents"].update(items)
+    return written
+
+
+async def _bulk_ingest(request: Request, entity: str, source: str, sync_mode: str,
+                       request_id: Optional[str]) -> "BulkIngestResponse":
+    if sync_mode not in SYNC_MODES:
+        raise HTTPException(status_code=400, detail=f"sync_mode must be one of {', '.join(SYNC_MODES)}")
+    request_id = request_id or str(uuid.uuid4())
+    csv_body = request.headers.get("content-type", "").split(";")[0].strip().lower() in CSV_MEDIA_TYPES
+    store = get_erp_store()
+    ingest = {"source": source, "timestamp": datetime.now().isoformat(), "ingest_id": uuid.uuid4().hex,
+              "created": 0, "updated": 0, "parents": set()}
+    started = time.time()
+    received = processed = failed = batches = 0
+    failed_rows = []
+
+    async def flush(batch):
+        nonlocal processed, failed, batches
+        valid, batch_failed = await asyncio.to_thread(_validate_ingest_batch, entity, batch)
+        if valid:
+            processed += await asyncio.to_thread(_write_ingest_batch, store, entity, valid, ingest)
+        batches += 1
+        failed += len(batch_failed)
+        failed_rows.extend(batch_failed[:BULK_INGEST_MAX_FAILED_REPORTED - len(failed_rows)])
+
+    try:
+        batch = []
+        async for line_no, record in _ingest_records(request, csv_body, entity):
+            received += 1
+            if isinstance(record, str):
+                failed += 1
+                if len(failed_rows) < BULK_INGEST_MAX_FAILED_REPORTED:
+                    failed_rows.append({"line": line_no, "error": record})
+                continue
+            batch.append((line_no, record))
+            if len(batch) >= BULK_INGEST_BATCH_ROWS:
+                await flush(batch)
+                batch = []
+        if batch:
+            await flush(batch)
+
+        # Publish the whole push as one ERP version
+        pruned = 0
+        if sync_mode == "replace_all" and failed == 0 and received > 0:
+            pruned = await asyncio.to_thread(store.prune, entity, ingest["ingest_id"])
+        elif processed:
+            await asyncio.to_thread(store.publish, entity, ingest["ingest_id"])
+    except BaseException:
+        # Client gone or a write failed: nothing of this push is published
+        await asyncio.to_thread(store.discard, ingest["ingest_id"])
+        raise
+    duration = time.time() - started
+
+    message = f"{entity} bulk sync completed. {processed} rows upserted in {batches} batch(es), {failed} failed"
+    if entity == "products":
+        message += f" ({ingest['created']} created, {ingest['updated']} updated)"
+    if sync_mode == "replace_all":
+        message += f"; {pruned} stale rows removed" if failed == 0 and received > 0 else "; nothing removed (rows failed)"
+    print(f"📥 {message} in {duration:.2f}s")
+
+    await asyncio.to_thread(get_sync_audit_log().record, {
+        "type": f"{entity}_bulk_sync",
+        "request_id": request_id,
+        "timestamp": ingest["timestamp"],
+        "source": source,
+        "sync_mode": sync_mode,
+        "rows_received": received,
+        "rows_processed": processed,
+        "rows_failed": failed
+    })
+
+    return BulkIngestResponse(
+        success=failed == 0,
+        request_id=request_id,
+        entity=entity,
+        sync_mode=sync_mode,
+        rows_received=received,
+        rows_processed=processed,
+        rows_failed=failed,
+        batches=batches,
+        duration_seconds=round(duration, 3),
+        failed_rows=failed_rows,
+        message=message + "."
+    )
+
+
+@api_app.post("/api/v1/inventory/sync/bulk", response_model=BulkIngestResponse, tags=["ERP Integration"])
+async def bulk_sync_inventory(request: Request, source: str = "erpnext", sync_mode: str = "upsert",
+                              request_id: Optional[str] = None):
+    """
+    Stream a full inventory push as NDJSON or CSV.
+    
+    **Use Case:** Nightly ERPNext export of every stock level.
+    
+    **Example Request** (`Content-Type: text/csv`):
+```
+    component_id,quantity,warehouse,uom
+    COMP-001,1500,WH-MAIN,EA
+    COMP-002,800,WH-MAIN,
+```
+    With `Content-Type: application/x-ndjson`, send one JSON object per line
+    with the same fields. Empty CSV cells take the field defaults.
+    
+    **Query Parameters:**
+    - `source`: Sending system (default: erpnext)
+    - `sync_mode`: `upsert` (default) or `replace_all`, which removes items
+      missing from this push once it finishes without failed rows
+    - `request_id`: Echoed back and recorded in the sync history
+    
+    **Behavior:**
+    - Rows are validated and committed in batches; invalid rows are reported
+      by line number and the rest are still stored
+    """
+    return await _bulk_ingest(request, "inventory", source, sync_mode, request_id)
+
+
+@api_app.post("/api/v1/products/sync/bulk", response_model=BulkIngestResponse, tags=["ERP Integration"])
+async def bulk_sync_products(request: Request, source: str = "erpnext", sync_mode: str = "upsert",
+                             request_id: Optional[str] = None):
+    """
+    Stream a full product master push as NDJSON or CSV.
+    
+    **Fields:** sku_id, sku_name, upc, category, status, unit_cost,
+    lead_time_days, launch_date — one product per line. Query parameters as
+    for `/api/v1/inventory/sync/bulk`.
+    """
+    return await _bulk_ingest(request, "products", source, sync_mode, request_id)
+
+
+@api_app.post("/api/v1/bom/sync/bulk", response_model=BulkIngestResponse, tags=["ERP Integration"])
+async def bulk_sync_bom(request: Request, source: str = "erpnext", sync_mode: str = "upsert",
+                        request_id: Optional[str] = None):
+    """
+    Stream a full BOM push as NDJSON or CSV.
+    
+    **Fields:** parent_sku_id, parent_sku_name, component_id, component_name,
+    quantity_required, uom, wastage_pct, unit_cost — one component per line.
+    NDJSON lines may also be whole BOM items with nested `components`, as in
+    `/api/v1/bom/sync`. Each parent's component list is replaced by the lines
+    this push sends for it. Query parameters as for `/api/v1/inventory/sync/bulk`.
+    """
+    return await _bulk_ingest(request, "bom", source, sync_mode, request_id)
+
+
+@api_app.post("/api/v1/procurement-params/sync/bulk", response_model=BulkIngestResponse, tags=["ERP Integration"])
+async def bulk_sync_procurement_params(request: Request, source: str = "erpnext", sync_mode: str = "upsert",
+                                       request_id: Optional[str] = None):
+    """
+    Stream a full procurement parameter push as NDJSON or CSV.
+    
+    **Fields:** component_id, lead_time_days, moq, eoq, safety_stock_pct,
+    reorder_point, supplier_id, supplier_name — one component per line. Only
+    provided fields are updated. Query parameters as for `/api/v1/inventory/sync/bulk`.
+    """
+    return await _bulk_ingest(request, "procurement_params", source, sync_mode, request_id)
+
+
 # ==============================================================================
 # DATA RETRIEVAL ENDPOINTS (For ERP to verify synced data)
 # ==============================================================================
@@ -7391,10 +9278,12 @@ async def get_current_inventory():
     
     **Use Case:** ERPNext verifies what inventory data the MRP system has.
     """
+    snapshot = await asyncio.to_thread(get_erp_snapshot)
     return {
         "success": True,
-        "total_items": len(erp_inventory_store),
-        "inventory": erp_inventory_store
+        "erp_version": snapshot.version,
+        "total_items": len(snapshot.inventory),
+        "inventory": dict(snapshot.inventory)
     }
 
 
@@ -7405,10 +9294,11 @@ async def get_forecast_overrides():
     
     **Use Case:** ERPNext reviews what forecast overrides are active.
     """
+    overrides = await asyncio.to_thread(get_forecast_override_map)
     return {
         "success": True,
-        "total_overrides": len(erp_forecast_overrides),
-        "overrides": erp_forecast_overrides
+        "total_overrides": len(overrides),
+        "overrides": overrides
     }
 
 
@@ -7419,10 +9309,12 @@ async def get_current_products():
     
     **Use Case:** ERPNext verifies product data in MRP system.
     """
+    snapshot = await asyncio.to_thread(get_erp_snapshot)
     return {
         "success": True,
-        "total_products": len(erp_products_store),
-        "products": erp_products_store
+        "erp_version": snapshot.version,
+        "total_products": len(snapshot.products),
+        "products": dict(snapshot.products)
     }
 
 
@@ -7433,10 +9325,12 @@ async def get_current_bom():
     
     **Use Case:** ERPNext verifies BOM data in MRP system.
     """
+    snapshot = await asyncio.to_thread(get_erp_snapshot)
     return {
         "success": True,
-        "total_boms": len(erp_bom_store),
-        "boms": erp_bom_store
+        "erp_version": snapshot.version,
+        "total_boms": len(snapshot.bom),
+        "boms": dict(snapshot.bom)
     }
 
 
@@ -7447,47 +9341,74 @@ async def get_current_procurement_params():
     
     **Use Case:** ERPNext verifies procurement parameters in MRP system.
     """
+    snapshot = await asyncio.to_thread(get_erp_snapshot)
     return {
         "success": True,
-        "total_items": len(erp_procurement_params_store),
-        "parameters": erp_procurement_params_store
+        "erp_version": snapshot.version,
+        "total_items": len(snapshot.procurement_params),
+        "parameters": dict(snapshot.procurement_params)
     }
 
 
 @api_app.get("/api/v1/sync/history", tags=["ERP Integration"])
-async def get_sync_history(limit: int = 50):
+async def get_sync_history(
+    limit: int = Query(50, ge=1, le=SYNC_AUDIT_MAX_PAGE),
+    type: Optional[str] = None,
+    source: Optional[str] = None,
+    request_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    before_id: Optional[int] = None
+):
     """
     Get history of sync operations.
     
     **Use Case:** Audit trail for troubleshooting integration issues.
     
     **Query Parameters:**
-    - `limit`: Maximum number of records to return (default: 50)
+    - `limit`: Maximum number of records to return (default: 50, max: 1000)
+    - `type`: Only this sync type, e.g. `inventory_sync`, `bom_bulk_sync`
+    - `source`: Only syncs from this source, e.g. `erpnext`
+    - `request_id`: Only the entries of this request
+    - `since` / `until`: ISO datetimes bounding when the sync was recorded
+    - `before_id`: Page to older entries; pass the previous response's `next_before_id`
+    
+    Entries are returned oldest first, newest page first. History is kept for
+    90 days, up to the newest 100,000 entries.
     """
+    try:
+        since_ts = datetime.fromisoformat(since).timestamp() if since else None
+        until_ts = datetime.fromisoformat(until).timestamp() if until else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid since/until datetime: {e}")
+    
+    total, history = await asyncio.to_thread(
+        get_sync_audit_log().query, entry_type=type, source=source, request_id=request_id,
+        since=since_ts, until=until_ts, before_id=before_id, limit=limit)
+    
     return {
         "success": True,
-        "total_records": len(sync_history),
-        "showing": min(limit, len(sync_history)),
-        "history": sync_history[-limit:]  # Return most recent
+        "total_records": total,
+        "showing": len(history),
+        "history": history,
+        "next_before_id": history[0]["id"] if len(history) == limit else None
     }
 
 
 @api_app.delete("/api/v1/sync/clear-all", tags=["ERP Integration"])
 async def clear_all_synced_data():
     """
-    Clear all synced data from memory.
+    Clear all synced data from the ERP store and memory.
     
     **Use Case:** Reset system for fresh sync from ERP.
     
     **Warning:** This will delete all inventory, forecasts, products, BOMs, and procurement params!
     """
-    erp_inventory_store.clear()
-    erp_forecast_overrides.clear()
-    erp_products_store.clear()
-    erp_bom_store.clear()
-    erp_procurement_params_store.clear()
+    # Publishes an empty ERP version; running jobs keep reporting the version they started at
+    await asyncio.to_thread(get_erp_store().clear)
+    await asyncio.to_thread(get_state_backend().delete, FORECAST_OVERRIDES_NAMESPACE)
     
-    sync_history.append({
+    await asyncio.to_thread(get_sync_audit_log().record, {
         "type": "clear_all",
         "timestamp": datetime.now().isoformat(),
         "message": "All synced data cleared"
@@ -8396,18 +10317,49 @@ st.markdown("""
 # ==============================================================================
 # SESSION STATE INITIALIZATION
 # ==============================================================================
-if "excel_buffer" not in st.session_state:
-    st.session_state.excel_buffer = None
+if "forecast_result" not in st.session_state:
+    st.session_state.forecast_result = None
     st.session_state.filename = None
     st.session_state.drive_file_id = None
     st.session_state.file_downloaded = False
-    st.session_state.bom_excel_buffer = None
+    st.session_state.bom_analysis = None
     st.session_state.bom_filename = None
     st.session_state.bom_analysis_complete = False
     st.session_state.bom_sheets_url = None
     st.session_state.show_onboarding = True
     st.session_state.last_forecast_time = None
     st.session_state.last_bom_time = None
+    st.session_state.forecast_publish_job = None
+    st.session_state.bom_publish_job = None
+
+
+def _publish_status_caption(job):
+    if job is None:
+        return
+    if job.done:
+        st.caption(f"Cloud publish: {job.describe()}")
+    else:
+        st.caption(f"📤 Publishing in background... {job.describe()}")
+
+
+@st.fragment(run_every=3)
+def render_forecast_cloud_link(show_unavailable=False):
+    """Google Sheets link for the forecast workbook, shown once the background Drive upload lands."""
+    job = st.session_state.forecast_publish_job
+    if job is not None and job.drive_file_id:
+        st.session_state.drive_file_id = job.drive_file_id
+
+    if st.session_state.drive_file_id:
+        sheets_link = f"https://docs.google.com/spreadsheets/d/{st.session_state.drive_file_id}/edit"
+        st.markdown(f'<a href="{sheets_link}" target="_blank" class="neural-btn">☁️ GOOGLE SHEETS</a>', unsafe_allow_html=True)
+    elif show_unavailable:
+        st.markdown('<div class="neural-btn" style="opacity: 0.5;">☁️ Not Available</div>', unsafe_allow_html=True)
+    _publish_status_caption(job)
+
+
+@st.fragment(run_every=3)
+def render_bom_publish_status():
+    _publish_status_caption(st.session_state.bom_publish_job)
 
 # ==============================================================================
 # SIDEBAR
@@ -8641,7 +10593,7 @@ with tab1:
                         steps_container.empty()
                         st.stop()
                     
-                    excel_buffer, filename, drive_file_id = result
+                    forecast_result, filename, publish_job = result
                     
                 except Exception as e:
                     import traceback
@@ -8669,10 +10621,11 @@ with tab1:
                 steps_container.empty()
                 
                 # Store results
-                if excel_buffer:
-                    st.session_state.excel_buffer = excel_buffer
+                if forecast_result:
+                    st.session_state.forecast_result = forecast_result
                     st.session_state.filename = filename
-                    st.session_state.drive_file_id = drive_file_id
+                    st.session_state.drive_file_id = None
+                    st.session_state.forecast_publish_job = publish_job
                     
                     end_time = time.time()
                     duration_sec = end_time - start_time
@@ -8692,7 +10645,7 @@ with tab1:
                         st.error("❌ Forecast Analysis Failed. Please try again.")
     
     # Show quick access if results exist
-    if st.session_state.excel_buffer:
+    if st.session_state.forecast_result:
         st.markdown("""
             <div class="holo-card" style="margin-top: 1rem;">
                 <h3 class="section-title" style="font-size: 1.3rem;">
@@ -8707,16 +10660,14 @@ with tab1:
         with col1:
             st.download_button(
                 label="📥 DOWNLOAD EXCEL",
-                data=st.session_state.excel_buffer.getvalue(),
+                data=st.session_state.forecast_result.excel_bytes,
                 file_name=st.session_state.filename,
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True
             )
         
         with col2:
-            if st.session_state.drive_file_id:
-                sheets_link = f"https://docs.google.com/spreadsheets/d/{st.session_state.drive_file_id}/edit"
-                st.markdown(f'<a href="{sheets_link}" target="_blank" class="neural-btn">☁️ GOOGLE SHEETS</a>', unsafe_allow_html=True)
+            render_forecast_cloud_link()
         
         with col3:
             looker_url = "https://lookerstudio.google.com/reporting/9525ae1e-6f0e-4b5f-ae50-ca84312b76fd/page/br5SF"
@@ -8820,7 +10771,7 @@ with tab2:
                         bom_steps_container.empty()
                         st.stop()
                     
-                    bom_excel_buffer, bom_filename = bom_result
+                    bom_analysis, bom_filename, bom_publish_job = bom_result
                     
                 except Exception as e:
                     import traceback
@@ -8848,9 +10799,10 @@ with tab2:
                 bom_steps_container.empty()
                 
                 # Store results
-                if bom_excel_buffer:
-                    st.session_state.bom_excel_buffer = bom_excel_buffer
+                if bom_analysis:
+                    st.session_state.bom_analysis = bom_analysis
                     st.session_state.bom_filename = bom_filename
+                    st.session_state.bom_publish_job = bom_publish_job
                     st.session_state.bom_analysis_complete = True
                     st.session_state.bom_sheets_url = "https://docs.google.com/spreadsheets/d/1_wXJDNZeZ7Y31S_i3UUDQ89vCbJC-xotm3wADBSf5eY"
                     
@@ -8872,7 +10824,7 @@ with tab2:
                         st.error("❌ BOM Analysis Failed. Please try again.")
     
     # Show quick access if results exist
-    if st.session_state.bom_analysis_complete and st.session_state.bom_excel_buffer:
+    if st.session_state.bom_analysis_complete and st.session_state.bom_analysis:
         st.markdown("""
             <div class="holo-card" style="margin-top: 1rem;">
                 <h3 class="section-title" style="font-size: 1.3rem;">
@@ -8887,7 +10839,7 @@ with tab2:
         with bom_col1:
             st.download_button(
                 label="📥 DOWNLOAD BOM WORKBOOK",
-                data=st.session_state.bom_excel_buffer.getvalue(),
+                data=st.session_state.bom_analysis.excel_bytes,
                 file_name=st.session_state.bom_filename,
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True
@@ -8896,6 +10848,7 @@ with tab2:
         with bom_col2:
             bom_sheets_url = "https://docs.google.com/spreadsheets/d/1izbZowu4FEiwiVwKWIiRz066aWWOII5u"
             st.markdown(f'<a href="{bom_sheets_url}" target="_blank" class="neural-btn">☁️ BOM SHEETS</a>', unsafe_allow_html=True)
+            render_bom_publish_status()
         
         with bom_col3:
             bom_looker_url = "https://lookerstudio.google.com/reporting/9525ae1e-6f0e-4b5f-ae50-ca84312b76fd/page/p_xsi76rd4yd"
@@ -8928,7 +10881,7 @@ with tab3:
         </div>
     """, unsafe_allow_html=True)
     
-    if st.session_state.excel_buffer:
+    if st.session_state.forecast_result:
         last_time = st.session_state.last_forecast_time or "N/A"
         st.info(f"📅 Last Generated: **{last_time}**")
         
@@ -8937,7 +10890,7 @@ with tab3:
         with col1:
             st.download_button(
                 label="📥 DOWNLOAD EXCEL WORKBOOK",
-                data=st.session_state.excel_buffer.getvalue(),
+                data=st.session_state.forecast_result.excel_bytes,
                 file_name=st.session_state.filename,
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True,
@@ -8945,11 +10898,7 @@ with tab3:
             )
         
         with col2:
-            if st.session_state.drive_file_id:
-                sheets_link = f"https://docs.google.com/spreadsheets/d/{st.session_state.drive_file_id}/edit"
-                st.markdown(f'<a href="{sheets_link}" target="_blank" class="neural-btn">☁️ GOOGLE SHEETS</a>', unsafe_allow_html=True)
-            else:
-                st.markdown('<div class="neural-btn" style="opacity: 0.5;">☁️ Not Available</div>', unsafe_allow_html=True)
+            render_forecast_cloud_link(show_unavailable=True)
         
         with col3:
             looker_url = "https://lookerstudio.google.com/reporting/9525ae1e-6f0e-4b5f-ae50-ca84312b76fd/page/br5SF"
@@ -8969,7 +10918,7 @@ with tab3:
         </div>
     """, unsafe_allow_html=True)
     
-    if st.session_state.bom_analysis_complete and st.session_state.bom_excel_buffer:
+    if st.session_state.bom_analysis_complete and st.session_state.bom_analysis:
         last_bom_time = st.session_state.last_bom_time or "N/A"
         st.info(f"📅 Last Generated: **{last_bom_time}**")
         
@@ -8978,7 +10927,7 @@ with tab3:
         with col1:
             st.download_button(
                 label="📥 DOWNLOAD BOM WORKBOOK",
-                data=st.session_state.bom_excel_buffer.getvalue(),
+                data=st.session_state.bom_analysis.excel_bytes,
                 file_name=st.session_state.bom_filename,
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True,
@@ -8988,6 +10937,7 @@ with tab3:
         with col2:
             bom_sheets_url = "https://docs.google.com/spreadsheets/d/1izbZowu4FEiwiVwKWIiRz066aWWOII5u"
             st.markdown(f'<a href="{bom_sheets_url}" target="_blank" class="neural-btn">☁️ BOM SHEETS</a>', unsafe_allow_html=True)
+            render_bom_publish_status()
         
         with col3:
             bom_looker_url = "https://lookerstudio.google.com/reporting/9525ae1e-6f0e-4b5f-ae50-ca84312b76fd/page/p_xsi76rd4yd"
@@ -9023,11 +10973,19 @@ if __name__ == "__main__":
     import sys
     
     if "--api" in sys.argv:
-        # Run FastAPI server
-        print("🚀 Starting API Server...")
+        # Run FastAPI server; every worker shares jobs, ERP data and state (see STATE BACKEND)
+        workers = int(os.environ.get("HG_API_WORKERS", "1"))
+        print(f"🚀 Starting API Server ({workers} worker(s))...")
+        if workers > 1:
+            print(f"   BOM job limits are per worker: up to {workers * BOM_JOB_WORKERS} jobs run at once")
         print("📖 API Documentation: http://localhost:8000/api/docs")
         import uvicorn
-        uvicorn.run(api_app, host="0.0.0.0", port=8000)
+        if workers > 1:
+            # Multiple workers need an import string so each can load the app itself
+            module_name = os.path.splitext(os.path.basename(__file__))[0]
+            uvicorn.run(f"{module_name}:api_app", host="0.0.0.0", port=8000, workers=workers)
+        else:
+            uvicorn.run(api_app, host="0.0.0.0", port=8000)
     else:
         # Streamlit runs automatically when executed with `streamlit run`
         print("ℹ️  To run API server, use: python main_app.py --api")